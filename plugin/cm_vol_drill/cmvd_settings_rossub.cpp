@@ -1,6 +1,7 @@
 #include "cmvd_settings_rossub.h"
 #include <ambf_server/RosComBase.h>
 #include <std_msgs/Bool.h>
+#include <std_msgs/String.h>
 #include <geometry_msgs/PoseStamped.h>
 #include <eigen3/Eigen/Geometry>
 
@@ -22,7 +23,10 @@ CMVDSettingsSub::CMVDSettingsSub(string a_namespace, string a_plugin)
     sub_initToolCursors = m_rosNode->subscribe<std_msgs::Bool>(a_namespace + "/" + a_plugin + "/initToolCursors", 1, &CMVDSettingsSub::callback_initToolCursors, this);
     sub_resetVoxels = m_rosNode->subscribe<std_msgs::Bool>(a_namespace + "/" + a_plugin + "/resetVoxels", 1, &CMVDSettingsSub::callback_resetVoxels, this);
     sub_setBurrOn = m_rosNode->subscribe<std_msgs::Bool>(a_namespace + "/" + a_plugin + "/setBurrOn", 1, &CMVDSettingsSub::callback_setBurrOn, this);
+    sub_saveCheckpoint = m_rosNode->subscribe<std_msgs::String>(a_namespace + "/" + a_plugin + "/saveCheckpoint", 1, &CMVDSettingsSub::callback_saveCheckpoint, this);
+    sub_restoreCheckpoint = m_rosNode->subscribe<std_msgs::String>(a_namespace + "/" + a_plugin + "/restoreCheckpoint", 1, &CMVDSettingsSub::callback_restoreCheckpoint, this);
     pub_anatomy_pose = m_rosNode->advertise<geometry_msgs::PoseStamped>(a_namespace + "/" + a_plugin + "/anatomy_pose", 1, true);
+    pub_checkpoint_status = m_rosNode->advertise<std_msgs::String>(a_namespace + "/" + a_plugin + "/checkpoint_status", 10);
 }
 
 CMVDSettingsSub::~CMVDSettingsSub()
@@ -35,6 +39,8 @@ CMVDSettingsSub::~CMVDSettingsSub()
     sub_initToolCursors.shutdown();
     sub_resetVoxels.shutdown();
     sub_setBurrOn.shutdown();
+    sub_saveCheckpoint.shutdown();
+    sub_restoreCheckpoint.shutdown();
 }
 
 void CMVDSettingsSub::callback_setShowToolCursors(std_msgs::Bool msg)
@@ -83,6 +89,26 @@ void CMVDSettingsSub::callback_setBurrOn(std_msgs::Bool msg)
     setBurrOn_last_val = msg.data;
 }
 
+// checkpoints are written and read by the plugin, the paths are on the simulator's machine
+void CMVDSettingsSub::callback_saveCheckpoint(std_msgs::String msg)
+{
+    saveCheckpoint_changed = true;
+    saveCheckpoint_last_val = msg.data;
+}
+
+void CMVDSettingsSub::callback_restoreCheckpoint(std_msgs::String msg)
+{
+    restoreCheckpoint_changed = true;
+    restoreCheckpoint_last_val = msg.data;
+}
+
+void CMVDSettingsSub::publish_checkpoint_status(std::string status)
+{
+    std_msgs::String msg;
+    msg.data = status;
+    pub_checkpoint_status.publish(msg);
+}
+
 void CMVDSettingsSub::publish_anatomy_pose(chai3d::cTransform transform, double m_to_ambf_unit)
 {
     geometry_msgs::PoseStamped msg;
@@ -4,6 +4,7 @@
 #include "ros/ros.h"
 #include <string>
 #include <std_msgs/Bool.h>
+#include <std_msgs/String.h>
 #include <afFramework.h>
 
 class CMVDSettingsSub
@@ -21,7 +22,10 @@ public:
     void callback_initToolCursors(std_msgs::Bool msg);
     void callback_resetVoxels(std_msgs::Bool msg);
     void callback_setBurrOn(std_msgs::Bool msg);
+    void callback_saveCheckpoint(std_msgs::String msg);
+    void callback_restoreCheckpoint(std_msgs::String msg);
     void publish_anatomy_pose(chai3d::cTransform transform, double m_to_ambf_unit=1.0);
+    void publish_checkpoint_status(std::string status);
 
     bool setShowToolCursors_changed = false;
     bool setDrillControlMode_changed = false;
@@ -31,6 +35,8 @@ public:
     bool initToolCursors_changed = false;
     bool resetVoxels_changed = false;
     bool setBurrOn_changed = false;
+    bool saveCheckpoint_changed = false;
+    bool restoreCheckpoint_changed = false;
 
     bool setShowToolCursors_last_val;
     bool setDrillControlMode_last_val;
@@ -38,6 +44,8 @@ public:
     bool setCableControlMode_last_val;
     bool setPhysicsPaused_last_val;
     bool setBurrOn_last_val;
+    std::string saveCheckpoint_last_val;
+    std::string restoreCheckpoint_last_val;
 
 private:
     ros::Subscriber sub_setShowToolCursors;
@@ -48,7 +56,10 @@ private:
     ros::Subscriber sub_initToolCursors;
     ros::Subscriber sub_resetVoxels;
     ros::Subscriber sub_setBurrOn;
+    ros::Subscriber sub_saveCheckpoint;
+    ros::Subscriber sub_restoreCheckpoint;
     ros::Publisher pub_anatomy_pose;
+    ros::Publisher pub_checkpoint_status;
 
 };
 
@@ -1,27 +1,94 @@
 #include "collision_publisher.h"
 #include <ambf_server/RosComBase.h>
+#include <cstring>
+#include <sensor_msgs/PointField.h>
+#include <diagnostic_msgs/KeyValue.h>
+#include <sstream>
+#include <iomanip>
 
 using namespace std;
 
-DrillingPublisher::DrillingPublisher(string a_namespace, string a_plugin){
-    init(a_namespace, a_plugin);
+// bytes per point of voxels_removed_batch: 3 x int32 index, 4 x uint8 color
+static const uint32_t VOXEL_BATCH_POINT_STEP = 16;
+// one tick removes up to m_removalCount (150) voxels, predrilling thousands at once
+static const size_t VOXEL_BATCH_RESERVE = 1024;
+// frame_id of the batches that start from a reset volume, see voxel_stream.py
+static const char *VOXEL_BATCH_RESET_FRAME = "volume_reset";
+
+DrillingPublisher::DrillingPublisher(string a_namespace, string a_plugin, bool a_legacyVoxelTopic){
+    init(a_namespace, a_plugin, a_legacyVoxelTopic);
 }
 
 DrillingPublisher::~DrillingPublisher(){
-    m_voxelsRemovedPub.shutdown();
+    if (m_legacyVoxelTopic){
+        m_voxelsRemovedPub.shutdown();
+    }
+    m_voxelsRemovedBatchPub.shutdown();
     m_burrChangePub.shutdown();
     m_volumePropPub.shutdown();
+    m_diagnosticsPub.shutdown();
 }
 
-void DrillingPublisher::init(string a_namespace, string a_plugin){
+void DrillingPublisher::init(string a_namespace, string a_plugin, bool a_legacyVoxelTopic){
     m_rosNode = afROSNode::getNode();
+    m_legacyVoxelTopic = a_legacyVoxelTopic;
 
-    m_voxelsRemovedPub = m_rosNode-> advertise<vdrilling_msgs::points>(a_namespace + "/" + a_plugin + "/voxels_removed", 1);
+    if (m_legacyVoxelTopic){
+        m_voxelsRemovedPub = m_rosNode-> advertise<vdrilling_msgs::points>(a_namespace + "/" + a_plugin + "/voxels_removed", 1);
+    }
+    // deeper queue, a subscriber that falls behind a few ticks still gets every removal
+    m_voxelsRemovedBatchPub = m_rosNode-> advertise<sensor_msgs::PointCloud2>(a_namespace + "/" + a_plugin + "/voxels_removed_batch", 100);
     m_burrChangePub = m_rosNode -> advertise<vdrilling_msgs::UInt8Stamped>(a_namespace + "/" + a_plugin + "/burr_change", 1, true);
     m_volumePropPub = m_rosNode -> advertise<vdrilling_msgs::VolumeProp>(a_namespace + "/" + a_plugin + "/volume_prop", 1, true);
+    m_diagnosticsPub = m_rosNode -> advertise<diagnostic_msgs::DiagnosticArray>("/diagnostics", 1);
+    m_diagnosticsName = a_plugin + " physicsUpdate";
+
+    // layout of the batch message is fixed, only width, row_step and data change per tick
+    const char* names[7] = {"x", "y", "z", "r", "g", "b", "a"};
+    voxel_batch_msg.fields.resize(7);
+    for (int i = 0; i < 7; i++){
+        sensor_msgs::PointField &field = voxel_batch_msg.fields[i];
+        field.name = names[i];
+        field.offset = i < 3 ? 4 * i : 12 + (i - 3);
+        field.datatype = i < 3 ? sensor_msgs::PointField::INT32 : sensor_msgs::PointField::UINT8;
+        field.count = 1;
+    }
+    voxel_batch_msg.height = 1;
+    voxel_batch_msg.is_bigendian = false;
+    voxel_batch_msg.is_dense = true;
+    voxel_batch_msg.point_step = VOXEL_BATCH_POINT_STEP;
+    m_voxelBatch.reserve(VOXEL_BATCH_RESERVE * VOXEL_BATCH_POINT_STEP);
+}
+
+void DrillingPublisher::queueVoxelRemoved(double vray[3], unsigned char vcolor[4]){
+    size_t offset = m_voxelBatch.size();
+    m_voxelBatch.resize(offset + VOXEL_BATCH_POINT_STEP);
+    uint8_t* point = &m_voxelBatch[offset];
+    int32_t index[3] = {int32_t(vray[0]), int32_t(vray[1]), int32_t(vray[2])};
+    memcpy(point, index, sizeof(index));
+    memcpy(point + 12, vcolor, 4);
+}
+
+void DrillingPublisher::flushVoxelsRemoved(double time, bool a_reset){
+    if (m_voxelBatch.empty() && !a_reset){
+        return;
+    }
+    uint32_t count = m_voxelBatch.size() / VOXEL_BATCH_POINT_STEP;
+    voxel_batch_msg.header.stamp.fromSec(time);
+    voxel_batch_msg.header.frame_id = a_reset ? VOXEL_BATCH_RESET_FRAME : "";
+    voxel_batch_msg.width = count;
+    voxel_batch_msg.row_step = count * VOXEL_BATCH_POINT_STEP;
+    // swap instead of copy, the batch buffer keeps the capacity of the message data
+    voxel_batch_msg.data.swap(m_voxelBatch);
+    m_voxelsRemovedBatchPub.publish(voxel_batch_msg);
+    m_voxelBatch.swap(voxel_batch_msg.data);
+    m_voxelBatch.clear();
 }
 
 void DrillingPublisher::voxelsRemoved(double vray[3], float vcolor[4], double time){
+    if (!m_legacyVoxelTopic){
+        return;
+    }
     voxel_msg.header.stamp.fromSec(time);
 
     std::vector<float> vec(vcolor, vcolor + 4);
@@ -50,3 +117,42 @@ void DrillingPublisher::volumeProp(float dimensions[3], int voxelCount[3]){
 
     m_volumePropPub.publish(volume_msg);
 }
+
+static void addDiagnosticValue(diagnostic_msgs::DiagnosticStatus &status, const string &key, double value, int precision){
+    diagnostic_msgs::KeyValue kv;
+    kv.key = key;
+    ostringstream ss;
+    ss << fixed << setprecision(precision) << value;
+    kv.value = ss.str();
+    status.values.push_back(kv);
+}
+
+void DrillingPublisher::physicsProfile(const PhysicsProfiler &profiler, double window){
+    diagnostic_msgs::DiagnosticStatus status;
+    status.name = m_diagnosticsName;
+    status.hardware_id = "ambf";
+    // ticks that took longer than their dt keep the simulation from running in real time
+    status.level = profiler.overruns() ? diagnostic_msgs::DiagnosticStatus::WARN : diagnostic_msgs::DiagnosticStatus::OK;
+    ostringstream message;
+    message << fixed << setprecision(0) << profiler.ticks() / window << " Hz, " << profiler.overruns() << " ticks over dt, "
+            << setprecision(2) << profiler.simTime() / window << "x real time";
+    status.message = message.str();
+    addDiagnosticValue(status, "window (s)", window, 3);
+    addDiagnosticValue(status, "ticks", profiler.ticks(), 0);
+    addDiagnosticValue(status, "overruns", profiler.overruns(), 0);
+    addDiagnosticValue(status, "voxels removed", profiler.voxelsRemoved(), 0);
+    addDiagnosticValue(status, "contacts", profiler.contacts(), 0);
+    for (int i = 0; i < PHYSICS_STAT_COUNT; i++){
+        const DurationStats &stats = profiler.stats(PhysicsStat(i));
+        string name = PHYSICS_STAT_NAMES[i];
+        addDiagnosticValue(status, name + " count", stats.count(), 0);
+        addDiagnosticValue(status, name + " total (ms)", stats.total() * 1e3, 4);
+        addDiagnosticValue(status, name + " mean (ms)", stats.mean() * 1e3, 4);
+        addDiagnosticValue(status, name + " p99 (ms)", stats.percentile(99) * 1e3, 4);
+        addDiagnosticValue(status, name + " max (ms)", stats.max() * 1e3, 4);
+    }
+    diagnostic_msgs::DiagnosticArray msg;
+    msg.header.stamp = ros::Time::now();
+    msg.status.push_back(status);
+    m_diagnosticsPub.publish(msg);
+}
@@ -3,26 +3,47 @@
 
 #include "ros/ros.h"
 #include <string>
+#include <vector>
+#include <sensor_msgs/PointCloud2.h>
+#include <diagnostic_msgs/DiagnosticArray.h>
 #include <vdrilling_msgs/points.h>
 #include <vdrilling_msgs/UInt8Stamped.h>
 #include <vdrilling_msgs/VolumeProp.h>
+#include "physics_profiler.h"
 
 
 class DrillingPublisher{
 public:
-    DrillingPublisher(std::string a_namespace, std::string a_plugin);
+    DrillingPublisher(std::string a_namespace, std::string a_plugin, bool a_legacyVoxelTopic = false);
     ~DrillingPublisher();
-    void init(std::string a_namespace, std::string a_plugin);
+    void init(std::string a_namespace, std::string a_plugin, bool a_legacyVoxelTopic = false);
     ros::NodeHandle* m_rosNode;
 
+    // Removed voxels are queued and published once per physics tick as one PointCloud2 on voxels_removed_batch
+    // (int32 x, y, z voxel indices and uint8 r, g, b, a colors per point, header stamp = sim time)
+    void queueVoxelRemoved(double vray[3], unsigned char vcolor[4]);
+    // a_reset: the volume was reset to its state as loaded before the queued voxels were removed (resetVoxels,
+    // checkpoint restore), sent with frame_id VOXEL_BATCH_RESET_FRAME even if no voxel is queued
+    void flushVoxelsRemoved(double time, bool a_reset = false);
+    // One vdrilling_msgs::points per voxel on voxels_removed, only if enabled with a_legacyVoxelTopic
     void voxelsRemoved(double ray[3], float vcolor[4], double time);
+    bool legacyVoxelTopic(){ return m_legacyVoxelTopic; }
     void burrChange(int burrSize, double time);
     void volumeProp(float dimensions[3], int voxelCount[3]);
+    // Timing of the physicsUpdate phases over the last window (wall clock seconds) on /diagnostics
+    void physicsProfile(const PhysicsProfiler &profiler, double window);
 private:
     ros::Publisher m_voxelsRemovedPub;
+    ros::Publisher m_voxelsRemovedBatchPub;
     ros::Publisher m_burrChangePub;
     ros::Publisher m_volumePropPub;
+    ros::Publisher m_diagnosticsPub;
+    std::string m_diagnosticsName;
     vdrilling_msgs::points voxel_msg;
+    sensor_msgs::PointCloud2 voxel_batch_msg;
+    bool m_legacyVoxelTopic;
+    // packed points of the current tick, see VOXEL_BATCH_POINT_STEP
+    std::vector<uint8_t> m_voxelBatch;
     vdrilling_msgs::UInt8Stamped burr_msg;
     vdrilling_msgs::VolumeProp volume_msg;
 
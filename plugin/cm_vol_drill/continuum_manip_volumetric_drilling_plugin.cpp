@@ -54,6 +54,7 @@
 
 #include <boost/program_options.hpp>
 #include <fstream>
+#include <cstring>
 
 //==============================================================================
 
@@ -78,27 +79,37 @@ void afVolmetricDrillingPlugin::graphicsUpdate()
 /// @param dt time step (in seconds) since last call
 void afVolmetricDrillingPlugin::physicsUpdate(double dt)
 {
-    checkForSettingsUpdate();
-
-    m_worldPtr->getChaiWorld()->computeGlobalPositions(true);
+    PhysicsProfiler::Clock::time_point tick_start = PhysicsProfiler::now();
+    {
+        ScopedPhysicsTimer timer(m_physicsProfiler, PHYSICS_SETTINGS);
+        checkForSettingsUpdate();
+    }
 
-    if (m_CM_moved_by_other) // i.e. if the CM is not being moved by keyboard / device, but is attached to another AMBF body
     {
-        T_contmanip_base = m_contManipBaseRigidBody->getLocalTransform(); // let's find out where it is now
+        ScopedPhysicsTimer timer(m_physicsProfiler, PHYSICS_GLOBAL_POSITIONS);
+        m_worldPtr->getChaiWorld()->computeGlobalPositions(true);
     }
-    else
-    {                                                                                          // i.e. if the CM is being moved 'manually' using this plugin e.g. by keyboard / device
-        if (!cTransformAlmostEqual(m_contManipBaseRigidBody->getLocalTransform(), T_contmanip_base)) // update CM for commanded movements
+
+    {
+        ScopedPhysicsTimer timer(m_physicsProfiler, PHYSICS_CURSOR_POSES);
+        if (m_CM_moved_by_other) // i.e. if the CM is not being moved by keyboard / device, but is attached to another AMBF body
         {
-            cTransform T_newContManipBase;
-            T_newContManipBase.setLocalPos(T_contmanip_base.getLocalPos());
-            T_newContManipBase.setLocalRot(T_contmanip_base.getLocalRot());
-            T_newContManipBase = T_newContManipBase * to_cTransform(m_contManipBaseRigidBody->getInertialOffsetTransform()); // handle offset due to fact that origin is not at center of body
-            m_contManipBaseRigidBody->setLocalTransform(T_newContManipBase);
+            T_contmanip_base = m_contManipBaseRigidBody->getLocalTransform(); // let's find out where it is now
+        }
+        else
+        {                                                                                              // i.e. if the CM is being moved 'manually' using this plugin e.g. by keyboard / device
+            if (!cTransformAlmostEqual(m_contManipBaseRigidBody->getLocalTransform(), T_contmanip_base)) // update CM for commanded movements
+            {
+                cTransform T_newContManipBase;
+                T_newContManipBase.setLocalPos(T_contmanip_base.getLocalPos());
+                T_newContManipBase.setLocalRot(T_contmanip_base.getLocalRot());
+                T_newContManipBase = T_newContManipBase * to_cTransform(m_contManipBaseRigidBody->getInertialOffsetTransform()); // handle offset due to fact that origin is not at center of body
+                m_contManipBaseRigidBody->setLocalTransform(T_newContManipBase);
+            }
         }
-    }
 
-    toolCursorsPosUpdate(T_contmanip_base);
+        toolCursorsPosUpdate(T_contmanip_base);
+    }
 
     if (m_volume_collisions_enabled)
     {
@@ -107,6 +118,7 @@ void afVolmetricDrillingPlugin::physicsUpdate(double dt)
         // Drilling Behavior
         if (m_burrOn && burr_cursor->isInContact(m_voxelObj))
         {
+            ScopedPhysicsTimer timer(m_physicsProfiler, PHYSICS_VOXEL_REMOVAL);
             // find the color of the voxel that is in contact with the burr
             cCollisionEvent *contact = burr_cursor->m_hapticPoint->getCollisionEvent(0);
             cVector3d voxel_idx(contact->m_voxelIndexX, contact->m_voxelIndexY, contact->m_voxelIndexZ);
@@ -117,33 +129,45 @@ void afVolmetricDrillingPlugin::physicsUpdate(double dt)
                 // removalCount specifies the max number of contacted voxels that can be removed in a single iteration
                 // [TODO]: make this parameter more easily accessible
                 int removalCount = cMin(m_removalCount, (int)contact->m_events.size());
+                int removed = 0;
+                PhysicsProfiler::Clock::time_point wait_start = PhysicsProfiler::now();
                 m_mutexVoxel.acquire();
+                m_physicsProfiler.add(PHYSICS_MUTEX_WAIT, PhysicsProfiler::since(wait_start));
                 for (int cIdx = 0; cIdx < removalCount; cIdx++)
                 {
                     cVector3d ct(contact->m_events[cIdx].m_voxelIndexX, contact->m_events[cIdx].m_voxelIndexY, contact->m_events[cIdx].m_voxelIndexZ);
                     if (m_hardness_behavior)
                     {
-                        m_voxel_hardnesses[uint(ct.x())][uint(ct.y())][uint(ct.z())] -= m_hardness_removal_rate;
-                        if (m_voxel_hardnesses[uint(ct.x())][uint(ct.y())][uint(ct.z())] > 0.0)
+                        float &hardness = m_voxel_hardnesses.at(uint(ct.x()), uint(ct.y()), uint(ct.z()));
+                        hardness -= m_hardness_removal_rate;
+                        if (hardness > 0.0)
                         {
                             continue; // skips removal
                         }
                     }
                     removeVoxel(ct);
+                    removed++;
                 }
                 m_mutexVoxel.release();
+                m_physicsProfiler.countContacts(removalCount);
+                m_physicsProfiler.countVoxelsRemoved(removed);
+                m_drillingPub->flushVoxelsRemoved(m_worldPtr->getSimulationTime());
                 m_flagMarkVolumeForUpdate = true;
             }
         }
 
         // Compute and Apply CM-to-volume interactions
-        for (auto &cursor_list : {m_shaftToolCursorList, m_segmentToolCursorList, m_burrToolCursorList})
         {
-            for (auto &cursor : cursor_list)
+            ScopedPhysicsTimer timer(m_physicsProfiler, PHYSICS_INTERACTION_FORCES);
+            for (auto &cursor_list : {m_shaftToolCursorList, m_segmentToolCursorList, m_burrToolCursorList})
             {
-                cursor->computeInteractionForces();
+                for (auto &cursor : cursor_list)
+                {
+                    cursor->computeInteractionForces();
+                }
             }
         }
+        ScopedPhysicsTimer timer(m_physicsProfiler, PHYSICS_IMPULSES);
         // Burr
         auto burr_impulse = calculate_impulse_from_tool_cursor_collision(m_burrToolCursorList[0], m_burrBody, dt);
         m_burrBody->m_bulletRigidBody->applyCentralImpulse(burr_impulse);
@@ -162,7 +186,17 @@ void afVolmetricDrillingPlugin::physicsUpdate(double dt)
     }
 
     // Compute and Apply CM cable forces
-    applyCablePull(dt);
+    {
+        ScopedPhysicsTimer timer(m_physicsProfiler, PHYSICS_CABLE_PULL);
+        applyCablePull(dt);
+    }
+
+    m_physicsProfiler.endTick(tick_start, dt);
+    if (m_physicsProfiler.windowElapsed(m_profilePeriod))
+    {
+        m_drillingPub->physicsProfile(m_physicsProfiler, m_physicsProfiler.windowSeconds());
+        m_physicsProfiler.reset();
+    }
 }
 
 /// @brief Remove a voxel from the volume
@@ -172,20 +206,25 @@ void afVolmetricDrillingPlugin::removeVoxel(cVector3d &pos)
 {
     cColorb colorb;
     m_voxelObj->m_texture->m_image->getVoxelColor(uint(pos.x()), uint(pos.y()), uint(pos.z()), colorb);
-    cColorf colorf = colorb.getColorf();
 
-    double sim_time = m_worldPtr->getSimulationTime();
     double voxel_array[3] = {pos.get(0), pos.get(1), pos.get(2)};
-
-    float color_array[4];
-    color_array[0] = colorf.getR();
-    color_array[1] = colorf.getG();
-    color_array[2] = colorf.getB();
-    color_array[3] = colorf.getA();
+    unsigned char color_bytes[4] = {colorb.getR(), colorb.getG(), colorb.getB(), colorb.getA()};
     m_voxelObj->m_texture->m_image->setVoxelColor(uint(pos.x()), uint(pos.y()), uint(pos.z()), m_zeroColor);
 
     m_volumeUpdate.enclose(cVector3d(uint(pos.x()), uint(pos.y()), uint(pos.z())));
-    m_drillingPub->voxelsRemoved(voxel_array, color_array, sim_time);
+    // published per tick by flushVoxelsRemoved
+    m_drillingPub->queueVoxelRemoved(voxel_array, color_bytes);
+
+    if (m_drillingPub->legacyVoxelTopic())
+    {
+        cColorf colorf = colorb.getColorf();
+        float color_array[4];
+        color_array[0] = colorf.getR();
+        color_array[1] = colorf.getG();
+        color_array[2] = colorf.getB();
+        color_array[3] = colorf.getA();
+        m_drillingPub->voxelsRemoved(voxel_array, color_array, m_worldPtr->getSimulationTime());
+    }
 }
 
 /// @brief initialize the plugin
@@ -207,7 +246,10 @@ int afVolmetricDrillingPlugin::init(int argc, char **argv, const afWorldPtr a_af
     cmd_opts.add_options()("base_body_name", p_opt::value<std::string>()->default_value("snake_stick"), "Name of body given in yaml. Default snake_stick");
     cmd_opts.add_options()("tool_body_name", p_opt::value<std::string>()->default_value("Burr"), "Name of body given in yaml. Default Burr");
     cmd_opts.add_options()("hardness_behavior", p_opt::value<std::string>()->default_value("0"), ". Turn on volume material hardness features. Default false");
-    cmd_opts.add_options()("hardness_spec_file", p_opt::value<std::string>()->default_value(""), ". Path to csv file with hardness specifications per voxel. Default empty. If hardness features set, but this not set, all hardness will be set to 1.0");
+    cmd_opts.add_options()("hardness_spec_file", p_opt::value<std::string>()->default_value(""), ". Path to binary (from generate_hardness_file_from_nrrd.py) or csv file with hardness specifications per voxel, format is detected automatically. Default empty. If hardness features set, but this not set, all hardness will be set to 1.0");
+    cmd_opts.add_options()("profile_period", p_opt::value<double>()->default_value(1.0), ". Seconds between physicsUpdate timing reports on /diagnostics, 0 disables them. Default 1.0");
+    cmd_opts.add_options()("legacy_voxel_topic", p_opt::value<std::string>()->default_value("0"), ". Also publish every removed voxel as its own message on voxels_removed (removals are always published per tick on voxels_removed_batch). Default false");
+    cmd_opts.add_options()("predrill_mask_file", p_opt::value<std::string>()->default_value(""), ". Path to a predrill mask from precompute_predrill_mask.py, removed instead of voxelizing --predrill_traj_file. Default empty");
     cmd_opts.add_options()("predrill_traj_file", p_opt::value<std::vector<std::string>>()->multitoken()->zero_tokens()->composing(), ". Path to csv file(s) with trajectory that will be predrilled. Default empty");
 
     // Parse command line options
@@ -225,6 +267,9 @@ int afVolmetricDrillingPlugin::init(int argc, char **argv, const afWorldPtr a_af
     std::string hardness_behavior = var_map["hardness_behavior"].as<std::string>();
     m_hardness_behavior = boost::lexical_cast<bool>(hardness_behavior);
     std::string hardness_spec_file = var_map["hardness_spec_file"].as<std::string>();
+    bool legacy_voxel_topic = boost::lexical_cast<bool>(var_map["legacy_voxel_topic"].as<std::string>());
+    m_profilePeriod = var_map["profile_period"].as<double>();
+    std::string predrill_mask_file = var_map["predrill_mask_file"].as<std::string>();
     std::vector<std::string> predrill_traj_files;
     if (var_map.count("predrill_traj_file"))
     {
@@ -284,7 +329,7 @@ int afVolmetricDrillingPlugin::init(int argc, char **argv, const afWorldPtr a_af
     T_contmanip_base = m_contManipBaseRigidBody->getLocalTransform();
 
     // Set up voxels_removed publisher
-    m_drillingPub = new DrillingPublisher("ambf", "volumetric_drilling");
+    m_drillingPub = new DrillingPublisher("ambf", "volumetric_drilling", legacy_voxel_topic);
 
     // Set up settings ros pub
     m_settingsPub = new CMVDSettingsSub("ambf", "volumetric_drilling");
@@ -311,7 +356,11 @@ int afVolmetricDrillingPlugin::init(int argc, char **argv, const afWorldPtr a_af
         }
     }
 
-    if (!predrill_traj_files.empty())
+    checkpointBaselineInit();
+
+    if (!predrill_mask_file.empty())
+        res = predrillMaskInit(predrill_mask_file);
+    else if (!predrill_traj_files.empty())
         res = predrillTrajInit(predrill_traj_files);
     if (res != 0)
     {
@@ -1094,6 +1143,7 @@ void afVolmetricDrillingPlugin::checkForSettingsUpdate(void)
     if (m_settingsPub->resetVoxels_changed)
     {
         m_volumeObject->reset();
+        m_drillingPub->flushVoxelsRemoved(m_worldPtr->getSimulationTime(), true);
         m_settingsPub->resetVoxels_changed = false;
     }
     if (m_settingsPub->setBurrOn_changed)
@@ -1101,125 +1151,685 @@ void afVolmetricDrillingPlugin::checkForSettingsUpdate(void)
         m_burrOn = m_settingsPub->setBurrOn_last_val;
         m_settingsPub->setBurrOn_changed = false;
     }
+    if (m_settingsPub->saveCheckpoint_changed)
+    {
+        m_settingsPub->saveCheckpoint_changed = false;
+        std::string file = m_settingsPub->saveCheckpoint_last_val;
+        m_settingsPub->publish_checkpoint_status((saveCheckpoint(file) == 0 ? "saved " : "failed ") + file);
+    }
+    if (m_settingsPub->restoreCheckpoint_changed)
+    {
+        m_settingsPub->restoreCheckpoint_changed = false;
+        std::string file = m_settingsPub->restoreCheckpoint_last_val;
+        m_settingsPub->publish_checkpoint_status((restoreCheckpoint(file) == 0 ? "restored " : "failed ") + file);
+    }
 }
 
 /// @brief  Initialize behavior for voxel hardnesses
-/// @param hardness_spec_file  CSV file containing hardness values for each voxel
+/// @param hardness_spec_file  Binary hardness file (see scripts/generate_hardness_file_from_nrrd.py) or legacy CSV file containing hardness values for each voxel
 /// @return 0 if successful, -1 if not
 int afVolmetricDrillingPlugin::hardnessBehaviorInit(const std::string &hardness_spec_file)
 {
     if (m_hardness_behavior)
     {
-        std::vector<std::vector<std::vector<double>>> forces(m_volumeObject->getVoxelCount().get(0), std::vector<std::vector<double>>(m_volumeObject->getVoxelCount().get(1), std::vector<double>(m_volumeObject->getVoxelCount().get(2), 1.0)));
+        m_hardness_dims[0] = m_volumeObject->getVoxelCount().get(0);
+        m_hardness_dims[1] = m_volumeObject->getVoxelCount().get(1);
+        m_hardness_dims[2] = m_volumeObject->getVoxelCount().get(2);
 
         if (hardness_spec_file == "")
         {
             std::cout << "[hardnessBehaviorInit]: No hardness spec file given, using default of 1.0" << std::endl;
-            m_voxel_hardnesses = forces;
+            m_voxel_hardnesses.init(m_hardness_dims, 1.0);
             return 0;
         }
 
-        std::ifstream file(hardness_spec_file);
+        std::ifstream file(hardness_spec_file, std::ios::binary);
         if (!file)
         {
             std::cout << "[hardnessBehaviorInit]: No such file: " << hardness_spec_file << std::endl;
             return -1;
         }
 
-        // read first line
-        std::string s;
-        if (!std::getline(file, s))
+        // detect the format from the leading magic bytes, anything else is treated as the legacy csv format
+        char magic[HARDNESS_FILE_MAGIC_SIZE] = {0};
+        file.read(magic, HARDNESS_FILE_MAGIC_SIZE);
+        file.close();
+        // stored values are offset by 0.5, air (stored as 0) is the background of the sparse volume
+        m_voxel_hardnesses.init(m_hardness_dims, 0.5);
+        int res;
+        if (std::memcmp(magic, HARDNESS_FILE_MAGIC, HARDNESS_FILE_MAGIC_SIZE) == 0)
         {
-            std::cout << "[hardnessBehaviorInit]: File appears to be empty: " << hardness_spec_file << std::endl;
-            return -1;
+            res = loadHardnessBinary(hardness_spec_file);
         }
-        std::istringstream ss(s);
-        std::vector<std::string> record;
-        while (ss)
+        else
         {
-            std::string s;
-            if (!getline(ss, s, ','))
-                break;
-            record.push_back(s);
+            res = loadHardnessCSV(hardness_spec_file);
         }
-        // see if first line is m_volumeObject->getVoxelCount().get(0), m_volumeObject->getVoxelCount().get(1), m_volumeObject->getVoxelCount().get(2)
-        if (record.size() != 3)
+        if (res == 0)
+        {
+            std::cout << "[hardnessBehaviorInit]: " << m_voxel_hardnesses.allocatedBricks() << " of " << m_voxel_hardnesses.gridSize()
+                      << " bricks allocated, " << m_voxel_hardnesses.memoryBytes() / 1024 << " KiB (dense: " << m_voxel_hardnesses.denseBytes() / 1024 << " KiB)" << std::endl;
+        }
+        return res;
+    }
+    return 0;
+}
+
+/// @brief  Load hardness values written in the binary format by generate_hardness_file_from_nrrd.py
+/// @param hardness_spec_file  Binary hardness file: fixed size header followed by a raw float32 or uint8 payload
+/// @return 0 if successful, -1 if not
+int afVolmetricDrillingPlugin::loadHardnessBinary(const std::string &hardness_spec_file)
+{
+    std::ifstream file(hardness_spec_file, std::ios::binary);
+    HardnessFileHeader header;
+    if (!file.read(reinterpret_cast<char *>(&header), sizeof(header)))
+    {
+        std::cout << "[hardnessBehaviorInit]: Could not read header of: " << hardness_spec_file << std::endl;
+        return -1;
+    }
+    if (header.version != HARDNESS_FILE_VERSION && header.version != HARDNESS_FILE_VERSION_BRICKS)
+    {
+        std::cout << "[hardnessBehaviorInit]: Unsupported hardness file version " << header.version << " in " << hardness_spec_file << std::endl;
+        return -1;
+    }
+    if (header.dims[0] != m_hardness_dims[0] || header.dims[1] != m_hardness_dims[1] || header.dims[2] != m_hardness_dims[2])
+    {
+        std::cout << "[hardnessBehaviorInit]: expected hardness spec size of " << m_hardness_dims[0] << ", " << m_hardness_dims[1] << ", " << m_hardness_dims[2] << " in " << hardness_spec_file << std::endl;
+        std::cout << "[hardnessBehaviorInit]: got " << header.dims[0] << ", " << header.dims[1] << ", " << header.dims[2] << std::endl;
+        return -1;
+    }
+    std::string axis_order(header.axis_order, strnlen(header.axis_order, sizeof(header.axis_order)));
+    std::cout << "[hardnessBehaviorInit]: Loading binary hardness file, axis order: " << axis_order << std::endl;
+
+    if (header.dtype != HARDNESS_DTYPE_FLOAT32 && header.dtype != HARDNESS_DTYPE_UINT8)
+    {
+        std::cout << "[hardnessBehaviorInit]: Unsupported hardness dtype " << header.dtype << " in " << hardness_spec_file << std::endl;
+        return -1;
+    }
+    file.seekg(HARDNESS_FILE_HEADER_SIZE);
+    if (header.version == HARDNESS_FILE_VERSION_BRICKS)
+    {
+        return loadHardnessBricks(file, header, hardness_spec_file);
+    }
+
+    // dense file: one bulk read per x plane, only non air voxels are stored in the sparse volume
+    size_t plane_voxels = m_hardness_dims[1] * m_hardness_dims[2];
+    size_t value_size = header.dtype == HARDNESS_DTYPE_FLOAT32 ? sizeof(float) : sizeof(uint8_t);
+    std::vector<char> plane(plane_voxels * value_size);
+    for (size_t i = 0; i < m_hardness_dims[0]; i++)
+    {
+        if (!file.read(plane.data(), plane.size()))
         {
-            std::cout << "[hardnessBehaviorInit]: expected hardness spec dimensionality of 3 in " << hardness_spec_file << std::endl;
+            std::cout << "[hardnessBehaviorInit]: File is truncated: " << hardness_spec_file << std::endl;
             return -1;
         }
-        if (std::stoi(record[0]) != m_volumeObject->getVoxelCount().get(0) || std::stoi(record[1]) != m_volumeObject->getVoxelCount().get(1) || std::stoi(record[2]) != m_volumeObject->getVoxelCount().get(2))
+        for (size_t v = 0; v < plane_voxels; v++)
+        {
+            float hardness;
+            if (header.dtype == HARDNESS_DTYPE_FLOAT32)
+            {
+                std::memcpy(&hardness, &plane[v * sizeof(float)], sizeof(float));
+            }
+            else
+            {
+                hardness = uint8_t(plane[v]) / 255.0f;
+            }
+            if (hardness != 0.0f)
+            {
+                m_voxel_hardnesses.at(i, v / m_hardness_dims[2], v % m_hardness_dims[2]) = hardness + 0.5f;
+            }
+        }
+    }
+    return 0;
+}
+
+/// @brief  Load the payload of a sparse brick hardness file (version 2), written by generate_hardness_file_from_nrrd.py -f bricks
+/// @param file  Stream positioned at the start of the payload
+/// @param header  Header of the file, already checked against the volume size
+/// @param hardness_spec_file  File name, for error messages
+/// @return 0 if successful, -1 if not
+int afVolmetricDrillingPlugin::loadHardnessBricks(std::ifstream &file, const HardnessFileHeader &header, const std::string &hardness_spec_file)
+{
+    uint32_t brick_shift = 0;
+    while ((1u << brick_shift) < header.brick_size)
+    {
+        brick_shift++;
+    }
+    if (header.brick_size == 0 || (1u << brick_shift) != header.brick_size)
+    {
+        std::cout << "[hardnessBehaviorInit]: Brick size must be a power of two, got " << header.brick_size << " in " << hardness_spec_file << std::endl;
+        return -1;
+    }
+    m_voxel_hardnesses.init(m_hardness_dims, 0.5, brick_shift);
+
+    std::vector<int32_t> index(m_voxel_hardnesses.gridSize());
+    file.read(reinterpret_cast<char *>(index.data()), index.size() * sizeof(int32_t));
+    size_t brick_voxels = m_voxel_hardnesses.brickVoxels();
+    size_t value_size = header.dtype == HARDNESS_DTYPE_FLOAT32 ? sizeof(float) : sizeof(uint8_t);
+    size_t stored_bricks = 0;
+    for (int32_t brick : index)
+    {
+        if (brick >= 0)
+        {
+            stored_bricks++;
+        }
+    }
+    // all stored bricks in one bulk read, they are in the same order as their (increasing) index entries
+    std::vector<char> raw(stored_bricks * brick_voxels * value_size);
+    file.read(raw.data(), raw.size());
+    if (!file)
+    {
+        std::cout << "[hardnessBehaviorInit]: File is truncated: " << hardness_spec_file << std::endl;
+        return -1;
+    }
+    for (size_t b = 0; b < index.size(); b++)
+    {
+        if (index[b] < 0)
+        {
+            continue;
+        }
+        if (size_t(index[b]) >= stored_bricks)
         {
-            std::cout << "[hardnessBehaviorInit]: expected hardness spec size of " << m_volumeObject->getVoxelCount().get(0) << ", " << m_volumeObject->getVoxelCount().get(1) << ", " << m_volumeObject->getVoxelCount().get(2) << " in " << hardness_spec_file << std::endl;
-            std::cout << "[hardnessBehaviorInit]: got " << record[0] << ", " << record[1] << ", " << record[2] << std::endl;
+            std::cout << "[hardnessBehaviorInit]: Invalid brick index " << index[b] << " in " << hardness_spec_file << std::endl;
             return -1;
         }
+        float *values = m_voxel_hardnesses.brickData(b);
+        const char *src = &raw[size_t(index[b]) * brick_voxels * value_size];
+        for (size_t v = 0; v < brick_voxels; v++)
+        {
+            float hardness;
+            if (header.dtype == HARDNESS_DTYPE_FLOAT32)
+            {
+                std::memcpy(&hardness, src + v * sizeof(float), sizeof(float));
+            }
+            else
+            {
+                hardness = uint8_t(src[v]) / 255.0f;
+            }
+            values[v] = hardness + 0.5f;
+        }
+    }
+    return 0;
+}
+
+/// @brief  Load hardness values from the legacy CSV format
+/// @param hardness_spec_file  CSV file, first line is the dimensions, then one hardness value per line
+/// @return 0 if successful, -1 if not
+int afVolmetricDrillingPlugin::loadHardnessCSV(const std::string &hardness_spec_file)
+{
+    std::ifstream file(hardness_spec_file);
+
+    // read first line
+    std::string s;
+    if (!std::getline(file, s))
+    {
+        std::cout << "[hardnessBehaviorInit]: File appears to be empty: " << hardness_spec_file << std::endl;
+        return -1;
+    }
+    std::istringstream ss(s);
+    std::vector<std::string> record;
+    while (ss)
+    {
+        std::string s;
+        if (!getline(ss, s, ','))
+            break;
+        record.push_back(s);
+    }
+    // see if first line is m_volumeObject->getVoxelCount().get(0), m_volumeObject->getVoxelCount().get(1), m_volumeObject->getVoxelCount().get(2)
+    if (record.size() != 3)
+    {
+        std::cout << "[hardnessBehaviorInit]: expected hardness spec dimensionality of 3 in " << hardness_spec_file << std::endl;
+        return -1;
+    }
+    if (std::stoi(record[0]) != m_hardness_dims[0] || std::stoi(record[1]) != m_hardness_dims[1] || std::stoi(record[2]) != m_hardness_dims[2])
+    {
+        std::cout << "[hardnessBehaviorInit]: expected hardness spec size of " << m_hardness_dims[0] << ", " << m_hardness_dims[1] << ", " << m_hardness_dims[2] << " in " << hardness_spec_file << std::endl;
+        std::cout << "[hardnessBehaviorInit]: got " << record[0] << ", " << record[1] << ", " << record[2] << std::endl;
+        return -1;
+    }
 
-        // rest of the file is one number per line which is the hardness, loop through each dimension of harndesses
-        for (size_t i = 0; i < m_volumeObject->getVoxelCount().get(0); i++)
+    // rest of the file is one number per line which is the hardness, z changing fastest
+    for (size_t i = 0; i < m_hardness_dims[0]; i++)
+    {
+        for (size_t j = 0; j < m_hardness_dims[1]; j++)
         {
-            for (size_t j = 0; j < m_volumeObject->getVoxelCount().get(1); j++)
+            for (size_t k = 0; k < m_hardness_dims[2]; k++)
             {
-                for (size_t k = 0; k < m_volumeObject->getVoxelCount().get(2); k++)
+                if (!std::getline(file, s))
                 {
-                    if (!std::getline(file, s))
-                    {
-                        std::cout << "[hardnessBehaviorInit]: No data at i,j,k = " << i << "," << j << "," << k << ": " << hardness_spec_file << std::endl;
-                        return -1;
-                    }
-                    forces[i][j][k] = std::stod(s) + 0.5;
+                    std::cout << "[hardnessBehaviorInit]: No data at i,j,k = " << i << "," << j << "," << k << ": " << hardness_spec_file << std::endl;
+                    return -1;
+                }
+                double hardness = std::stod(s);
+                if (hardness != 0.0)
+                {
+                    m_voxel_hardnesses.at(i, j, k) = hardness + 0.5;
                 }
             }
         }
-        file.close();
-        m_voxel_hardnesses = forces;
     }
+    file.close();
     return 0;
 }
 
-/// @brief Remove voxels in the cylinder around specified trajectory(ies) as if they were pre-drilled
+/// @brief Voxel grid of the volume in its local frame, voxel (i, j, k) is centered at origin + (i, j, k) + 0.5 voxels
+PredrillGrid afVolmetricDrillingPlugin::predrillGrid()
+{
+    PredrillGrid grid;
+    for (int n = 0; n < 3; n++)
+    {
+        grid.dims[n] = m_volumeObject->getVoxelCount().get(n);
+        grid.origin[n] = m_minVolCorner(n);
+        grid.voxel[n] = (m_maxVolCorner(n) - m_minVolCorner(n)) / grid.dims[n];
+    }
+    return grid;
+}
+
+bool afVolmetricDrillingPlugin::predrillVoxel(int i, int j, int k)
+{
+    cColorb color;
+    m_voxelObj->m_texture->m_image->getVoxelColor(uint(i), uint(j), uint(k), color);
+    if (color == m_zeroColor)
+    {
+        return false;
+    }
+    cVector3d idx(i, j, k);
+    removeVoxel(idx);
+    return true;
+}
+
+/// @brief Remove voxels in the capsules swept by the burr along specified trajectory(ies) as if they were pre-drilled
+/// @note Every voxel whose center is within burr_size / 2 of a trajectory segment is removed once, the texture is
+/// updated once at the end
 int afVolmetricDrillingPlugin::predrillTrajInit(const std::vector<std::string> &predrill_traj_files)
 {
-    // TODO there is likely a much more direct way of doing this - remove all voxels in the cylinder / "pill" around the trajectory
-    int resol = 20;
-    m_mutexVoxel.acquire();
+    PredrillGrid grid = predrillGrid();
+    std::vector<std::vector<cVector3d>> trajectories;
+    std::vector<double> radii;
+    // bounding box (voxel indices) of all capsules, the mask only covers it
+    int lo[3] = {grid.dims[0], grid.dims[1], grid.dims[2]};
+    int hi[3] = {-1, -1, -1};
     for (auto &predrill_traj_file : predrill_traj_files)
     {
         double burr_size;
         std::vector<cVector3d> traj_points;
-        if (!parsePredrillTrajFromCSV(predrill_traj_file, traj_points, burr_size))
+        if (!parsePredrillTrajFromCSV(predrill_traj_file, traj_points, burr_size) || traj_points.empty())
         {
             std::cout << "[predrillTrajInit]: Error reading: " << predrill_traj_file << std::endl;
             return -1;
         }
-        burr_size *= mm_to_ambf_unit;
-
+        double radius = burr_size * mm_to_ambf_unit / 2.0;
         for (auto &pt : traj_points)
         {
-            for (size_t i = 0; i <= resol; i++)
+            for (int n = 0; n < 3; n++)
+            {
+                lo[n] = std::min(lo[n], std::max(0, (int)std::floor((pt(n) - radius - grid.origin[n]) / grid.voxel[n])));
+                hi[n] = std::max(hi[n], std::min(grid.dims[n] - 1, (int)std::floor((pt(n) + radius - grid.origin[n]) / grid.voxel[n])));
+            }
+        }
+        trajectories.push_back(traj_points);
+        radii.push_back(radius);
+    }
+    if (hi[0] < lo[0] || hi[1] < lo[1] || hi[2] < lo[2])
+    {
+        std::cout << "[predrillTrajInit]: Trajectories are outside of the volume" << std::endl;
+        return 0;
+    }
+
+    // the grid should agree with the volume's own position to index conversion
+    cVector3d check_idx;
+    cVector3d check_pt = trajectories[0][0];
+    m_volumeObject->localPosToVoxelIndex(check_pt, check_idx);
+    for (int n = 0; n < 3; n++)
+    {
+        double grid_idx = std::floor((check_pt(n) - grid.origin[n]) / grid.voxel[n]);
+        if (std::abs(grid_idx - check_idx(n)) > 1.0)
+        {
+            std::cout << "[predrillTrajInit]: WARNING! voxel grid index " << grid_idx << " differs from localPosToVoxelIndex " << check_idx(n) << " on axis " << n << std::endl;
+        }
+    }
+
+    int size[3] = {hi[0] - lo[0] + 1, hi[1] - lo[1] + 1, hi[2] - lo[2] + 1};
+    std::vector<uint8_t> mask(size_t(size[0]) * size[1] * size[2], 0);
+    for (size_t t = 0; t < trajectories.size(); t++)
+    {
+        auto &points = trajectories[t];
+        for (size_t p = 0; p < std::max(points.size(), size_t(2)) - 1; p++)
+        {
+            const cVector3d &pa = points[p];
+            const cVector3d &pb = points[std::min(p + 1, points.size() - 1)];
+            double a[3] = {pa(0), pa(1), pa(2)};
+            double b[3] = {pb(0), pb(1), pb(2)};
+            rasterizeCapsule(a, b, radii[t], grid, [&](int i, int j, int k_begin, int k_end)
+                             {
+                                 size_t row = (size_t(i - lo[0]) * size[1] + (j - lo[1])) * size[2];
+                                 std::fill(mask.begin() + row + (k_begin - lo[2]), mask.begin() + row + (k_end - lo[2]), 1);
+                             });
+        }
+    }
+
+    size_t removed = 0, inside = 0;
+    m_mutexVoxel.acquire();
+    for (int i = 0; i < size[0]; i++)
+    {
+        for (int j = 0; j < size[1]; j++)
+        {
+            const uint8_t *row = &mask[(size_t(i) * size[1] + j) * size[2]];
+            for (int k = 0; k < size[2]; k++)
             {
-                for (size_t j = 0; j <= resol; j++)
+                if (row[k])
                 {
-                    for (size_t k = 0; k <= resol; k++)
-                    {
-                        auto denom = static_cast<double>(resol);
-                        double r = i / denom * burr_size / 2.0;
-                        double th = j / denom * 2 * PI;
-                        double phi = k / denom * PI;
-                        cVector3d offset(r * sin(phi) * cos(th), r * sin(phi) * sin(th), r * cos(phi));
-
-                        cVector3d idx;
-                        auto new_pt = pt + offset;
-                        // std::cout << "actual point " << new_pt << std::endl;
-                        m_volumeObject->localPosToVoxelIndex(new_pt, idx);
-                        removeVoxel(idx);
-                    }
+                    inside++;
+                    removed += predrillVoxel(lo[0] + i, lo[1] + j, lo[2] + k);
                 }
             }
         }
     }
     m_mutexVoxel.release();
+    m_drillingPub->flushVoxelsRemoved(m_worldPtr->getSimulationTime());
+    m_flagMarkVolumeForUpdate = true;
+    graphicsUpdate();
+    std::cout << "[predrillTrajInit]: removed " << removed << " of " << inside << " voxels in the predrill trajectories" << std::endl;
+    return 0;
+}
+
+/// @brief Remove the voxels listed in a predrill mask file (scripts/precompute_predrill_mask.py)
+int afVolmetricDrillingPlugin::predrillMaskInit(const std::string &predrill_mask_file)
+{
+    std::ifstream file(predrill_mask_file, std::ios::binary);
+    PredrillMaskHeader header;
+    if (!file || !file.read(reinterpret_cast<char *>(&header), sizeof(header)) ||
+        strncmp(header.magic, PREDRILL_MASK_MAGIC, PREDRILL_MASK_MAGIC_SIZE) != 0)
+    {
+        std::cout << "[predrillMaskInit]: Not a predrill mask file: " << predrill_mask_file << std::endl;
+        return -1;
+    }
+    if (header.version != PREDRILL_MASK_VERSION)
+    {
+        std::cout << "[predrillMaskInit]: Unsupported predrill mask version " << header.version << " in " << predrill_mask_file << std::endl;
+        return -1;
+    }
+    PredrillGrid grid = predrillGrid();
+    for (int n = 0; n < 3; n++)
+    {
+        if (int(header.dims[n]) != grid.dims[n])
+        {
+            std::cout << "[predrillMaskInit]: mask of " << header.dims[0] << ", " << header.dims[1] << ", " << header.dims[2] << " voxels does not match the volume (" << grid.dims[0] << ", " << grid.dims[1] << ", " << grid.dims[2] << ")" << std::endl;
+            return -1;
+        }
+    }
+    // check the count from the file against its size before allocating
+    file.seekg(0, std::ios::end);
+    uint64_t data_bytes = uint64_t(file.tellg()) - PREDRILL_MASK_HEADER_SIZE;
+    if (header.count > data_bytes / (3 * sizeof(int32_t)))
+    {
+        std::cout << "[predrillMaskInit]: Truncated predrill mask file: " << predrill_mask_file << std::endl;
+        return -1;
+    }
+    std::vector<int32_t> indices(header.count * 3);
+    file.seekg(PREDRILL_MASK_HEADER_SIZE);
+    if (!file.read(reinterpret_cast<char *>(indices.data()), indices.size() * sizeof(int32_t)))
+    {
+        std::cout << "[predrillMaskInit]: Truncated predrill mask file: " << predrill_mask_file << std::endl;
+        return -1;
+    }
+    size_t removed = 0;
+    m_mutexVoxel.acquire();
+    for (size_t v = 0; v < header.count; v++)
+    {
+        int i = indices[3 * v], j = indices[3 * v + 1], k = indices[3 * v + 2];
+        if (i >= 0 && j >= 0 && k >= 0 && i < grid.dims[0] && j < grid.dims[1] && k < grid.dims[2])
+        {
+            removed += predrillVoxel(i, j, k);
+        }
+    }
+    m_mutexVoxel.release();
+    m_drillingPub->flushVoxelsRemoved(m_worldPtr->getSimulationTime());
+    m_flagMarkVolumeForUpdate = true;
     graphicsUpdate();
+    std::cout << "[predrillMaskInit]: removed " << removed << " of " << header.count << " voxels from " << predrill_mask_file << std::endl;
+    return 0;
+}
+
+/// @brief Remember the non empty voxels and the hardnesses of the volume as loaded, checkpoints store the difference to them
+void afVolmetricDrillingPlugin::checkpointBaselineInit()
+{
+    int count[3];
+    for (int n = 0; n < 3; n++)
+    {
+        count[n] = m_volumeObject->getVoxelCount().get(n);
+    }
+    m_pristine_voxels.init(size_t(count[0]) * count[1] * count[2]);
+    cColorb color;
+    size_t f = 0;
+    for (int z = 0; z < count[2]; z++)
+    {
+        for (int y = 0; y < count[1]; y++)
+        {
+            for (int x = 0; x < count[0]; x++, f++)
+            {
+                m_voxelObj->m_texture->m_image->getVoxelColor(uint(x), uint(y), uint(z), color);
+                if (color != m_zeroColor)
+                {
+                    m_pristine_voxels.set(f);
+                }
+            }
+        }
+    }
+    if (m_hardness_behavior)
+    {
+        m_pristine_hardnesses = m_voxel_hardnesses;
+    }
+}
+
+/// @brief Save the removed voxels and the changed hardnesses to a checkpoint file (see volume_checkpoint.h)
+/// @return 0 if successful, -1 otherwise
+int afVolmetricDrillingPlugin::saveCheckpoint(const std::string &checkpoint_file)
+{
+    cPrecisionClock clock;
+    clock.start();
+    int count[3];
+    for (int n = 0; n < 3; n++)
+    {
+        count[n] = m_volumeObject->getVoxelCount().get(n);
+    }
+    std::vector<VoxelRun> runs;
+    std::vector<int64_t> bricks;
+    cColorb color;
+    m_mutexVoxel.acquire();
+    size_t f = 0;
+    for (int z = 0; z < count[2]; z++)
+    {
+        for (int y = 0; y < count[1]; y++)
+        {
+            for (int x = 0; x < count[0]; x++, f++)
+            {
+                if (!m_pristine_voxels.test(f))
+                {
+                    continue;
+                }
+                m_voxelObj->m_texture->m_image->getVoxelColor(uint(x), uint(y), uint(z), color);
+                if (color == m_zeroColor)
+                {
+                    appendVoxelRun(runs, f);
+                }
+            }
+        }
+    }
+    if (m_hardness_behavior)
+    {
+        size_t brick_voxels = m_voxel_hardnesses.brickVoxels();
+        for (size_t b = 0; b < m_voxel_hardnesses.gridSize(); b++)
+        {
+            const float *values = m_voxel_hardnesses.brickValues(b);
+            if (values == nullptr)
+            {
+                continue; // bricks are never freed, so it is still the pristine background
+            }
+            const float *pristine = m_pristine_hardnesses.brickValues(b);
+            for (size_t v = 0; v < brick_voxels; v++)
+            {
+                if (values[v] != (pristine ? pristine[v] : m_pristine_hardnesses.background()))
+                {
+                    bricks.push_back(b);
+                    break;
+                }
+            }
+        }
+    }
+
+    VolumeCheckpointHeader header = {};
+    strncpy(header.magic, VOLUME_CHECKPOINT_MAGIC, VOLUME_CHECKPOINT_MAGIC_SIZE);
+    header.version = VOLUME_CHECKPOINT_VERSION;
+    for (int n = 0; n < 3; n++)
+    {
+        header.dims[n] = count[n];
+    }
+    header.run_count = runs.size();
+    header.brick_shift = m_hardness_behavior ? m_voxel_hardnesses.brickShift() : 0;
+    header.brick_count = bricks.size();
+    header.sim_time = m_worldPtr->getSimulationTime();
+
+    std::string tmp_file = checkpoint_file + ".tmp";
+    std::ofstream file(tmp_file, std::ios::binary);
+    file.write(reinterpret_cast<const char *>(&header), sizeof(header));
+    file.write(reinterpret_cast<const char *>(runs.data()), runs.size() * sizeof(VoxelRun));
+    for (int64_t b : bricks)
+    {
+        file.write(reinterpret_cast<const char *>(&b), sizeof(b));
+        file.write(reinterpret_cast<const char *>(m_voxel_hardnesses.brickValues(b)), m_voxel_hardnesses.brickVoxels() * sizeof(float));
+    }
+    m_mutexVoxel.release();
+    file.close();
+    if (!file || std::rename(tmp_file.c_str(), checkpoint_file.c_str()) != 0)
+    {
+        std::cout << "[saveCheckpoint]: Could not write " << checkpoint_file << std::endl;
+        std::remove(tmp_file.c_str());
+        return -1;
+    }
+    double ms = clock.getCurrentTimeSeconds() * 1000.0;
+    std::cout << "[saveCheckpoint]: " << runs.size() << " removed voxel runs, " << bricks.size() << " hardness bricks to " << checkpoint_file << " in " << ms << " ms" << std::endl;
+    return 0;
+}
+
+/// @brief Reset the volume and reapply a checkpoint saved by saveCheckpoint, the whole texture is uploaded once
+/// @return 0 if successful, -1 if the file can not be used (the volume is left untouched)
+int afVolmetricDrillingPlugin::restoreCheckpoint(const std::string &checkpoint_file)
+{
+    cPrecisionClock clock;
+    clock.start();
+    std::ifstream file(checkpoint_file, std::ios::binary);
+    VolumeCheckpointHeader header;
+    if (!file || !file.read(reinterpret_cast<char *>(&header), sizeof(header)) ||
+        strncmp(header.magic, VOLUME_CHECKPOINT_MAGIC, VOLUME_CHECKPOINT_MAGIC_SIZE) != 0)
+    {
+        std::cout << "[restoreCheckpoint]: Not a checkpoint file: " << checkpoint_file << std::endl;
+        return -1;
+    }
+    if (header.version != VOLUME_CHECKPOINT_VERSION)
+    {
+        std::cout << "[restoreCheckpoint]: Unsupported checkpoint version " << header.version << " in " << checkpoint_file << std::endl;
+        return -1;
+    }
+    int count[3];
+    for (int n = 0; n < 3; n++)
+    {
+        count[n] = m_volumeObject->getVoxelCount().get(n);
+    }
+    for (int n = 0; n < 3; n++)
+    {
+        if (int(header.dims[n]) != count[n])
+        {
+            std::cout << "[restoreCheckpoint]: checkpoint of " << header.dims[0] << ", " << header.dims[1] << ", " << header.dims[2] << " voxels does not match the volume" << std::endl;
+            return -1;
+        }
+    }
+    if (header.brick_count > 0 && (!m_hardness_behavior || header.brick_shift != m_voxel_hardnesses.brickShift()))
+    {
+        std::cout << "[restoreCheckpoint]: hardnesses in " << checkpoint_file << " do not match the hardness behavior of the simulation" << std::endl;
+        return -1;
+    }
+
+    // the counts come from the file, check them against its size before allocating anything
+    size_t brick_voxels = m_voxel_hardnesses.brickVoxels();
+    std::streamoff data_start = file.tellg();
+    file.seekg(0, std::ios::end);
+    uint64_t remaining = uint64_t(file.tellg() - data_start);
+    file.seekg(data_start);
+    uint64_t brick_bytes = sizeof(int64_t) + brick_voxels * sizeof(float);
+    if (header.run_count > remaining / sizeof(VoxelRun) ||
+        header.brick_count > (remaining - header.run_count * sizeof(VoxelRun)) / brick_bytes)
+    {
+        std::cout << "[restoreCheckpoint]: Truncated checkpoint file: " << checkpoint_file << std::endl;
+        return -1;
+    }
+
+    // read everything before touching the volume
+    std::vector<VoxelRun> runs(header.run_count);
+    std::vector<int64_t> bricks(header.brick_count);
+    std::vector<float> brick_values(header.brick_count * brick_voxels);
+    file.read(reinterpret_cast<char *>(runs.data()), runs.size() * sizeof(VoxelRun));
+    for (size_t b = 0; b < bricks.size(); b++)
+    {
+        file.read(reinterpret_cast<char *>(&bricks[b]), sizeof(int64_t));
+        file.read(reinterpret_cast<char *>(&brick_values[b * brick_voxels]), brick_voxels * sizeof(float));
+    }
+    if (!file)
+    {
+        std::cout << "[restoreCheckpoint]: Truncated checkpoint file: " << checkpoint_file << std::endl;
+        return -1;
+    }
+    for (auto &run : runs)
+    {
+        if (run.start + run.length > m_pristine_voxels.size())
+        {
+            std::cout << "[restoreCheckpoint]: Voxel run out of the volume in " << checkpoint_file << std::endl;
+            return -1;
+        }
+    }
+    for (int64_t b : bricks)
+    {
+        if (b < 0 || size_t(b) >= m_voxel_hardnesses.gridSize())
+        {
+            std::cout << "[restoreCheckpoint]: Hardness brick out of the volume in " << checkpoint_file << std::endl;
+            return -1;
+        }
+    }
+
+    m_volumeObject->reset();
+    m_mutexVoxel.acquire();
+    size_t nx = count[0], nxy = nx * count[1];
+    cColorb color;
+    for (auto &run : runs)
+    {
+        for (uint64_t f = run.start; f < run.start + run.length; f++)
+        {
+            uint x = f % nx, y = f % nxy / nx, z = f / nxy;
+            m_voxelObj->m_texture->m_image->getVoxelColor(x, y, z, color);
+            double voxel_array[3] = {double(x), double(y), double(z)};
+            unsigned char color_bytes[4] = {color.getR(), color.getG(), color.getB(), color.getA()};
+            m_drillingPub->queueVoxelRemoved(voxel_array, color_bytes);
+            m_voxelObj->m_texture->m_image->setVoxelColor(x, y, z, m_zeroColor);
+        }
+    }
+    if (m_hardness_behavior)
+    {
+        m_voxel_hardnesses = m_pristine_hardnesses;
+        for (size_t b = 0; b < bricks.size(); b++)
+        {
+            std::copy_n(&brick_values[b * brick_voxels], brick_voxels, m_voxel_hardnesses.brickData(bricks[b]));
+        }
+    }
+    // one upload of the whole texture
+    m_volumeUpdate.enclose(cVector3d(0, 0, 0));
+    m_volumeUpdate.enclose(cVector3d(count[0] - 1, count[1] - 1, count[2] - 1));
+    m_mutexVoxel.release();
+    // subscribers of voxels_removed_batch (CmvdOccupancyMirror) reset and get the restored removals
+    m_drillingPub->flushVoxelsRemoved(m_worldPtr->getSimulationTime(), true);
+    m_flagMarkVolumeForUpdate = true;
+
+    double ms = clock.getCurrentTimeSeconds() * 1000.0;
+    std::cout << "[restoreCheckpoint]: " << runs.size() << " removed voxel runs, " << bricks.size() << " hardness bricks from " << checkpoint_file << " (saved at t = " << header.sim_time << " s) in " << ms << " ms" << std::endl;
     return 0;
 }
 
@@ -7,6 +7,10 @@
 #include "collision_publisher.h"
 #include "cable_pull_subscriber.h"
 #include "cmvd_settings_rossub.h"
+#include "hardness_file.h"
+#include "hardness_volume.h"
+#include "predrill_mask.h"
+#include "volume_checkpoint.h"
 
 using namespace std;
 using namespace ambf;
@@ -211,7 +215,13 @@ private:
     // cVector3d m_summed_burr_force;
 
     int m_col_count = 0;
-    std::vector<std::vector<std::vector<double>>> m_voxel_hardnesses;
+    HardnessVolume m_voxel_hardnesses; // sparse, only bricks with non air voxels are allocated
+    size_t m_hardness_dims[3] = {0, 0, 0};
+    // state of the volume as loaded, checkpoints only store the difference to it
+    VoxelBitset m_pristine_voxels; // non empty voxels
+    HardnessVolume m_pristine_hardnesses;
+    PhysicsProfiler m_physicsProfiler;
+    double m_profilePeriod = 1.0; // s between reports on /diagnostics, 0 = off
     double m_debug_value = 0.0;
     bool m_debug_print = false;
     bool m_hardness_behavior = false;
@@ -228,10 +238,29 @@ private:
 
     int hardnessBehaviorInit(const std::string &hardness_spec_file);
 
+    int loadHardnessBinary(const std::string &hardness_spec_file);
+
+    int loadHardnessCSV(const std::string &hardness_spec_file);
+
+    int loadHardnessBricks(std::ifstream &file, const HardnessFileHeader &header, const std::string &hardness_spec_file);
+
     int predrillTrajInit(const std::vector<std::string> &predrill_traj_files);
 
+    int predrillMaskInit(const std::string &predrill_mask_file);
+
+    PredrillGrid predrillGrid();
+
+    // removes the voxel if it is not empty, returns true if it was removed. To be called within the voxel mutex
+    bool predrillVoxel(int i, int j, int k);
+
     void removeVoxel(cVector3d &pos);
 
+    void checkpointBaselineInit();
+
+    int saveCheckpoint(const std::string &checkpoint_file);
+
+    int restoreCheckpoint(const std::string &checkpoint_file);
+
 };
 
 int init(int argc, char **argv, const afWorldPtr a_afWorld);
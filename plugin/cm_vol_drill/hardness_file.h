@@ -0,0 +1,39 @@
+#ifndef HARDNESS_FILE_H
+#define HARDNESS_FILE_H
+
+#include <cstdint>
+
+// Binary hardness file written by scripts/generate_hardness_file_from_nrrd.py
+// (see scripts/continuum_manip_volumetric_drilling_plugin/hardness_file.py for the python side).
+// The header is HARDNESS_FILE_HEADER_SIZE bytes, little endian, followed by the payload.
+// Version 1 (dense): every voxel in C order (last axis fastest).
+// Version 2 (bricks): the volume is split in brick_size^3 bricks, the payload is an int32 index over the brick grid
+// (C order, -1 = brick with only zero values, not stored) followed by the stored bricks, each in C order
+
+#define HARDNESS_FILE_MAGIC "CMVDHRD"
+#define HARDNESS_FILE_MAGIC_SIZE 8
+#define HARDNESS_FILE_VERSION 1
+#define HARDNESS_FILE_VERSION_BRICKS 2
+#define HARDNESS_FILE_HEADER_SIZE 128
+
+enum hardness_file_dtype
+{
+    HARDNESS_DTYPE_FLOAT32 = 1,
+    HARDNESS_DTYPE_UINT8 = 2 // value / 255
+};
+
+struct HardnessFileHeader
+{
+    char magic[HARDNESS_FILE_MAGIC_SIZE];
+    uint32_t version;
+    uint32_t dtype;
+    uint32_t dims[3];
+    uint32_t brick_size; // 0 for dense files
+    char axis_order[8]; // stored axis -> nrrd axis, e.g. "+Y-X+Z"
+    double origin[3];   // LPS space origin (mm)
+    double spacing[3];  // voxel spacing (mm)
+};
+
+static_assert(sizeof(HardnessFileHeader) == 88, "HardnessFileHeader must match the python struct layout");
+
+#endif // HARDNESS_FILE_H
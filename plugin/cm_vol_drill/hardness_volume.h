@@ -0,0 +1,99 @@
+#ifndef HARDNESS_VOLUME_H
+#define HARDNESS_VOLUME_H
+
+#include <cstdint>
+#include <cstddef>
+#include <vector>
+
+// Sparse per voxel hardness. The volume is split in bricks of (1 << brick_shift)^3 voxels, only bricks that hold a
+// value different from the background are allocated, the others all read as the background value. Most of a scan
+// is air, so this keeps a small fraction of the dense array and the voxels of a brick stay next to each other in
+// memory while drilling.
+class HardnessVolume
+{
+public:
+    void init(const size_t dims[3], float background, uint32_t brick_shift = 3)
+    {
+        m_brick_shift = brick_shift;
+        m_brick_size = 1u << brick_shift;
+        m_brick_voxels = size_t(m_brick_size) * m_brick_size * m_brick_size;
+        for (int i = 0; i < 3; i++)
+        {
+            m_dims[i] = dims[i];
+            m_grid[i] = (dims[i] + m_brick_size - 1) >> brick_shift;
+        }
+        m_background = background;
+        m_index.assign(m_grid[0] * m_grid[1] * m_grid[2], -1);
+        m_bricks.clear();
+    }
+
+    inline float get(uint32_t x, uint32_t y, uint32_t z) const
+    {
+        int32_t brick = m_index[brickIndex(x, y, z)];
+        return brick < 0 ? m_background : m_bricks[size_t(brick) * m_brick_voxels + voxelOffset(x, y, z)];
+    }
+
+    // writable reference, allocates the brick (filled with the background) on first write
+    inline float &at(uint32_t x, uint32_t y, uint32_t z)
+    {
+        int32_t &brick = m_index[brickIndex(x, y, z)];
+        if (brick < 0)
+        {
+            brick = allocateBrick();
+        }
+        return m_bricks[size_t(brick) * m_brick_voxels + voxelOffset(x, y, z)];
+    }
+
+    // allocate the brick at grid position brick_index and return its voxels (m_brick_voxels values, C order)
+    float *brickData(size_t brick_index)
+    {
+        if (m_index[brick_index] < 0)
+        {
+            m_index[brick_index] = allocateBrick();
+        }
+        return &m_bricks[size_t(m_index[brick_index]) * m_brick_voxels];
+    }
+
+    // voxels of the brick at grid position brick_index, nullptr if it is not allocated (all background)
+    const float *brickValues(size_t brick_index) const
+    {
+        return m_index[brick_index] < 0 ? nullptr : &m_bricks[size_t(m_index[brick_index]) * m_brick_voxels];
+    }
+
+    size_t gridSize() const { return m_index.size(); }
+    uint32_t brickShift() const { return m_brick_shift; }
+    float background() const { return m_background; }
+    size_t brickVoxels() const { return m_brick_voxels; }
+    size_t allocatedBricks() const { return m_bricks.size() / m_brick_voxels; }
+    size_t memoryBytes() const { return m_index.size() * sizeof(int32_t) + m_bricks.size() * sizeof(float); }
+    size_t denseBytes() const { return m_dims[0] * m_dims[1] * m_dims[2] * sizeof(float); }
+
+private:
+    inline size_t brickIndex(uint32_t x, uint32_t y, uint32_t z) const
+    {
+        return (size_t(x >> m_brick_shift) * m_grid[1] + (y >> m_brick_shift)) * m_grid[2] + (z >> m_brick_shift);
+    }
+
+    inline size_t voxelOffset(uint32_t x, uint32_t y, uint32_t z) const
+    {
+        uint32_t mask = m_brick_size - 1;
+        return ((size_t(x & mask) << m_brick_shift | (y & mask)) << m_brick_shift) | (z & mask);
+    }
+
+    int32_t allocateBrick()
+    {
+        m_bricks.resize(m_bricks.size() + m_brick_voxels, m_background);
+        return int32_t(m_bricks.size() / m_brick_voxels - 1);
+    }
+
+    size_t m_dims[3] = {0, 0, 0};
+    size_t m_grid[3] = {0, 0, 0};
+    uint32_t m_brick_shift = 3;
+    uint32_t m_brick_size = 8;
+    size_t m_brick_voxels = 512;
+    float m_background = 0.0;
+    std::vector<int32_t> m_index; // brick grid, C order, -1 = not allocated
+    std::vector<float> m_bricks;  // allocated bricks, m_brick_voxels values each
+};
+
+#endif // HARDNESS_VOLUME_H
@@ -0,0 +1,168 @@
+#ifndef PHYSICS_PROFILER_H
+#define PHYSICS_PROFILER_H
+
+#include <chrono>
+#include <cmath>
+#include <cstdint>
+
+// Timing of the phases of physicsUpdate, aggregated per reporting window (published by DrillingPublisher on
+// /diagnostics, see scripts/physics_profile_monitor.py). Durations go into fixed log scale histograms, the same
+// binning as scripts/continuum_manip_volumetric_drilling_plugin/loop_profiler.py, so p50 / p99 cost no sorting.
+
+enum PhysicsStat
+{
+    PHYSICS_SETTINGS,
+    PHYSICS_GLOBAL_POSITIONS,
+    PHYSICS_CURSOR_POSES,
+    PHYSICS_VOXEL_REMOVAL,
+    PHYSICS_INTERACTION_FORCES,
+    PHYSICS_IMPULSES,
+    PHYSICS_CABLE_PULL,
+    PHYSICS_MUTEX_WAIT, // time spent acquiring m_mutexVoxel, included in voxel_removal
+    PHYSICS_TICK,       // whole physicsUpdate
+    PHYSICS_STAT_COUNT
+};
+
+static const char *const PHYSICS_STAT_NAMES[PHYSICS_STAT_COUNT] = {
+    "settings", "global_positions", "cursor_poses", "voxel_removal", "interaction_forces", "impulses", "cable_pull",
+    "mutex_wait", "tick"};
+
+#define PHYSICS_HISTOGRAM_MIN 1e-6 // s, first bin
+#define PHYSICS_HISTOGRAM_DECADES 6
+#define PHYSICS_BINS_PER_DECADE 20
+#define PHYSICS_HISTOGRAM_BINS (PHYSICS_HISTOGRAM_DECADES * PHYSICS_BINS_PER_DECADE + 1)
+
+class DurationStats
+{
+public:
+    inline void add(double seconds)
+    {
+        int i = 0;
+        if (seconds > PHYSICS_HISTOGRAM_MIN)
+        {
+            i = int(std::log10(seconds / PHYSICS_HISTOGRAM_MIN) * PHYSICS_BINS_PER_DECADE) + 1;
+            i = i < PHYSICS_HISTOGRAM_BINS ? i : PHYSICS_HISTOGRAM_BINS - 1;
+        }
+        m_bins[i]++;
+        m_count++;
+        m_total += seconds;
+        m_max = seconds > m_max ? seconds : m_max;
+    }
+
+    // upper edge of the bin holding the p-th percentile, capped by the max seen
+    double percentile(double p) const
+    {
+        if (m_count == 0)
+        {
+            return 0.0;
+        }
+        uint64_t target = uint64_t(std::ceil(p / 100.0 * m_count)), seen = 0;
+        int i = 0;
+        for (; i < PHYSICS_HISTOGRAM_BINS - 1; i++)
+        {
+            seen += m_bins[i];
+            if (seen >= target)
+            {
+                break;
+            }
+        }
+        double edge = PHYSICS_HISTOGRAM_MIN * std::pow(10.0, double(i) / PHYSICS_BINS_PER_DECADE);
+        return edge < m_max ? edge : m_max;
+    }
+
+    uint64_t count() const { return m_count; }
+    double total() const { return m_total; }
+    double mean() const { return m_count ? m_total / m_count : 0.0; }
+    double max() const { return m_max; }
+
+    void reset()
+    {
+        for (auto &bin : m_bins)
+        {
+            bin = 0;
+        }
+        m_count = 0;
+        m_total = 0.0;
+        m_max = 0.0;
+    }
+
+private:
+    uint64_t m_bins[PHYSICS_HISTOGRAM_BINS] = {};
+    uint64_t m_count = 0;
+    double m_total = 0.0;
+    double m_max = 0.0;
+};
+
+class PhysicsProfiler
+{
+public:
+    typedef std::chrono::steady_clock Clock;
+
+    static inline Clock::time_point now() { return Clock::now(); }
+
+    static inline double since(Clock::time_point start)
+    {
+        return std::chrono::duration<double>(Clock::now() - start).count();
+    }
+
+    inline void add(PhysicsStat stat, double seconds) { m_stats[stat].add(seconds); }
+
+    // whole tick, dt is the physics step it had to fit in
+    inline void endTick(Clock::time_point start, double dt)
+    {
+        double seconds = since(start);
+        m_stats[PHYSICS_TICK].add(seconds);
+        m_overruns += seconds > dt;
+        m_sim_time += dt;
+    }
+
+    inline void countVoxelsRemoved(uint64_t n) { m_voxels_removed += n; }
+    inline void countContacts(uint64_t n) { m_contacts += n; }
+
+    const DurationStats &stats(PhysicsStat stat) const { return m_stats[stat]; }
+    uint64_t ticks() const { return m_stats[PHYSICS_TICK].count(); }
+    uint64_t overruns() const { return m_overruns; }
+    uint64_t voxelsRemoved() const { return m_voxels_removed; }
+    uint64_t contacts() const { return m_contacts; }
+    double simTime() const { return m_sim_time; } // sum of dt over the window
+
+    // true once window seconds (wall clock) passed since the last reset
+    bool windowElapsed(double window) const { return window > 0.0 && since(m_window_start) >= window; }
+    double windowSeconds() const { return since(m_window_start); }
+
+    void reset()
+    {
+        for (auto &stats : m_stats)
+        {
+            stats.reset();
+        }
+        m_overruns = 0;
+        m_voxels_removed = 0;
+        m_contacts = 0;
+        m_sim_time = 0.0;
+        m_window_start = now();
+    }
+
+private:
+    DurationStats m_stats[PHYSICS_STAT_COUNT];
+    uint64_t m_overruns = 0;
+    uint64_t m_voxels_removed = 0;
+    uint64_t m_contacts = 0;
+    double m_sim_time = 0.0;
+    Clock::time_point m_window_start = Clock::now();
+};
+
+// Adds the time until the end of the scope to a stat
+class ScopedPhysicsTimer
+{
+public:
+    ScopedPhysicsTimer(PhysicsProfiler &profiler, PhysicsStat stat) : m_profiler(profiler), m_stat(stat), m_start(PhysicsProfiler::now()) {}
+    ~ScopedPhysicsTimer() { m_profiler.add(m_stat, PhysicsProfiler::since(m_start)); }
+
+private:
+    PhysicsProfiler &m_profiler;
+    PhysicsStat m_stat;
+    PhysicsProfiler::Clock::time_point m_start;
+};
+
+#endif // PHYSICS_PROFILER_H
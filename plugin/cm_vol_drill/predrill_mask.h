@@ -0,0 +1,167 @@
+#ifndef PREDRILL_MASK_H
+#define PREDRILL_MASK_H
+
+#include <algorithm>
+#include <cmath>
+#include <cstdint>
+
+// Voxelization of predrill trajectories: the capsule (radius r) swept between consecutive trajectory points is
+// intersected analytically with every voxel column (fixed x, y index, along z) of its bounding box, each column
+// gives one run of voxels whose centers are inside the capsule.
+// Cached masks are written by scripts/precompute_predrill_mask.py (see
+// scripts/continuum_manip_volumetric_drilling_plugin/predrill_mask.py for the python side of the format):
+// PREDRILL_MASK_HEADER_SIZE bytes of header, little endian, followed by count x int32[3] voxel indices.
+
+#define PREDRILL_MASK_MAGIC "CMVDPDM"
+#define PREDRILL_MASK_MAGIC_SIZE 8
+#define PREDRILL_MASK_VERSION 1
+#define PREDRILL_MASK_HEADER_SIZE 64
+
+struct PredrillMaskHeader
+{
+    char magic[PREDRILL_MASK_MAGIC_SIZE];
+    uint32_t version;
+    uint32_t dims[3];
+    uint64_t count;     // number of voxel indices
+    char source_hash[32]; // hash of the trajectories and volume parameters the mask was made from (python side)
+};
+
+static_assert(sizeof(PredrillMaskHeader) == 64, "PredrillMaskHeader must match the python struct layout");
+
+// Grid of the volume: voxel (i, j, k) has its center at origin + (i + 0.5, j + 0.5, k + 0.5) * voxel
+struct PredrillGrid
+{
+    double origin[3];
+    double voxel[3];
+    int dims[3];
+};
+
+// Interval [t0, t1] of t where |p + t * ez - c|^2 <= r^2, false if empty
+inline bool sphereZInterval(const double p[3], const double c[3], double r, double &t0, double &t1)
+{
+    double dx = p[0] - c[0], dy = p[1] - c[1];
+    double h2 = r * r - dx * dx - dy * dy;
+    if (h2 < 0.0)
+    {
+        return false;
+    }
+    double h = std::sqrt(h2);
+    t0 = c[2] - p[2] - h;
+    t1 = c[2] - p[2] + h;
+    return true;
+}
+
+// Interval of t where p + t * ez is within r of the segment a + s * d, 0 <= s <= 1, excluding the end caps
+inline bool cylinderZInterval(const double p[3], const double a[3], const double d[3], double r, double &t0, double &t1)
+{
+    double dd = d[0] * d[0] + d[1] * d[1] + d[2] * d[2];
+    if (dd <= 0.0)
+    {
+        return false;
+    }
+    // w(t) = (p - a) + t ez, distance^2 to the axis = |w|^2 - (w.d)^2 / dd = A t^2 + 2 B t + C
+    double w[3] = {p[0] - a[0], p[1] - a[1], p[2] - a[2]};
+    double wd = w[0] * d[0] + w[1] * d[1] + w[2] * d[2];
+    double A = 1.0 - d[2] * d[2] / dd;
+    double B = w[2] - wd * d[2] / dd;
+    double C = w[0] * w[0] + w[1] * w[1] + w[2] * w[2] - wd * wd / dd - r * r;
+    double lo, hi;
+    if (A < 1e-12)
+    {
+        // column parallel to the axis: inside for all t or none
+        if (C > 0.0)
+        {
+            return false;
+        }
+        lo = -INFINITY;
+        hi = INFINITY;
+    }
+    else
+    {
+        double disc = B * B - A * C;
+        if (disc < 0.0)
+        {
+            return false;
+        }
+        double sq = std::sqrt(disc);
+        lo = (-B - sq) / A;
+        hi = (-B + sq) / A;
+    }
+    // axis parameter s(t) = (wd + t d_z) / dd must be in [0, 1]
+    if (std::abs(d[2]) < 1e-300)
+    {
+        if (wd < 0.0 || wd > dd)
+        {
+            return false;
+        }
+    }
+    else
+    {
+        double s0 = -wd / d[2], s1 = (dd - wd) / d[2];
+        lo = std::max(lo, std::min(s0, s1));
+        hi = std::min(hi, std::max(s0, s1));
+    }
+    if (lo > hi)
+    {
+        return false;
+    }
+    t0 = lo;
+    t1 = hi;
+    return true;
+}
+
+// Calls visit(i, j, k_begin, k_end) for every column run of voxels (k_begin <= k < k_end) whose centers are within
+// radius of the segment a - b (a capsule, a sphere if a == b). Positions are in the units of the grid
+template <class Visit>
+void rasterizeCapsule(const double a[3], const double b[3], double radius, const PredrillGrid &grid, Visit visit)
+{
+    int lo[3], hi[3];
+    for (int n = 0; n < 3; n++)
+    {
+        double mn = std::min(a[n], b[n]) - radius, mx = std::max(a[n], b[n]) + radius;
+        lo[n] = std::max(0, (int)std::ceil((mn - grid.origin[n]) / grid.voxel[n] - 0.5));
+        hi[n] = std::min(grid.dims[n] - 1, (int)std::floor((mx - grid.origin[n]) / grid.voxel[n] - 0.5));
+        if (lo[n] > hi[n])
+        {
+            return;
+        }
+    }
+    double d[3] = {b[0] - a[0], b[1] - a[1], b[2] - a[2]};
+    for (int i = lo[0]; i <= hi[0]; i++)
+    {
+        for (int j = lo[1]; j <= hi[1]; j++)
+        {
+            // column through the voxel centers, t is the z coordinate relative to the grid origin
+            double p[3] = {grid.origin[0] + (i + 0.5) * grid.voxel[0], grid.origin[1] + (j + 0.5) * grid.voxel[1], grid.origin[2]};
+            double t0 = INFINITY, t1 = -INFINITY, s0, s1;
+            // the capsule is convex, its intersection with the column is the hull of the three parts
+            if (sphereZInterval(p, a, radius, s0, s1))
+            {
+                t0 = std::min(t0, s0);
+                t1 = std::max(t1, s1);
+            }
+            if (sphereZInterval(p, b, radius, s0, s1))
+            {
+                t0 = std::min(t0, s0);
+                t1 = std::max(t1, s1);
+            }
+            if (cylinderZInterval(p, a, d, radius, s0, s1))
+            {
+                t0 = std::min(t0, s0);
+                t1 = std::max(t1, s1);
+            }
+            if (t0 > t1)
+            {
+                continue;
+            }
+            int k0 = std::max(lo[2], (int)std::ceil(t0 / grid.voxel[2] - 0.5));
+            int k1 = std::min(hi[2], (int)std::floor(t1 / grid.voxel[2] - 0.5));
+            if (k0 <= k1)
+            {
+                visit(i, j, k0, k1 + 1);
+            }
+        }
+    }
+}
+
+#endif // PREDRILL_MASK_H
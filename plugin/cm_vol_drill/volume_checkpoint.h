@@ -0,0 +1,72 @@
+#ifndef VOLUME_CHECKPOINT_H
+#define VOLUME_CHECKPOINT_H
+
+#include <cstdint>
+#include <cstddef>
+#include <vector>
+
+// Checkpoint of the drilled volume, saved and restored through the saveCheckpoint / restoreCheckpoint topics. Only
+// the difference to the pristine volume (as loaded, before predrilling) is stored: the removed voxels as runs of
+// consecutive flat indices and the hardness bricks that changed. Little endian:
+//   VolumeCheckpointHeader
+//   run_count x VoxelRun
+//   brick_count x (int64 brick index, (1 << brick_shift)^3 float32 hardness values)
+// Flat voxel indices follow the texture memory: index = (z * ny + y) * nx + x.
+
+#define VOLUME_CHECKPOINT_MAGIC "CMVDCKP"
+#define VOLUME_CHECKPOINT_MAGIC_SIZE 8
+#define VOLUME_CHECKPOINT_VERSION 1
+
+struct VolumeCheckpointHeader
+{
+    char magic[VOLUME_CHECKPOINT_MAGIC_SIZE];
+    uint32_t version;
+    uint32_t dims[3];
+    uint64_t run_count;
+    uint32_t brick_shift; // of the hardness volume, 0 if no hardness is stored
+    uint32_t brick_count;
+    double sim_time; // simulation time at which the checkpoint was saved
+};
+
+static_assert(sizeof(VolumeCheckpointHeader) == 48, "VolumeCheckpointHeader must not be padded");
+
+struct VoxelRun
+{
+    uint64_t start;
+    uint64_t length;
+};
+
+// One bit per voxel, used to remember which voxels of the pristine volume are not empty
+class VoxelBitset
+{
+public:
+    void init(size_t count)
+    {
+        m_count = count;
+        m_words.assign((count + 63) / 64, 0);
+    }
+
+    inline void set(size_t i) { m_words[i >> 6] |= uint64_t(1) << (i & 63); }
+    inline bool test(size_t i) const { return (m_words[i >> 6] >> (i & 63)) & 1; }
+    size_t size() const { return m_count; }
+    size_t memoryBytes() const { return m_words.size() * sizeof(uint64_t); }
+
+private:
+    size_t m_count = 0;
+    std::vector<uint64_t> m_words;
+};
+
+// Appends flat index i to runs, extending the last run if i follows it
+inline void appendVoxelRun(std::vector<VoxelRun> &runs, uint64_t i)
+{
+    if (!runs.empty() && runs.back().start + runs.back().length == i)
+    {
+        runs.back().length++;
+    }
+    else
+    {
+        runs.push_back(VoxelRun{i, 1});
+    }
+}
+
+#endif // VOLUME_CHECKPOINT_H
@@ -0,0 +1,84 @@
+
+import hashlib
+import json
+import os
+
+# Manifest kept next to the generated volume assets (resources/volumes/<name>/asset_manifest.json) so the preparation
+# scripts can skip work whose inputs and parameters did not change. Layout:
+#   inputs:  {abs path: {size, mtime_ns, digest}}          caches input digests so unchanged nrrds are not re-hashed
+#   stages:  {stage name: {input, params, outputs: {file: [size, mtime_ns]}, ...stage specific entries}}
+MANIFEST_FILENAME = 'asset_manifest.json'
+MANIFEST_VERSION = 1
+_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def digest_bytes(data):
+    return hashlib.blake2b(memoryview(data).cast('B'), digest_size=20).hexdigest()
+
+
+def digest_file(path):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+class AssetManifest:
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_FILENAME)
+        self.data = {'version': MANIFEST_VERSION, 'inputs': {}, 'stages': {}}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self.data = data
+            except ValueError:
+                print("WARNING: ignoring unreadable asset manifest " + self.path)
+
+    def input_digest(self, path):
+        key = os.path.abspath(path)
+        stat = _stat_key(path)
+        cached = self.data['inputs'].get(key)
+        if cached is not None and [cached['size'], cached['mtime_ns']] == stat:
+            return cached['digest']
+        digest = digest_file(path)
+        self.data['inputs'][key] = {'size': stat[0], 'mtime_ns': stat[1], 'digest': digest}
+        return digest
+
+    def stage(self, name):
+        return self.data['stages'].get(name, {})
+
+    def stage_matches(self, name, input_digest, params):
+        stage = self.stage(name)
+        return stage.get('input') == input_digest and stage.get('params') == params
+
+    def stage_up_to_date(self, name, input_digest, params):
+        """True if the stage ran on the same input with the same params and none of its outputs were changed since"""
+        if not self.stage_matches(name, input_digest, params):
+            return False
+        for output, stat in self.stage(name).get('outputs', {}).items():
+            output_path = os.path.join(self.directory, output)
+            if not os.path.isfile(output_path) or _stat_key(output_path) != stat:
+                return False
+        return True
+
+    def set_stage(self, name, input_digest, params, outputs=(), **extra):
+        stage = {'input': input_digest, 'params': params,
+                 'outputs': {os.path.relpath(o, self.directory): _stat_key(o) for o in outputs}}
+        stage.update(extra)
+        self.data['stages'][name] = stage
+
+    def save(self):
+        # write then rename so an interrupted run never leaves a truncated manifest behind
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,153 @@
+
+import os
+import numpy as np
+from continuum_manip_volumetric_drilling_plugin.session_store import Session, is_session_dir
+
+# Polynomial calibration of the snake tip (x, y, z, rotation about z) as a function of the bend cable length,
+# from the averaged base / tip marker poses of a calibration session (free_space_calibration.py). No ROS needed.
+
+OUTPUT_NAMES = ('x', 'y', 'z', 'thz')
+XYZTHZ_COEFFS_SUFFIX = "xyzthz_snake_polyfit_coeffs.txt"
+DERIVATIVE_COEFFS_SUFFIX = "dxdydzdthz_snake_polyfit_coeffs.txt"
+
+
+def load_calibration_session(directory):
+    """(bend lengths, base_avg, tip_avg, base_zero, tip_zero) of the commanded datapoints of a session, from the
+    session files or from the .npy files of earlier versions"""
+    if is_session_dir(directory):
+        session = Session(directory)
+        commanded = ~np.isnan(session.bend_cmd)
+        return (np.array(session.bend_cmd[commanded]), np.array(session.base_avg[commanded]), np.array(session.tip_avg[commanded]),
+                session.base_zero_transform, session.tip_zero_transform)
+    lengths = np.load(os.path.join(directory, "bend_motor_cmd_all.npy"))
+    base_avg = np.load(os.path.join(directory, "base_transforms_measured_avg.npy"))
+    tip_avg = np.load(os.path.join(directory, "tip_transforms_measured_avg.npy"))
+    if len(lengths) != len(base_avg):
+        raise ValueError(f"{directory}: {len(lengths)} bend commands for {len(base_avg)} datapoints")
+    return (lengths, base_avg, tip_avg, np.load(os.path.join(directory, "base_zero_transform.npy")),
+            np.load(os.path.join(directory, "tip_zero_transform.npy")))
+
+
+def invert_transforms(g):
+    """Batched inverse of (..., 4, 4) rigid transforms"""
+    g = np.asarray(g, dtype=np.float64)
+    inv = np.zeros_like(g)
+    rotation_t = np.swapaxes(g[..., :3, :3], -1, -2)
+    inv[..., :3, :3] = rotation_t
+    inv[..., :3, 3] = -np.einsum('...ij,...j->...i', rotation_t, g[..., :3, 3])
+    inv[..., 3, 3] = 1.0
+    return inv
+
+
+def relative_transforms(base, tip):
+    """base^-1 @ tip for every pair of (n, 4, 4) transforms"""
+    return invert_transforms(base) @ np.asarray(tip, dtype=np.float64)
+
+
+def signed_z_angles(g):
+    """Rotation angle of each transform, signed by the z component of its rotation axis
+    (same as th * sign(dir[2]) of tf.transformations.rotation_from_matrix)"""
+    r = np.asarray(g)[..., :3, :3]
+    axis = np.stack((r[..., 2, 1] - r[..., 1, 2], r[..., 0, 2] - r[..., 2, 0], r[..., 1, 0] - r[..., 0, 1]), axis=-1)
+    cos = (np.trace(r, axis1=-2, axis2=-1) - 1.0) / 2.0
+    angle = np.arctan2(np.linalg.norm(axis, axis=-1) / 2.0, cos)
+    return angle * np.sign(axis[..., 2])
+
+
+def calibration_outputs(base_avg, tip_avg):
+    """(4, n) x, y, z, thz of the tip in the base frame"""
+    base_T_tip = relative_transforms(base_avg, tip_avg)
+    return np.vstack((base_T_tip[:, :3, 3].T, signed_z_angles(base_T_tip)))
+
+
+def kfold_splits(n, folds, seed=0):
+    order = np.random.default_rng(seed).permutation(n)
+    return [(np.setdiff1d(order, test), test) for test in np.array_split(order, min(folds, n))]
+
+
+def cross_validation_error(lengths, outputs, degree, folds=5, seed=0):
+    """Mean squared held-out error of each output row for a polynomial of the given degree"""
+    lengths = np.asarray(lengths, dtype=np.float64)
+    errors = np.zeros(len(outputs))
+    splits = kfold_splits(len(lengths), folds, seed)
+    for train, test in splits:
+        if len(np.unique(lengths[train])) <= degree:
+            return np.full(len(outputs), np.inf)
+        # polyfit fits every output row at once when given a 2D y
+        coeffs = np.polyfit(lengths[train], outputs[:, train].T, degree)
+        predicted = np.vander(lengths[test], degree + 1) @ coeffs
+        errors += ((predicted.T - outputs[:, test]) ** 2).mean(axis=1)
+    return errors / len(splits)
+
+
+def _cross_validation_task(args):
+    return cross_validation_error(*args)
+
+
+def select_degrees(lengths, outputs, degrees, folds=5, executor=None):
+    """Degree with the smallest cross validation error for each output row, and the {degree: errors} table.
+    The candidate degrees are evaluated on executor (e.g. a ProcessPoolExecutor) if given"""
+    tasks = [(lengths, outputs, d, folds) for d in degrees]
+    mapper = executor.map if executor is not None else map
+    table = dict(zip(degrees, mapper(_cross_validation_task, tasks)))
+    errors = np.array([table[d] for d in degrees])
+    if not np.isfinite(errors).any():
+        raise ValueError(f"Not enough distinct bend lengths ({len(np.unique(lengths))}) for the candidate degrees")
+    return [degrees[i] for i in np.argmin(errors, axis=0)], table
+
+
+def fit_calibration_model(lengths, base_avg, tip_avg, degrees=(3,), folds=5, derivative_degree=3, executor=None):
+    """Fit x, y, z, thz(length) and the derivatives d(x, y, z, thz)/dlength as polynomials of thz.
+    With several candidate degrees, each output gets the one with the lowest k-fold cross validation error"""
+    lengths = np.asarray(lengths, dtype=np.float64)
+    outputs = calibration_outputs(base_avg, tip_avg)
+    if len(degrees) > 1:
+        chosen, cv_errors = select_degrees(lengths, outputs, list(degrees), folds, executor)
+    else:
+        chosen, cv_errors = [degrees[0]] * len(outputs), {}
+
+    # rows padded with leading zeros to a common length, np.poly1d ignores them
+    max_degree = max(chosen)
+    coeffs = np.zeros((len(outputs), max_degree + 1))
+    for i, degree in enumerate(chosen):
+        coeffs[i, max_degree - degree:] = np.polyfit(lengths, outputs[i], degree)
+    polys = [np.poly1d(c) for c in coeffs]
+
+    new_l = np.linspace(lengths.min(), lengths.max())
+    new_outputs = np.array([p(new_l) for p in polys])
+    new_thz = new_outputs[3]
+    # additional estimates of dx,dy,dz as function of thz (essentially fitting terms of the jacobian to angle)
+    derivatives = np.array([p.deriv()(new_l) for p in polys])
+    derivative_coeffs = np.polyfit(new_thz, derivatives.T, derivative_degree).T
+    derivative_fit = np.array([np.poly1d(c)(new_thz) for c in derivative_coeffs])
+    return {'lengths': lengths, 'outputs': outputs, 'degrees': chosen, 'cv_errors': cv_errors, 'coeffs': coeffs,
+            'new_l': new_l, 'new_outputs': new_outputs, 'derivatives': derivatives,
+            'derivative_coeffs': derivative_coeffs, 'derivative_fit': derivative_fit}
+
+
+def save_calibration_fit(fit, prefix):
+    """Write the coefficient files (one row per output, highest power first) as prefix + suffix, returns their names"""
+    xyzthz_file = prefix + XYZTHZ_COEFFS_SUFFIX
+    derivative_file = prefix + DERIVATIVE_COEFFS_SUFFIX
+    np.savetxt(xyzthz_file, fit['coeffs'])
+    np.savetxt(derivative_file, fit['derivative_coeffs'])
+    return xyzthz_file, derivative_file
+
+
+def plot_calibration_fit(fit):
+    """The two figures of the calibration (outputs over length, derivatives over thz). pyplot is imported here so
+    callers can pick the backend first"""
+    import matplotlib.pyplot as plt
+    l, new_l, new_thz = fit['lengths'], fit['new_l'], fit['new_outputs'][3]
+
+    fig_outputs, axes = plt.subplots(4)
+    ylabels = ("Tip X value (m)", "Tip Y value (m)", "Tip Z value (m)", "Tip Rotation Angle (rad) (th_z)")
+    for ax, measured, fitted, ylabel in zip(axes, fit['outputs'], fit['new_outputs'], ylabels):
+        ax.plot(l, measured, "o", new_l, fitted)
+        ax.set(xlabel="cable length (mm)", ylabel=ylabel)
+
+    fig_derivatives, axes = plt.subplots(4)
+    for ax, derivative, fitted, ylabel in zip(axes, fit['derivatives'], fit['derivative_fit'], ylabels):
+        ax.plot(new_thz, derivative, "o", new_thz, fitted)
+        ax.set(xlabel="Tip Rotation Angle (rad) (th_z)", ylabel=ylabel)
+    return fig_outputs, fig_derivatives
@@ -0,0 +1,170 @@
+
+import sys
+import time
+import numpy as np
+from continuum_manip_volumetric_drilling_plugin.calibration_fit import OUTPUT_NAMES
+
+# Runtime evaluation of the calibration polynomials written by fit_calibration.py / free_space_calibration.py
+# (<timestamp>_xyzthz_snake_polyfit_coeffs.txt and <timestamp>_dxdydzdthz_snake_polyfit_coeffs.txt).
+# The polynomials are sampled once on uniform grids, queries are a linear interpolation (an index computation and
+# two table reads) instead of a np.poly1d evaluation or a root finder per control tick:
+#   forward(l)            cable length -> x, y, z, thz
+#   derivative(l)         cable length -> d(x, y, z, thz)/dl
+#   inverse(thz)          thz -> cable length (thz must be monotone over the length range)
+#   derivative_thz(thz)   thz -> d(x, y, z, thz)/dl from the second coefficient file
+# Inputs can be scalars or arrays, queries outside the table range are clamped to it. The grids are refined until
+# the interpolation agrees with the polynomials to within tolerance (m for x, y, z, rad for thz), the reached
+# errors are in max_error.
+
+DEFAULT_LENGTH_RANGE = (-0.20, 0.20)  # range of the 'A' sweep of free_space_calibration.py
+DEFAULT_TOLERANCE = 1e-7
+_INITIAL_SAMPLES = 257
+_MAX_SAMPLES = 1 << 20
+
+
+class _UniformTable:
+    """Linear interpolation of (k, n) values sampled at n uniform points between x0 and x1"""
+
+    def __init__(self, x0, x1, values):
+        self.x0 = float(x0)
+        self.x1 = float(x1)
+        self.values = np.ascontiguousarray(np.atleast_2d(values))
+        self.last = self.values.shape[1] - 1
+        self.scale = self.last / (self.x1 - self.x0)
+        # slope of each interval, so a query is values[i] + frac * slopes[i]
+        self.slopes = np.diff(self.values, axis=1)
+
+    def __call__(self, x):
+        if np.ndim(x) == 0:
+            u = (min(max(float(x), self.x0), self.x1) - self.x0) * self.scale
+            i = min(int(u), self.last - 1)
+            return self.values[:, i] + (u - i) * self.slopes[:, i]
+        u = (np.clip(np.asarray(x, dtype=np.float64), self.x0, self.x1) - self.x0) * self.scale
+        i = np.minimum(u.astype(np.intp), self.last - 1)
+        return self.values[:, i] + (u - i) * self.slopes[:, i]
+
+
+def _refined_table(functions, x0, x1, tolerance, name):
+    """Sample functions (x -> (k, n)) until the interpolation error at the interval midpoints is below tolerance"""
+    samples = _INITIAL_SAMPLES
+    while True:
+        x = np.linspace(x0, x1, samples)
+        table = _UniformTable(x0, x1, functions(x))
+        midpoints = (x[:-1] + x[1:]) / 2.0
+        error = np.abs(table(midpoints) - functions(midpoints)).max(axis=1)
+        if (error <= tolerance).all() or samples >= _MAX_SAMPLES:
+            if not (error <= tolerance).all():
+                print(f"WARNING: {name} table error {error.max():.3g} is above the tolerance {tolerance:.3g}")
+            return table, error
+        samples = 2 * samples - 1
+
+
+def load_coeffs(filename):
+    return np.atleast_2d(np.loadtxt(filename))
+
+
+class CalibrationLUT:
+    def __init__(self, coeffs, derivative_coeffs=None, length_range=DEFAULT_LENGTH_RANGE, tolerance=DEFAULT_TOLERANCE):
+        """coeffs: (4, degree + 1) x, y, z, thz polynomials of the cable length (highest power first),
+        derivative_coeffs: optional (4, degree + 1) d(x, y, z, thz)/dl polynomials of thz"""
+        self.polys = [np.poly1d(c) for c in coeffs]
+        self.derivative_polys = [p.deriv() for p in self.polys]
+        self.length_range = (float(length_range[0]), float(length_range[1]))
+        self.tolerance = tolerance
+        self.max_error = {}
+        l0, l1 = self.length_range
+
+        def forward(l):
+            return np.array([p(l) for p in self.polys])
+
+        def derivative(l):
+            return np.array([p(l) for p in self.derivative_polys])
+
+        self._forward, self.max_error['forward'] = _refined_table(forward, l0, l1, tolerance, 'forward')
+        self._derivative, self.max_error['derivative'] = _refined_table(derivative, l0, l1, tolerance, 'derivative')
+
+        # inverse: thz has to be strictly monotone over the range, the inverse is then sampled on a uniform thz grid
+        dense_l = np.linspace(l0, l1, 4 * len(self._forward.values[0]))
+        dthz = self.derivative_polys[3](dense_l)
+        if not ((dthz > 0).all() or (dthz < 0).all()):
+            raise ValueError(f"thz is not monotone over the cable length range {self.length_range}, "
+                             "restrict length_range to a monotone part to use the inverse")
+        thz = self.polys[3](dense_l)
+        order = np.argsort(thz)
+        thz_sorted, l_sorted = thz[order], dense_l[order]
+        self.thz_range = (float(thz_sorted[0]), float(thz_sorted[-1]))
+
+        def inverse(thz_query):
+            # Newton polishing of the dense interpolation, exact to the polynomial within rounding
+            l = np.interp(thz_query, thz_sorted, l_sorted)
+            for _ in range(3):
+                l = np.clip(l - (self.polys[3](l) - thz_query) / self.derivative_polys[3](l), l0, l1)
+            return l[None, :]
+
+        self._inverse, self.max_error['inverse'] = _refined_table(inverse, self.thz_range[0], self.thz_range[1], tolerance, 'inverse')
+
+        self._derivative_thz = None
+        if derivative_coeffs is not None:
+            derivative_thz_polys = [np.poly1d(c) for c in derivative_coeffs]
+
+            def derivative_thz(t):
+                return np.array([p(t) for p in derivative_thz_polys])
+
+            self._derivative_thz, self.max_error['derivative_thz'] = _refined_table(
+                derivative_thz, self.thz_range[0], self.thz_range[1], tolerance, 'derivative_thz')
+
+    @classmethod
+    def from_files(cls, xyzthz_file, derivative_file=None, length_range=DEFAULT_LENGTH_RANGE, tolerance=DEFAULT_TOLERANCE):
+        return cls(load_coeffs(xyzthz_file), load_coeffs(derivative_file) if derivative_file else None, length_range, tolerance)
+
+    def forward(self, l):
+        """x, y, z, thz: shape (4,) for a scalar l, (4, n) for n lengths"""
+        return self._forward(l)
+
+    def derivative(self, l):
+        return self._derivative(l)
+
+    def inverse(self, thz):
+        """Cable length giving the tip rotation thz: float for a scalar thz, (n,) array for n angles"""
+        l = self._inverse(thz)[0]
+        return float(l) if np.ndim(thz) == 0 else l
+
+    def derivative_thz(self, thz):
+        if self._derivative_thz is None:
+            raise ValueError("No derivative coefficient file was loaded")
+        return self._derivative_thz(thz)
+
+
+def benchmark(lut, repeats=20000):
+    """Time per scalar query (us) of the tables and of the polynomial / root finding they replace"""
+    rng = np.random.default_rng(0)
+    lengths = rng.uniform(*lut.length_range, size=repeats)
+    angles = lut.forward(lengths)[3]
+    results = {}
+
+    def timed(name, function, inputs):
+        t = time.perf_counter()
+        for x in inputs:
+            function(x)
+        results[name] = (time.perf_counter() - t) / len(inputs) * 1e6
+
+    timed('forward', lut.forward, lengths)
+    timed('inverse', lut.inverse, angles)
+    timed('poly1d forward', lambda l: [p(l) for p in lut.polys], lengths)
+    timed('np.roots inverse', lambda t: (lut.polys[3] - t).roots, angles[:repeats // 10])
+    t = time.perf_counter()
+    lut.forward(lengths)
+    results['forward batch of ' + str(repeats)] = (time.perf_counter() - t) / repeats * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    # python3 -m continuum_manip_volumetric_drilling_plugin.calibration_lut <xyzthz coeffs> [<dxdydzdthz coeffs>]
+    if len(sys.argv) < 2:
+        sys.exit("usage: calibration_lut.py <xyzthz_snake_polyfit_coeffs.txt> [dxdydzdthz_snake_polyfit_coeffs.txt]")
+    lut = CalibrationLUT.from_files(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    for table, error in lut.max_error.items():
+        print(f"{table:>15} max error " + " ".join(f"{e:.2g}" for e in error) + f" ({len(getattr(lut, '_' + table).values[0])} samples)")
+    print("outputs: " + ", ".join(OUTPUT_NAMES))
+    for name, us in benchmark(lut).items():
+        print(f"{name:>28}: {us:8.2f} us per query")
@@ -1,6 +1,12 @@
 
+import os
+import threading
 import rospy
-from std_msgs.msg import Bool
+from std_msgs.msg import Bool, String
+from sensor_msgs.msg import PointCloud2
+from vdrilling_msgs.msg import VolumeProp
+from continuum_manip_volumetric_drilling_plugin.voxel_stream import unpack_voxels_removed, is_reset_batch
+from continuum_manip_volumetric_drilling_plugin.occupancy_mirror import OccupancyMirror
 
 class CmvdRosInterfaceBoolPublisher():
     def __init__(self, topic_name, latch=False):
@@ -12,6 +18,103 @@ class CmvdRosInterfaceBoolPublisher():
         self.msg.data = data
         self.pub.publish(self.msg)
 
+class CmvdVoxelsRemovedSubscriber():
+    # callback(indices, colors, time) once per physics tick with the voxels removed in it, see voxel_stream.py.
+    # reset_callback(time), if given, is called first when the volume was reset (resetVoxels, checkpoint restore)
+    def __init__(self, callback, cm_plugin_rosnamespace='/ambf/volumetric_drilling', queue_size=100, reset_callback=None):
+        self.callback = callback
+        self.reset_callback = reset_callback
+        self.sub = rospy.Subscriber(cm_plugin_rosnamespace + "/voxels_removed_batch", PointCloud2, self.msg_callback, queue_size=queue_size)
+
+    def msg_callback(self, msg):
+        indices, colors, time = unpack_voxels_removed(msg)
+        if self.reset_callback is not None and is_reset_batch(msg):
+            self.reset_callback(time)
+        if len(indices):
+            self.callback(indices, colors, time)
+
+class CmvdOccupancyMirror():
+    # OccupancyMirror (occupancy_mirror.py) sized from volume_prop and fed from voxels_removed_batch. Batches that
+    # arrive before volume_prop are kept and applied once the volume size is known. A reset or checkpoint restore of
+    # the volume clears the mirror, the restored removals follow in the same batch
+    def __init__(self, cm_plugin_rosnamespace='/ambf/volumetric_drilling', slab_size=16):
+        self.mirror = None
+        self.slab_size = slab_size
+        self.pending = []
+        self.last_time = None
+        self.prop_sub = rospy.Subscriber(cm_plugin_rosnamespace + "/volume_prop", VolumeProp, self.volume_prop_callback)
+        self.voxels_sub = CmvdVoxelsRemovedSubscriber(self.voxels_removed_callback, cm_plugin_rosnamespace,
+                                                      reset_callback=self.volume_reset_callback)
+
+    def volume_prop_callback(self, msg):
+        if self.mirror is not None and tuple(self.mirror.shape) == tuple(msg.voxelCount):
+            return
+        mirror = OccupancyMirror(msg.voxelCount, msg.dimensions, self.slab_size)
+        for indices in self.pending:
+            mirror.apply(indices)
+        self.pending = []
+        self.mirror = mirror
+
+    def volume_reset_callback(self, time):
+        self.last_time = time
+        if self.mirror is None:
+            self.pending = []
+        else:
+            self.mirror.reset()
+
+    def voxels_removed_callback(self, indices, colors, time):
+        self.last_time = time
+        if self.mirror is None:
+            self.pending.append(indices.copy())
+        else:
+            self.mirror.apply(indices)
+
+    def snapshot(self):
+        # None until volume_prop was received
+        return self.mirror.snapshot() if self.mirror is not None else None
+
+class CmvdCheckpoints():
+    # Saves / restores the drilled volume (removed voxels and hardnesses) to / from a file written by the simulator.
+    # save and restore block until the plugin reports on checkpoint_status and return True if it succeeded
+    def __init__(self, cm_plugin_rosnamespace='/ambf/volumetric_drilling'):
+        self.save_pub = rospy.Publisher(cm_plugin_rosnamespace + "/saveCheckpoint", String, queue_size=1)
+        self.restore_pub = rospy.Publisher(cm_plugin_rosnamespace + "/restoreCheckpoint", String, queue_size=1)
+        self.status_sub = rospy.Subscriber(cm_plugin_rosnamespace + "/checkpoint_status", String, self.status_callback)
+        self.condition = threading.Condition()
+        self.statuses = []
+
+    def status_callback(self, msg):
+        with self.condition:
+            self.statuses.append(msg.data)
+            self.condition.notify_all()
+
+    def request(self, pub, done, path, timeout):
+        path = os.path.abspath(path)
+        deadline = rospy.get_time() + timeout
+        # not latched (a restart of the simulator must not replay it), so wait for the plugin to subscribe
+        while pub.get_num_connections() == 0 and rospy.get_time() < deadline and not rospy.is_shutdown():
+            rospy.sleep(0.01)
+        with self.condition:
+            self.statuses = []
+            pub.publish(String(path))
+            while not rospy.is_shutdown():
+                for status in self.statuses:
+                    verb, _, status_path = status.partition(' ')
+                    if status_path == path:
+                        return verb == done
+                remaining = deadline - rospy.get_time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(min(remaining, 0.1))
+        rospy.logwarn("No checkpoint status for " + path)
+        return False
+
+    def save(self, path, timeout=10.0):
+        return self.request(self.save_pub, 'saved', path, timeout)
+
+    def restore(self, path, timeout=10.0):
+        return self.request(self.restore_pub, 'restored', path, timeout)
+
 class CmvdRosInterface():
     def __init__(self, cm_plugin_rosnamespace='/ambf/volumetric_drilling'):
         self.ros_nh = rospy.get_node_uri()  
@@ -25,6 +128,7 @@ class CmvdRosInterface():
         self.burr_on = CmvdRosInterfaceBoolPublisher(cm_plugin_rosnamespace + "/setBurrOn", latch=True)
         self.toggle_trace_collect = CmvdRosInterfaceBoolPublisher(cm_plugin_rosnamespace + "/set_body_trace_collect", latch=True)
         self.toggle_trace_visible = CmvdRosInterfaceBoolPublisher(cm_plugin_rosnamespace + "/set_body_trace_visible", latch=True)
+        self.checkpoints = CmvdCheckpoints(cm_plugin_rosnamespace)
 
 class AmbfTraceRosInterface():
     def __init__(self, trace_plugin_rosnamespace='/ambf/trace_plugin'):
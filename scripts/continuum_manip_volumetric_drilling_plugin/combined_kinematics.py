@@ -0,0 +1,146 @@
+
+import sys
+import time
+import numpy as np
+from continuum_manip_volumetric_drilling_plugin.ur_kinematics import URKinematics, fk_batch, NUM_JOINTS
+from continuum_manip_volumetric_drilling_plugin.calibration_lut import CalibrationLUT
+
+# Differential kinematics of the UR arm carrying the continuum manipulator (CM), at the burr tip:
+#   arm tip (ur_kinematics) -> arm_T_cm (fixed, calibrated) -> CM base (snake_stick) -> burr (calibration polynomials)
+# The calibration (calibration_fit.py) gives x, y, z, thz of the burr in the CM base frame as functions of the bend
+# cable length, the burr orientation is taken as Rz(thz) in the CM base frame. The task Jacobian maps the 6 arm
+# joint velocities and the cable length velocity to the burr twist in the arm base frame (linear rows first):
+#   combined = CombinedKinematics(CalibrationLUT.from_files(coeffs_file), arm_T_cm)
+#   T, J = combined.evaluate(q, length)           # (4, 4), (6, 7), views of internal buffers
+#   dq = dls_solve(J, twist, damping=0.01)        # 7 joint velocities, damped least squares
+# evaluate_batch and dls_solve also take N configurations at once.
+
+NUM_TASK_JOINTS = NUM_JOINTS + 1
+DEFAULT_DAMPING = 0.01
+
+
+def _z_rotations(thz):
+    c, s = np.cos(thz), np.sin(thz)
+    r = np.zeros(np.shape(thz) + (3, 3))
+    r[..., 0, 0] = c
+    r[..., 0, 1] = -s
+    r[..., 1, 0] = s
+    r[..., 1, 1] = c
+    r[..., 2, 2] = 1.0
+    return r
+
+
+class CombinedKinematics:
+    def __init__(self, lut, arm_T_cm=None, robot_type='UR5'):
+        """lut: CalibrationLUT of the CM, arm_T_cm: 4x4 transform from the arm tip to the CM base (identity if
+        None)"""
+        self.lut = lut
+        self.arm = URKinematics(robot_type)
+        self.robot_type = robot_type
+        self.arm_T_cm = np.eye(4) if arm_T_cm is None else np.asarray(arm_T_cm, dtype=np.float64)
+        self.T = np.eye(4)
+        self.jacobian = np.zeros((6, NUM_TASK_JOINTS))
+        self._T_cm = np.zeros((4, 4))
+        self._cm_tip = np.eye(4)
+        self._lever = np.zeros(3)
+
+    def compose(self, arm_T, arm_jacobian, length):
+        """Burr transform and task Jacobian from an arm FK result (URKinematics.fk) and the cable length"""
+        x, y, z, thz = self.lut.forward(length)
+        dx, dy, dz, dthz = self.lut.derivative(length)
+        c, s = np.cos(thz), np.sin(thz)
+        cm_tip = self._cm_tip
+        cm_tip[0, 0] = c
+        cm_tip[0, 1] = -s
+        cm_tip[1, 0] = s
+        cm_tip[1, 1] = c
+        cm_tip[0, 3] = x
+        cm_tip[1, 3] = y
+        cm_tip[2, 3] = z
+        np.matmul(arm_T, self.arm_T_cm, out=self._T_cm)
+        np.matmul(self._T_cm, cm_tip, out=self.T)
+
+        # arm columns: the twist at the arm tip moved to the burr, v + w x (p_burr - p_arm)
+        J = self.jacobian
+        np.subtract(self.T[0:3, 3], arm_T[0:3, 3], out=self._lever)
+        J[0:3, 0:NUM_JOINTS] = arm_jacobian[0:3] + np.cross(arm_jacobian[3:6].T, self._lever).T
+        J[3:6, 0:NUM_JOINTS] = arm_jacobian[3:6]
+        # cable column: burr velocity and rotation rate about the CM base z axis per unit length
+        r_cm = self._T_cm[0:3, 0:3]
+        J[0:3, NUM_JOINTS] = r_cm @ (dx, dy, dz)
+        J[3:6, NUM_JOINTS] = r_cm[:, 2] * dthz
+        return self.T, J
+
+    def evaluate(self, q, length):
+        """(4, 4) burr transform in the arm base frame and (6, 7) task Jacobian for the arm joints q and the cable
+        length. Both are overwritten by the next call"""
+        arm_T, arm_jacobian = self.arm.fk(q)
+        return self.compose(arm_T, arm_jacobian, length)
+
+    def evaluate_batch(self, q, lengths):
+        """(N, 6) arm joints and (N,) cable lengths -> (N, 4, 4) burr transforms and (N, 6, 7) task Jacobians"""
+        arm_T, arm_jacobians = fk_batch(q, self.robot_type)
+        lengths = np.asarray(lengths, dtype=np.float64).reshape(-1)
+        x, y, z, thz = self.lut.forward(lengths)
+        derivatives = self.lut.derivative(lengths)
+        cm_tip = np.zeros((len(lengths), 4, 4))
+        cm_tip[:, 0:3, 0:3] = _z_rotations(thz)
+        cm_tip[:, 0:3, 3] = np.stack((x, y, z), axis=1)
+        cm_tip[:, 3, 3] = 1.0
+        T_cm = arm_T @ self.arm_T_cm
+        T = T_cm @ cm_tip
+
+        jacobians = np.empty((len(lengths), 6, NUM_TASK_JOINTS))
+        lever = T[:, None, 0:3, 3] - arm_T[:, None, 0:3, 3]
+        angular = np.swapaxes(arm_jacobians[:, 3:6], 1, 2)
+        jacobians[:, 0:3, 0:NUM_JOINTS] = arm_jacobians[:, 0:3] + np.swapaxes(np.cross(angular, lever), 1, 2)
+        jacobians[:, 3:6, 0:NUM_JOINTS] = arm_jacobians[:, 3:6]
+        jacobians[:, 0:3, NUM_JOINTS] = np.einsum('nij,jn->ni', T_cm[:, 0:3, 0:3], derivatives[0:3])
+        jacobians[:, 3:6, NUM_JOINTS] = T_cm[:, 0:3, 2] * derivatives[3][:, None]
+        return T, jacobians
+
+
+def dls_solve(J, twist, damping=DEFAULT_DAMPING, weights=None):
+    """Damped least squares joint velocities W J^T (J W J^T + damping^2 I)^-1 twist for (..., 6, n) Jacobians and
+    (..., 6) twists. weights: optional (n,) joint weights W (larger moves that joint more)"""
+    J = np.asarray(J, dtype=np.float64)
+    twist = np.asarray(twist, dtype=np.float64)
+    JW = J if weights is None else J * np.asarray(weights, dtype=np.float64)
+    JWT = np.swapaxes(JW, -1, -2)
+    A = J @ JWT + damping ** 2 * np.eye(J.shape[-2])
+    return (JWT @ np.linalg.solve(A, twist[..., None]))[..., 0]
+
+
+def benchmark(combined, repeats=5000, batch=10000):
+    """us per configuration of evaluate (+ dls_solve) and of evaluate_batch"""
+    rng = np.random.default_rng(0)
+    q = rng.uniform(-np.pi, np.pi, size=(repeats, NUM_JOINTS))
+    lengths = rng.uniform(*combined.lut.length_range, size=repeats)
+    twist = np.array([0.01, 0.0, 0.0, 0.0, 0.0, 0.1])
+    results = {}
+    q_lists = q.tolist()
+    t = time.perf_counter()
+    for qi, l in zip(q_lists, lengths):
+        combined.evaluate(qi, l)
+    results['evaluate'] = (time.perf_counter() - t) / repeats * 1e6
+    t = time.perf_counter()
+    for qi, l in zip(q_lists, lengths):
+        _, J = combined.evaluate(qi, l)
+        dls_solve(J, twist)
+    results['evaluate + dls_solve'] = (time.perf_counter() - t) / repeats * 1e6
+    q = rng.uniform(-np.pi, np.pi, size=(batch, NUM_JOINTS))
+    lengths = rng.uniform(*combined.lut.length_range, size=batch)
+    t = time.perf_counter()
+    _, J = combined.evaluate_batch(q, lengths)
+    dls_solve(J, np.broadcast_to(twist, (batch, 6)))
+    results['evaluate_batch + dls_solve (N=' + str(batch) + ')'] = (time.perf_counter() - t) / batch * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    # python3 -m continuum_manip_volumetric_drilling_plugin.combined_kinematics <xyzthz coeffs> [UR5|UR10]
+    if len(sys.argv) < 2:
+        sys.exit("usage: combined_kinematics.py <xyzthz_snake_polyfit_coeffs.txt> [UR5|UR10]")
+    combined = CombinedKinematics(CalibrationLUT.from_files(sys.argv[1]), robot_type=sys.argv[2] if len(sys.argv) > 2 else 'UR5')
+    for name, us in benchmark(combined).items():
+        print(f"{name:>40}: {us:8.2f} us per configuration")
@@ -0,0 +1,217 @@
+import struct
+import numpy as np
+
+# Binary hardness file layout (all little endian), read by afVolmetricDrillingPlugin::hardnessBehaviorInit
+#   magic         8 bytes   b"CMVDHRD\0"
+#   version       uint32
+#   dtype         uint32    1 = float32, 2 = uint8 (value / 255)
+#   dims          3 x uint32, size of each stored axis
+#   brick size    uint32    0 for dense files (also keeps the following fields 8 byte aligned)
+#   axis order    8 bytes   stored axis -> nrrd axis, e.g. b"+Y-X+Z\0\0" (sign is the direction)
+#   origin        3 x float64, LPS space origin of the nrrd (mm)
+#   spacing       3 x float64, voxel spacing along the nrrd axes (mm)
+#   padding up to HEADER_SIZE bytes, then the payload
+# Version 1 (dense): all values in C order (last axis fastest).
+# Version 2 (bricks): the volume is padded to whole brick size^3 bricks, the payload is an int32 index over the brick
+# grid (C order, -1 = all zero brick, which is not stored) followed by the stored bricks (each in C order)
+MAGIC = b"CMVDHRD\0"
+VERSION = 1
+BRICK_VERSION = 2
+DEFAULT_BRICK_SIZE = 8
+HEADER_SIZE = 128
+DTYPE_FLOAT32 = 1
+DTYPE_UINT8 = 2
+_HEADER_STRUCT = struct.Struct("<8sII3II8s3d3d")
+
+# voxels at or below this HU value are air and get a hardness of 0
+AIR_HU = -1000
+# the hardness volume is stored as (y, -x, z) of the nrrd to match the voxel indexing of the AMBF volume
+HARDNESS_AXIS_ORDER = "+Y-X+Z"
+HARDNESS_STAGE_PREFIX = 'hardness_'
+
+_DTYPE_CODES = {'float32': DTYPE_FLOAT32, 'uint8': DTYPE_UINT8}
+_NUMPY_DTYPES = {DTYPE_FLOAT32: np.float32, DTYPE_UINT8: np.uint8}
+
+
+def is_binary_hardness_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def pack_header(dims, dtype='float32', axis_order=HARDNESS_AXIS_ORDER, origin=(0.0, 0.0, 0.0), spacing=(1.0, 1.0, 1.0), brick_size=0):
+    if dtype not in _DTYPE_CODES:
+        raise ValueError("Unsupported hardness dtype: " + str(dtype))
+    version = BRICK_VERSION if brick_size else VERSION
+    header = _HEADER_STRUCT.pack(MAGIC, version, _DTYPE_CODES[dtype], *[int(d) for d in dims], int(brick_size),
+                                 axis_order.encode('ascii'), *[float(o) for o in origin], *[float(s) for s in spacing])
+    return header.ljust(HEADER_SIZE, b"\0")
+
+
+def unpack_header(raw):
+    values = _HEADER_STRUCT.unpack(raw[:_HEADER_STRUCT.size])
+    if values[0] != MAGIC:
+        raise ValueError("Not a binary hardness file (bad magic)")
+    if values[1] not in (VERSION, BRICK_VERSION):
+        raise ValueError("Unsupported hardness file version: " + str(values[1]))
+    return {'version': values[1],
+            'dtype': values[2],
+            'dims': tuple(values[3:6]),
+            'brick_size': values[6],
+            'axis_order': values[7].rstrip(b"\0").decode('ascii'),
+            'origin': np.array(values[8:11]),
+            'spacing': np.array(values[11:14])}
+
+
+def encode_hardness(data, dtype='float32'):
+    # data is expected to already be normalized between 0 and 1
+    if dtype == 'uint8':
+        return np.rint(np.clip(data, 0.0, 1.0) * 255.0).astype(np.uint8)
+    return np.ascontiguousarray(data, dtype=np.float32)
+
+
+def write_hardness_file(filename, data, dtype='float32', axis_order=HARDNESS_AXIS_ORDER, origin=(0.0, 0.0, 0.0), spacing=(1.0, 1.0, 1.0)):
+    payload = encode_hardness(data, dtype)
+    with open(filename, 'wb') as f:
+        f.write(pack_header(payload.shape, dtype, axis_order, origin, spacing))
+        # single contiguous write of the whole volume
+        f.write(np.ascontiguousarray(payload).astype(payload.dtype.newbyteorder('<'), copy=False).tobytes())
+
+
+def to_bricks(data, brick_size=DEFAULT_BRICK_SIZE):
+    """Split a 3D array into brick_size^3 bricks. Returns (index, bricks): index is the int32 brick grid with -1 for
+    all zero bricks and the position in bricks otherwise, bricks is (n, brick_size, brick_size, brick_size)"""
+    if brick_size <= 0 or brick_size & (brick_size - 1):
+        raise ValueError("Brick size must be a power of two, got " + str(brick_size))
+    grid = tuple(-(-int(n) // brick_size) for n in data.shape)
+    padded = np.zeros(tuple(g * brick_size for g in grid), dtype=data.dtype)
+    padded[:data.shape[0], :data.shape[1], :data.shape[2]] = data
+    blocks = padded.reshape(grid[0], brick_size, grid[1], brick_size, grid[2], brick_size).transpose(0, 2, 4, 1, 3, 5)
+    occupied = blocks.any(axis=(3, 4, 5))
+    index = np.full(grid, -1, dtype=np.int32)
+    index[occupied] = np.arange(np.count_nonzero(occupied), dtype=np.int32)
+    return index, blocks[occupied]
+
+
+def from_bricks(index, bricks, dims):
+    brick_size = bricks.shape[1]
+    grid = index.shape
+    blocks = np.zeros(grid + (brick_size,) * 3, dtype=bricks.dtype)
+    blocks[index >= 0] = bricks[index[index >= 0]]
+    data = blocks.transpose(0, 3, 1, 4, 2, 5).reshape(tuple(g * brick_size for g in grid))
+    return data[:dims[0], :dims[1], :dims[2]]
+
+
+def write_hardness_bricks(filename, data, dtype='float32', brick_size=DEFAULT_BRICK_SIZE, axis_order=HARDNESS_AXIS_ORDER,
+                          origin=(0.0, 0.0, 0.0), spacing=(1.0, 1.0, 1.0)):
+    """Sparse version of write_hardness_file, bricks that only contain air (0) are not stored"""
+    payload = encode_hardness(data, dtype)
+    index, bricks = to_bricks(payload, brick_size)
+    with open(filename, 'wb') as f:
+        f.write(pack_header(payload.shape, dtype, axis_order, origin, spacing, brick_size=brick_size))
+        f.write(index.astype('<i4', copy=False).tobytes())
+        f.write(np.ascontiguousarray(bricks).astype(bricks.dtype.newbyteorder('<'), copy=False).tobytes())
+    return len(bricks), index.size
+
+
+def create_hardness_file(filename, dims, dtype='float32', axis_order=HARDNESS_AXIS_ORDER, origin=(0.0, 0.0, 0.0), spacing=(1.0, 1.0, 1.0)):
+    """Write the header and return a writable memory map of the (zero filled) payload, so large volumes can be
+    filled in piece by piece. Values written to it must already be encoded (see encode_hardness)"""
+    if dtype not in _DTYPE_CODES:
+        raise ValueError("Unsupported hardness dtype: " + str(dtype))
+    numpy_dtype = np.dtype(_NUMPY_DTYPES[_DTYPE_CODES[dtype]]).newbyteorder('<')
+    with open(filename, 'wb') as f:
+        f.write(pack_header(dims, dtype, axis_order, origin, spacing))
+        f.truncate(HEADER_SIZE + int(np.prod(dims)) * numpy_dtype.itemsize)
+    return np.memmap(filename, dtype=numpy_dtype, mode='r+', offset=HEADER_SIZE, shape=tuple(int(d) for d in dims))
+
+
+def hu_to_hardness(data, min_hu, max_hu, air_hu=AIR_HU):
+    # voxels above air_hu are scaled between 0 and 1 using the (global) min_hu / max_hu, air is 0
+    if min_hu is None or min_hu == max_hu:
+        if min_hu is None or min_hu == air_hu:
+            return np.zeros(data.shape, dtype=np.float32)
+        return np.ones(data.shape, dtype=np.float32)
+    hardness = np.zeros(data.shape, dtype=np.float32)
+    mask = data > air_hu
+    hardness[mask] = (data[mask] - np.float32(min_hu)) / np.float32(max_hu - min_hu)
+    return hardness
+
+
+def to_hardness_axes(data):
+    # data is (x by y by z) but we want (y by x by z)
+    data = np.swapaxes(data, 0, 1)
+    # we want to flip the y' axis if axes are (x' by y' by z')
+    return np.flip(data, 1)
+
+
+def volume_to_hardness(data):
+    """Whole nrrd HU volume (x, y, z) -> hardness values between 0 and 1 in the stored (HARDNESS_AXIS_ORDER) layout"""
+    air = data <= AIR_HU
+    min_hu = np.min(data[~air]) if not air.all() else None
+    max_hu = np.max(data)
+    del air
+    return to_hardness_axes(hu_to_hardness(data, min_hu, max_hu))
+
+
+def hardness_stage_params(format, dtype, brick_size=DEFAULT_BRICK_SIZE):
+    # everything that changes the hardness file for a given nrrd, recorded in the asset manifest
+    params = {'format': format, 'dtype': dtype if format != 'csv' else 'text', 'air_hu': AIR_HU, 'axis_order': HARDNESS_AXIS_ORDER}
+    if format == 'bricks':
+        params['brick_size'] = brick_size
+    return params
+
+
+def write_hardness_csv(output_filename, data):
+    # first line is the dimensions of the data (x by y by z), then one value per line with z changing fastest
+    data_size = data.shape
+    with open(output_filename, 'w') as f:
+        f.write(str(data_size[0]) + "," + str(data_size[1]) + "," + str(data_size[2]) + "\n")
+        np.savetxt(f, data.reshape(-1), fmt='%.17g')
+
+
+def save_hardness(output_filename, data, header, format='bin', dtype='float32', brick_size=DEFAULT_BRICK_SIZE):
+    """Convert a whole nrrd HU volume (as returned by nrrd.read) and write it as a dense binary, sparse brick (bricks)
+    or csv hardness file"""
+    hardness = volume_to_hardness(data)
+    spacing_mm = np.linalg.norm(header['space directions'], axis=1)
+    if format == 'bin':
+        write_hardness_file(output_filename, hardness, dtype=dtype, axis_order=HARDNESS_AXIS_ORDER,
+                            origin=header['space origin'], spacing=spacing_mm)
+    elif format == 'bricks':
+        stored, total = write_hardness_bricks(output_filename, hardness, dtype=dtype, brick_size=brick_size,
+                                              axis_order=HARDNESS_AXIS_ORDER, origin=header['space origin'], spacing=spacing_mm)
+        print("Stored " + str(stored) + " of " + str(total) + " hardness bricks")
+    else:
+        write_hardness_csv(output_filename, hardness)
+
+
+def read_hardness_file(filename, mmap=True):
+    """Return (hardness, header). hardness is a (memory mapped if mmap) array of raw stored values,
+    use decode_hardness to get values between 0 and 1. Brick files are expanded to a dense (not memory mapped) array"""
+    with open(filename, 'rb') as f:
+        header = unpack_header(f.read(HEADER_SIZE))
+    dtype = np.dtype(_NUMPY_DTYPES[header['dtype']]).newbyteorder('<')
+    if header['version'] == BRICK_VERSION:
+        b = header['brick_size']
+        grid = tuple(-(-int(n) // b) for n in header['dims'])
+        index = np.fromfile(filename, dtype='<i4', count=int(np.prod(grid)), offset=HEADER_SIZE).reshape(grid)
+        bricks = np.fromfile(filename, dtype=dtype, offset=HEADER_SIZE + index.nbytes).reshape(-1, b, b, b)
+        return from_bricks(index, bricks, header['dims']), header
+    if mmap:
+        data = np.memmap(filename, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=header['dims'])
+    else:
+        data = np.fromfile(filename, dtype=dtype, offset=HEADER_SIZE).reshape(header['dims'])
+    return data, header
+
+
+def decode_hardness(data, header):
+    if header['dtype'] == DTYPE_UINT8:
+        return data.astype(np.float32) / 255.0
+    return np.asarray(data, dtype=np.float32)
+
+
+def read_hardness_csv(filename):
+    with open(filename, 'r') as f:
+        dims = tuple(int(d) for d in f.readline().split(','))
+        data = np.loadtxt(f, dtype=np.float64)
+    return data.reshape(dims)
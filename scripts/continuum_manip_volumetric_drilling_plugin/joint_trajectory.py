@@ -0,0 +1,116 @@
+
+import bisect
+import numpy as np
+
+# Piecewise polynomial interpolation of a time parameterized joint trajectory (no ROS dependency), evaluated by
+# the bridge loop at every tick instead of streaming one setpoint per tick:
+#   trajectory = JointTrajectorySpline(times, positions, velocities)
+#   position, velocity, done = trajectory.sample(t)
+# Segments are quintic where accelerations are given, cubic (Hermite) where velocities are given, and cubic with
+# estimated velocities (zero at the ends) where only positions are. Every segment is stored as a degree 5
+# polynomial so evaluation is the same for all of them.
+
+DEGREE = 5
+
+
+def estimate_velocities(times, positions):
+    """Velocities at the waypoints from the neighbouring segments (mean of the slopes where they agree in sign,
+    zero at turning points and at both ends)"""
+    slopes = np.diff(positions, axis=0) / np.diff(times)[:, None]
+    velocities = np.zeros_like(positions)
+    inner = (slopes[:-1] + slopes[1:]) / 2.0
+    velocities[1:-1] = np.where(slopes[:-1] * slopes[1:] > 0, inner, 0.0)
+    return velocities
+
+
+def segment_coefficients(duration, p0, p1, v0, v1, a0=None, a1=None):
+    """(6, joints) coefficients (constant term first) of the quintic, or of the cubic if no accelerations"""
+    T = duration
+    c = np.zeros((DEGREE + 1,) + np.shape(p0))
+    dp = p1 - p0
+    c[0] = p0
+    c[1] = v0
+    if a0 is None or a1 is None:
+        c[2] = (3 * dp - (2 * v0 + v1) * T) / T ** 2
+        c[3] = (-2 * dp + (v0 + v1) * T) / T ** 3
+    else:
+        c[2] = a0 / 2.0
+        c[3] = (20 * dp - (8 * v1 + 12 * v0) * T - (3 * a0 - a1) * T ** 2) / (2 * T ** 3)
+        c[4] = (-30 * dp + (14 * v1 + 16 * v0) * T + (3 * a0 - 2 * a1) * T ** 2) / (2 * T ** 4)
+        c[5] = (12 * dp - 6 * (v1 + v0) * T - (a0 - a1) * T ** 2) / (2 * T ** 5)
+    return c
+
+
+class JointTrajectorySpline:
+    def __init__(self, times, positions, velocities=None, accelerations=None):
+        """times: (n,) strictly increasing seconds from the start, positions: (n, joints), velocities /
+        accelerations: optional (n, joints)"""
+        self.times = np.asarray(times, dtype=np.float64)
+        positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+        if len(self.times) != len(positions) or len(self.times) < 1:
+            raise ValueError(f"{len(self.times)} times for {len(positions)} waypoints")
+        if (np.diff(self.times) <= 0).any():
+            raise ValueError("Waypoint times must be strictly increasing")
+        if velocities is None:
+            velocities = estimate_velocities(self.times, positions) if len(positions) > 1 else np.zeros_like(positions)
+        velocities = np.atleast_2d(np.asarray(velocities, dtype=np.float64))
+        if accelerations is not None:
+            accelerations = np.atleast_2d(np.asarray(accelerations, dtype=np.float64))
+        if velocities.shape != positions.shape or (accelerations is not None and accelerations.shape != positions.shape):
+            raise ValueError("Velocities and accelerations need one value per joint and waypoint")
+
+        self.positions = positions
+        self.velocities = velocities
+        self.num_joints = positions.shape[1]
+        self.duration = float(self.times[-1])
+        self.coeffs = np.zeros((max(len(self.times) - 1, 0), DEGREE + 1, self.num_joints))
+        for i in range(len(self.times) - 1):
+            self.coeffs[i] = segment_coefficients(
+                self.times[i + 1] - self.times[i], positions[i], positions[i + 1], velocities[i], velocities[i + 1],
+                None if accelerations is None else accelerations[i], None if accelerations is None else accelerations[i + 1])
+        self._times_list = self.times.tolist()
+        self._segment = 0
+        self.position = np.zeros(self.num_joints)
+        self.velocity = np.zeros(self.num_joints)
+
+    def _find_segment(self, t):
+        # ticks move forward, so the segment of the last call is usually still the right one
+        i = self._segment
+        if not (self._times_list[i] <= t < self._times_list[i + 1]):
+            i = min(max(bisect.bisect_right(self._times_list, t) - 1, 0), len(self.coeffs) - 1)
+            self._segment = i
+        return i
+
+    def sample(self, t):
+        """(position, velocity, done) at t seconds from the start. Before the first waypoint the first position is
+        held, after the last one the last position with zero velocity (done = True). The arrays are reused"""
+        if len(self.coeffs) == 0 or t >= self.duration:
+            self.position[:] = self.positions[-1]
+            self.velocity[:] = 0.0 if t >= self.duration else self.velocities[-1]
+            return self.position, self.velocity, t >= self.duration
+        if t <= self.times[0]:
+            self.position[:] = self.positions[0]
+            self.velocity[:] = 0.0
+            return self.position, self.velocity, False
+        i = self._find_segment(t)
+        c = self.coeffs[i]
+        s = t - self._times_list[i]
+        # Horner on position and velocity
+        position = self.position
+        velocity = self.velocity
+        position[:] = c[DEGREE]
+        velocity[:] = DEGREE * c[DEGREE]
+        for k in range(DEGREE - 1, 0, -1):
+            position *= s
+            position += c[k]
+            velocity *= s
+            velocity += k * c[k]
+        position *= s
+        position += c[0]
+        return position, velocity, False
+
+    def progress(self, t):
+        """Fraction of the duration elapsed at t, in [0, 1]"""
+        if self.duration <= 0:
+            return 1.0
+        return min(max(t / self.duration, 0.0), 1.0)
@@ -0,0 +1,139 @@
+
+import math
+import time
+import numpy as np
+
+# Timing of a fixed rate control loop (no ROS dependency). Every cycle is split in named phases:
+#   profiler.start_cycle()
+#   ... profiler.mark('read') ... profiler.mark('publish') ...
+#   profiler.end_cycle()
+# Phase durations, the busy time of the cycle and the start time jitter (start to start interval - period) go into
+# fixed size log scale histograms, summary() gives p50 / p99 / max per window. The last trace_capacity cycles are
+# also kept in a preallocated trace that dump_csv writes out.
+
+HISTOGRAM_MIN = 1e-6  # s, first bin
+HISTOGRAM_DECADES = 6  # up to 1 s, longer durations go in the last bin
+BINS_PER_DECADE = 20
+DEFAULT_TRACE_CAPACITY = 100000
+# a cycle that starts more than this fraction of a period late counts as an overrun
+DEFAULT_OVERRUN_MARGIN = 0.1
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = np.zeros(HISTOGRAM_DECADES * BINS_PER_DECADE + 1, dtype=np.int64)
+        self.max = 0.0
+        self.total = 0.0
+
+    def add(self, value):
+        if value <= HISTOGRAM_MIN:
+            i = 0
+        else:
+            i = min(int(math.log10(value / HISTOGRAM_MIN) * BINS_PER_DECADE) + 1, len(self.counts) - 1)
+        self.counts[i] += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, p):
+        """Upper edge of the bin holding the p-th percentile (capped by the max seen)"""
+        n = self.count()
+        if n == 0:
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), math.ceil(p / 100.0 * n)))
+        return min(HISTOGRAM_MIN * 10 ** (i / BINS_PER_DECADE), self.max)
+
+    def reset(self):
+        self.counts[:] = 0
+        self.max = 0.0
+        self.total = 0.0
+
+
+class LoopProfiler:
+    def __init__(self, phases, rate_hz, trace_capacity=DEFAULT_TRACE_CAPACITY, overrun_margin=DEFAULT_OVERRUN_MARGIN):
+        self.phases = tuple(phases)
+        self.period = 1.0 / rate_hz
+        self.overrun_margin = overrun_margin
+        self.histograms = {name: Histogram() for name in self.phases + ('cycle', 'jitter')}
+        self.overruns = 0
+        self.cycles = 0
+        self.total_cycles = 0
+        self.total_overruns = 0
+        # t_start, one column per phase, cycle busy time, start to start interval
+        self.trace_columns = ('t_start',) + self.phases + ('cycle', 'interval')
+        self._column = {name: i for i, name in enumerate(self.trace_columns)}
+        self.trace = np.zeros((trace_capacity, len(self.trace_columns)))
+        self._row = self.trace[0]
+        self._t_start = None
+        self._t_mark = None
+
+    def start_cycle(self):
+        t = time.perf_counter()
+        self._row = self.trace[self.total_cycles % len(self.trace)]
+        self._row[:] = 0.0
+        self._row[0] = t
+        if self._t_start is not None:
+            interval = t - self._t_start
+            self._row[-1] = interval
+            self.histograms['jitter'].add(abs(interval - self.period))
+            if interval > self.period * (1.0 + self.overrun_margin):
+                self.overruns += 1
+                self.total_overruns += 1
+        self._t_start = t
+        self._t_mark = t
+
+    def mark(self, phase):
+        """End the phase that started at the previous mark (or at the start of the cycle)"""
+        t = time.perf_counter()
+        duration = t - self._t_mark
+        self._t_mark = t
+        self.histograms[phase].add(duration)
+        self._row[self._column[phase]] += duration
+
+    def end_cycle(self):
+        busy = time.perf_counter() - self._t_start
+        self.histograms['cycle'].add(busy)
+        self._row[-2] = busy
+        self.cycles += 1
+        self.total_cycles += 1
+        return busy
+
+    def summary(self, reset=True):
+        """{name: {count, mean, p50, p99, max}} in seconds for every phase, 'cycle' and 'jitter', plus the cycle and
+        overrun counts of the window. Starts a new window if reset"""
+        stats = {'cycles': self.cycles, 'overruns': self.overruns}
+        for name, histogram in self.histograms.items():
+            n = histogram.count()
+            stats[name] = {'count': n, 'mean': histogram.total / n if n else 0.0, 'p50': histogram.percentile(50),
+                           'p99': histogram.percentile(99), 'max': histogram.max}
+            if reset:
+                histogram.reset()
+        if reset:
+            self.cycles = 0
+            self.overruns = 0
+        return stats
+
+    def trace_rows(self):
+        """Recorded cycles, oldest first"""
+        n = min(self.total_cycles, len(self.trace))
+        start = (self.total_cycles - n) % len(self.trace)
+        return np.roll(self.trace, -start, axis=0)[:n] if n == len(self.trace) else self.trace[:n]
+
+    def dump_csv(self, filename):
+        rows = self.trace_rows().copy()
+        if len(rows):
+            rows[:, 0] -= rows[0, 0]
+        np.savetxt(filename, rows, delimiter=',', header=','.join(self.trace_columns), comments='', fmt='%.9f')
+        return len(rows)
+
+
+def format_summary(stats, scale=1e3, unit='ms'):
+    """One line per histogram of a summary()"""
+    lines = [f"{stats['cycles']} cycles, {stats['overruns']} overruns"]
+    for name, s in stats.items():
+        if isinstance(s, dict):
+            lines.append(f"  {name:>10}: p50 {s['p50'] * scale:8.3f} p99 {s['p99'] * scale:8.3f} max {s['max'] * scale:8.3f} {unit}")
+    return "\n".join(lines)
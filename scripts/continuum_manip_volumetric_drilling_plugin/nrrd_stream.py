@@ -0,0 +1,150 @@
+
+import bz2
+import os
+import zlib
+import nrrd
+import numpy as np
+
+# Reads a 3D nrrd volume in slabs along its last (Z) axis so the volume preparation scripts never need the
+# whole volume in memory. nrrd stores the first axis fastest, so each Z-slab is one contiguous block of the file:
+# raw data is memory mapped, gzip/bzip2 data is decompressed incrementally. Any other encoding (e.g. ascii) falls
+# back to a regular nrrd.read of the whole volume.
+
+_NRRD_TYPES = {
+    'i1': ['signed char', 'int8', 'int8_t'],
+    'u1': ['uchar', 'unsigned char', 'uint8', 'uint8_t'],
+    'i2': ['short', 'short int', 'signed short', 'signed short int', 'int16', 'int16_t'],
+    'u2': ['ushort', 'unsigned short', 'unsigned short int', 'uint16', 'uint16_t'],
+    'i4': ['int', 'signed int', 'int32', 'int32_t'],
+    'u4': ['uint', 'unsigned int', 'uint32', 'uint32_t'],
+    'i8': ['longlong', 'long long', 'long long int', 'signed long long', 'signed long long int', 'int64', 'int64_t'],
+    'u8': ['ulonglong', 'unsigned long long', 'unsigned long long int', 'uint64', 'uint64_t'],
+    'f4': ['float'],
+    'f8': ['double'],
+}
+_NRRD_TYPE_TO_NUMPY = {name: code for code, names in _NRRD_TYPES.items() for name in names}
+
+# bytes of working memory per voxel of a slab on top of the stored value: float64 normalization plus the
+# uint8/RGBA image (or float32 hardness) built from it
+WORKING_BYTES_PER_VOXEL = 16
+DEFAULT_MAX_MEMORY_MB = 512
+
+
+def nrrd_dtype(header):
+    code = _NRRD_TYPE_TO_NUMPY.get(header['type'])
+    if code is None:
+        raise ValueError("Unsupported nrrd type: " + str(header['type']))
+    dtype = np.dtype(code)
+    if dtype.itemsize > 1:
+        dtype = dtype.newbyteorder('<' if header.get('endian', 'little') == 'little' else '>')
+    return dtype
+
+
+def slab_depth_for_memory(sizes, dtype, max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+    bytes_per_slice = int(sizes[0]) * int(sizes[1]) * (np.dtype(dtype).itemsize + WORKING_BYTES_PER_VOXEL)
+    depth = int(max_memory_mb * 1024 * 1024) // bytes_per_slice
+    return int(min(max(depth, 1), sizes[2]))
+
+
+class NrrdSlabReader:
+    def __init__(self, filename, max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+        self.filename = filename
+        with open(filename, 'rb') as fh:
+            self.header = nrrd.read_header(fh)
+            self._data_offset = fh.tell()
+        self.sizes = tuple(int(s) for s in self.header['sizes'])
+        if len(self.sizes) != 3:
+            raise ValueError("Expected a 3D nrrd volume, got sizes: " + str(self.sizes))
+        self.dtype = nrrd_dtype(self.header)
+        self.encoding = self.header.get('encoding', 'raw')
+        self.slab_depth = slab_depth_for_memory(self.sizes, self.dtype, max_memory_mb)
+
+        self._data_file = filename
+        if 'data file' in self.header or 'datafile' in self.header:
+            data_file = self.header.get('data file', self.header.get('datafile'))
+            if data_file.startswith('LIST') or len(data_file.split()) > 1:
+                raise ValueError("Multi-file nrrd data is not supported for streaming: " + filename)
+            if not os.path.isabs(data_file):
+                data_file = os.path.join(os.path.dirname(filename), data_file)
+            self._data_file = data_file
+            self._data_offset = 0
+
+    @property
+    def shape(self):
+        return self.sizes
+
+    def _slab_bytes(self, depth):
+        return self.sizes[0] * self.sizes[1] * depth * self.dtype.itemsize
+
+    def _payload_offset(self, fh):
+        # honour 'line skip' and 'byte skip' ('byte skip: -1' means the data is at the end of a raw file)
+        fh.seek(self._data_offset)
+        for _ in range(int(self.header.get('line skip', 0))):
+            fh.readline()
+        byte_skip = int(self.header.get('byte skip', 0))
+        if byte_skip == -1:
+            if self.encoding != 'raw':
+                raise ValueError("'byte skip: -1' is only valid for raw encoding")
+            return os.path.getsize(self._data_file) - self._slab_bytes(self.sizes[2])
+        return fh.tell() + byte_skip
+
+    def _iter_raw(self):
+        with open(self._data_file, 'rb') as fh:
+            offset = self._payload_offset(fh)
+        volume = np.memmap(self._data_file, dtype=self.dtype, mode='r', offset=offset, shape=self.sizes, order='F')
+        for z0 in range(0, self.sizes[2], self.slab_depth):
+            z1 = min(z0 + self.slab_depth, self.sizes[2])
+            yield z0, np.array(volume[:, :, z0:z1])
+        del volume
+
+    def _iter_compressed(self):
+        if self.encoding in ('gzip', 'gz'):
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)  # accepts both gzip and zlib streams
+        else:
+            decompressor = bz2.BZ2Decompressor()
+        chunk_size = 1024 * 1024
+        with open(self._data_file, 'rb') as fh:
+            fh.seek(self._payload_offset(fh))
+            pending = bytearray()
+            for z0 in range(0, self.sizes[2], self.slab_depth):
+                z1 = min(z0 + self.slab_depth, self.sizes[2])
+                needed = self._slab_bytes(z1 - z0)
+                while len(pending) < needed:
+                    compressed = fh.read(chunk_size)
+                    if not compressed:
+                        raise ValueError("nrrd data is truncated: " + self.filename)
+                    pending += decompressor.decompress(compressed)
+                slab = np.frombuffer(bytes(pending[:needed]), dtype=self.dtype)
+                del pending[:needed]
+                yield z0, slab.reshape((self.sizes[0], self.sizes[1], z1 - z0), order='F')
+
+    def _iter_full(self):
+        print("WARNING: nrrd encoding '" + self.encoding + "' can not be streamed, reading the whole volume")
+        data, _ = nrrd.read(self.filename)
+        for z0 in range(0, self.sizes[2], self.slab_depth):
+            yield z0, data[:, :, z0:z0 + self.slab_depth]
+
+    def iter_slabs(self):
+        """Yield (z0, slab) with slab = data[:, :, z0:z0 + depth] (x, y, z index order, as returned by nrrd.read)"""
+        if self.encoding == 'raw':
+            return self._iter_raw()
+        if self.encoding in ('gzip', 'gz', 'bzip2', 'bz2'):
+            return self._iter_compressed()
+        return self._iter_full()
+
+    def min_max(self, mask_above=None):
+        """Global (min, max) over one pass of the slabs. If mask_above is given, the min only considers values > mask_above
+        (None if there are none)"""
+        vmin, vmax = None, None
+        for _, slab in self.iter_slabs():
+            slab_max = slab.max()
+            vmax = slab_max if vmax is None else max(vmax, slab_max)
+            if mask_above is None:
+                slab_min = slab.min()
+            else:
+                masked = slab[slab > mask_above]
+                if masked.size == 0:
+                    continue
+                slab_min = masked.min()
+            vmin = slab_min if vmin is None else min(vmin, slab_min)
+        return vmin, vmax
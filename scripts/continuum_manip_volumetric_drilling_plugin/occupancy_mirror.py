@@ -0,0 +1,167 @@
+
+import threading
+import numpy as np
+
+# Dense mirror of the voxels removed from the drilled volume (no ROS dependency, see CmvdOccupancyMirror in
+# cmvd_ros_interface.py for the subscriber side):
+#   mirror = OccupancyMirror(voxel_count, dimensions)      # from volume_prop
+#   mirror.apply(indices)                                   # (n, 3) voxel indices, e.g. unpack_voxels_removed
+#   snapshot = mirror.snapshot()                            # frozen copy for metrics, O(number of slabs)
+#   snapshot.removed_in_region((0, 0, 0), (64, 64, 64)), snapshot.projection(2), snapshot.distance_to_plan(plan)
+# The volume is a uint8 array (1 = removed) split in slabs along x. Snapshots share the slabs, the mirror copies a
+# shared slab only when a removal lands in it, so taking a snapshot does not copy the volume and ingestion keeps
+# going while the snapshot is analysed.
+
+DEFAULT_SLAB_SIZE = 16  # x planes per slab
+# removed voxels x plan segments evaluated at once by distance_to_plan
+_DISTANCE_CHUNK = 1 << 20
+
+
+def point_segment_distances(points, starts, ends):
+    """Distance of every (n, 3) point to the closest of the segments starts[i] -> ends[i] ((m, 3) each)"""
+    points = np.asarray(points, dtype=np.float64)
+    starts = np.asarray(starts, dtype=np.float64)
+    direction = np.asarray(ends, dtype=np.float64) - starts
+    length2 = np.maximum((direction ** 2).sum(axis=1), 1e-300)
+    distances = np.empty(len(points))
+    chunk = max(1, _DISTANCE_CHUNK // max(len(starts), 1))
+    for i in range(0, len(points), chunk):
+        p = points[i:i + chunk, None, :] - starts[None, :, :]
+        t = np.clip((p * direction).sum(axis=2) / length2, 0.0, 1.0)
+        closest = p - t[:, :, None] * direction[None, :, :]
+        distances[i:i + chunk] = np.sqrt((closest ** 2).sum(axis=2).min(axis=1))
+    return distances
+
+
+class _SlabVolume:
+    """Queries shared by the mirror and its snapshots, over self.slabs (list of (slab_size, ny, nz) uint8)"""
+
+    def _slab_range(self, lo, hi):
+        return range(lo // self.slab_size, (hi - 1) // self.slab_size + 1) if hi > lo else range(0)
+
+    def removed_in_region(self, lower, upper):
+        """Removed voxels with lower <= index < upper (per axis, clipped to the volume)"""
+        lower = np.maximum(np.asarray(lower, dtype=np.int64), 0)
+        upper = np.minimum(np.asarray(upper, dtype=np.int64), self.shape)
+        if (upper <= lower).any():
+            return 0
+        count = 0
+        for s in self._slab_range(lower[0], upper[0]):
+            x0 = s * self.slab_size
+            slab = self.slabs[s]
+            count += int(np.count_nonzero(slab[max(lower[0] - x0, 0):upper[0] - x0, lower[1]:upper[1], lower[2]:upper[2]]))
+        return count
+
+    def removed_count(self):
+        return sum(int(np.count_nonzero(slab)) for slab in self.slabs)
+
+    def removed_indices(self):
+        """(n, 3) indices of all removed voxels"""
+        parts = []
+        for s, slab in enumerate(self.slabs):
+            idx = np.argwhere(slab)
+            if len(idx):
+                idx[:, 0] += s * self.slab_size
+                parts.append(idx)
+        return np.concatenate(parts) if parts else np.zeros((0, 3), dtype=np.int64)
+
+    def projection(self, axis):
+        """2D count of removed voxels summed along axis (0, 1 or 2)"""
+        if axis == 0:
+            result = np.zeros(self.shape[1:], dtype=np.int64)
+            for slab in self.slabs:
+                result += slab.sum(axis=0, dtype=np.int64)
+            return result
+        return np.concatenate([slab.sum(axis=axis, dtype=np.int64) for slab in self.slabs], axis=0)
+
+    def slice_counts(self, axis):
+        """Removed voxels in every slice perpendicular to axis"""
+        if axis == 0:
+            return np.concatenate([slab.sum(axis=(1, 2), dtype=np.int64) for slab in self.slabs])
+        return self.projection(0).sum(axis=2 - axis)
+
+    def distance_to_plan(self, plan_points, indices=None):
+        """Distance of the removed voxels (or the given (n, 3) indices) to the polyline through plan_points, both
+        in voxel index coordinates. Scaled by voxel_size (m) when the volume dimensions are known"""
+        if indices is None:
+            indices = self.removed_indices()
+        plan = np.atleast_2d(np.asarray(plan_points, dtype=np.float64))
+        if len(plan) == 1:
+            plan = np.vstack((plan, plan))
+        scale = self.voxel_size if self.voxel_size is not None else np.ones(3)
+        return point_segment_distances(np.asarray(indices) * scale, plan[:-1] * scale, plan[1:] * scale)
+
+    def volume(self):
+        """Copy of the whole (nx, ny, nz) uint8 volume"""
+        return np.concatenate(self.slabs, axis=0)
+
+
+class OccupancySnapshot(_SlabVolume):
+    def __init__(self, mirror, slabs, removed_total, batches):
+        self.shape = mirror.shape
+        self.slab_size = mirror.slab_size
+        self.voxel_size = mirror.voxel_size
+        self.slabs = slabs
+        self.removed_total = removed_total
+        self.batches = batches
+
+
+class OccupancyMirror(_SlabVolume):
+    def __init__(self, voxel_count, dimensions=None, slab_size=DEFAULT_SLAB_SIZE):
+        """voxel_count: (nx, ny, nz), dimensions: optional size of the volume (m) for distances in m"""
+        self.shape = np.asarray(voxel_count, dtype=np.int64)
+        if self.shape.shape != (3,) or (self.shape <= 0).any():
+            raise ValueError(f"Invalid voxel count {voxel_count}")
+        self.slab_size = int(slab_size)
+        self.voxel_size = None if dimensions is None else np.asarray(dimensions, dtype=np.float64) / self.shape
+        nx, ny, nz = (int(n) for n in self.shape)
+        self.slabs = [np.zeros((min(self.slab_size, nx - x0), ny, nz), dtype=np.uint8) for x0 in range(0, nx, self.slab_size)]
+        self._shared = np.zeros(len(self.slabs), dtype=bool)
+        self._lock = threading.Lock()
+        self.removed_total = 0
+        self.batches = 0
+        self.out_of_bounds = 0
+
+    def apply(self, indices):
+        """Mark the (n, 3) voxel indices as removed, returns how many were not removed before"""
+        indices = np.asarray(indices)
+        if indices.size == 0:
+            return 0
+        indices = indices.reshape(-1, 3).astype(np.int64, copy=False)
+        inside = ((indices >= 0) & (indices < self.shape)).all(axis=1)
+        if not inside.all():
+            self.out_of_bounds += int(len(indices) - np.count_nonzero(inside))
+            indices = indices[inside]
+        slab_of = indices[:, 0] // self.slab_size
+        new = 0
+        with self._lock:
+            for s in np.unique(slab_of):
+                if self._shared[s]:
+                    # copy on write, a snapshot still holds the old slab
+                    self.slabs[s] = self.slabs[s].copy()
+                    self._shared[s] = False
+                idx = indices[slab_of == s]
+                slab = self.slabs[s]
+                x = idx[:, 0] - s * self.slab_size
+                # voxels not removed before, counted once even if repeated in the batch
+                fresh = slab[x, idx[:, 1], idx[:, 2]] == 0
+                new += len(np.unique(np.ravel_multi_index((x[fresh], idx[fresh, 1], idx[fresh, 2]), slab.shape)))
+                slab[x, idx[:, 1], idx[:, 2]] = 1
+            self.removed_total += new
+            self.batches += 1
+        return new
+
+    def snapshot(self):
+        """Frozen view of the current volume, cheap to take, later removals do not change it"""
+        with self._lock:
+            self._shared[:] = True
+            slabs = [slab.view() for slab in self.slabs]
+            for slab in slabs:
+                slab.flags.writeable = False
+            return OccupancySnapshot(self, slabs, self.removed_total, self.batches)
+
+    def reset(self):
+        with self._lock:
+            self.slabs = [np.zeros_like(slab) for slab in self.slabs]
+            self._shared[:] = False
+            self.removed_total = 0
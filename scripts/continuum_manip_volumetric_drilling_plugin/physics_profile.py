@@ -0,0 +1,76 @@
+
+import os
+import csv
+
+# Reports of the physicsUpdate phase timers of the plugin (plugin/cm_vol_drill/physics_profiler.h), published on
+# /diagnostics as the key / value pairs of a DiagnosticStatus named "volumetric_drilling physicsUpdate". No ROS
+# dependency, scripts/physics_profile_monitor.py does the subscribing:
+#   report = parse_values([(kv.key, kv.value) for kv in status.values])
+#   print(format_table(report))
+
+STATUS_NAME = 'volumetric_drilling physicsUpdate'
+# same order as PhysicsStat, mutex_wait is part of voxel_removal and tick is the whole physicsUpdate
+PHASES = ('settings', 'global_positions', 'cursor_poses', 'voxel_removal', 'interaction_forces', 'impulses', 'cable_pull')
+STATS = PHASES + ('mutex_wait', 'tick')
+FIELDS = ('count', 'total', 'mean', 'p99', 'max')
+COUNTERS = ('window', 'ticks', 'overruns', 'voxels removed', 'contacts')
+CSV_COLUMNS = ('stamp',) + tuple(c.replace(' ', '_') for c in COUNTERS) + tuple(s + '_' + f for s in STATS for f in FIELDS)
+
+
+def _key(stat, field):
+    return stat + ' ' + field + ('' if field == 'count' else ' (ms)')
+
+
+def parse_values(values):
+    """{'window', 'ticks', ..., stat: {field: value}} from (key, value) pairs, times in ms. Missing entries are 0"""
+    raw = {}
+    for key, value in values:
+        try:
+            raw[key] = float(value)
+        except ValueError:
+            pass
+    report = {'window': raw.get('window (s)', 0.0)}
+    for counter in COUNTERS[1:]:
+        report[counter] = raw.get(counter, 0.0)
+    for stat in STATS:
+        report[stat] = {field: raw.get(_key(stat, field), 0.0) for field in FIELDS}
+    return report
+
+
+def format_table(report):
+    """Per stat table of a parse_values() report, with the share of the summed tick time"""
+    window = report['window']
+    ticks = report['ticks']
+    tick_total = report['tick']['total']
+    lines = [f"{ticks / window if window else 0.0:.0f} Hz over {window:.2f} s, {report['overruns']:.0f} ticks over dt, "
+             f"{report['voxels removed']:.0f} voxels removed, {report['contacts']:.0f} contacts",
+             f"{'phase':>20} {'calls':>8} {'mean ms':>10} {'p99 ms':>10} {'max ms':>10} {'ms/tick':>10} {'share':>7}"]
+    for stat in STATS:
+        s = report[stat]
+        per_tick = s['total'] / ticks if ticks else 0.0
+        share = 100.0 * s['total'] / tick_total if tick_total else 0.0
+        lines.append(f"{stat:>20} {s['count']:8.0f} {s['mean']:10.4f} {s['p99']:10.4f} {s['max']:10.4f} {per_tick:10.4f} {share:6.1f}%")
+    return "\n".join(lines)
+
+
+def csv_row(stamp, report):
+    return [stamp] + [report[c] for c in COUNTERS] + [report[s][f] for s in STATS for f in FIELDS]
+
+
+class ReportCsvWriter:
+    def __init__(self, filename):
+        # appends to an existing file, the header is only written to a new (or empty) one
+        new_file = not os.path.isfile(filename) or os.path.getsize(filename) == 0
+        self.file = open(filename, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(CSV_COLUMNS)
+        self.rows = 0
+
+    def write(self, stamp, report):
+        self.writer.writerow(csv_row(stamp, report))
+        self.file.flush()
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
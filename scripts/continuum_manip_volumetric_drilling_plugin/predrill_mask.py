@@ -0,0 +1,155 @@
+
+import os
+import struct
+import hashlib
+import numpy as np
+import yaml
+
+# Python side of plugin/cm_vol_drill/predrill_mask.h: voxelizes predrill trajectories (--predrill_traj_file csvs) into
+# the list of voxel indices the plugin removes at startup, cached in a file loaded with --predrill_mask_file:
+#   grid = VolumeGrid.from_adf('ADF/cube.yaml')
+#   indices = trajectories_mask([read_predrill_csv(f) for f in csv_files], grid)
+#   write_mask('predrill.mask', indices, grid.voxel_count, source_hash(csv_files, grid))
+# A voxel is removed if its center is within burr_size / 2 of a trajectory segment (a capsule per segment), the same
+# test as rasterizeCapsule in the plugin. Positions are in the volume's local frame (AMBF units), the volume spans
+# +-dimensions * scale / 2 and voxel (i, j, k) is centered at min corner + (i + 0.5, j + 0.5, k + 0.5) voxels.
+
+MAGIC = b'CMVDPDM\0'
+VERSION = 1
+HEADER_SIZE = 64
+# magic, version, dims[3], count, source_hash[32], little endian without padding, same as PredrillMaskHeader
+_HEADER = struct.Struct('<8sI3IQ32s')
+# mm_to_ambf_unit of the plugin (m_to_ambf_unit = 10)
+DEFAULT_MM_TO_AMBF_UNIT = 10.0 / 1000.0
+
+
+def read_predrill_csv(filename):
+    """(burr_size in mm, (n, 3) points) from a predrill trajectory csv: burr size on the first line, then x, y, z"""
+    with open(filename, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if not lines:
+        raise ValueError("Empty predrill trajectory file " + filename)
+    burr_size = float(lines[0].split(',')[0])
+    points = np.array([[float(v) for v in line.split(',')[0:3]] for line in lines[1:]], dtype=np.float64).reshape(-1, 3)
+    if len(points) == 0:
+        raise ValueError("No trajectory points in " + filename)
+    return burr_size, points
+
+
+def png_size(filename):
+    """(width, height) from the IHDR chunk of a png"""
+    with open(filename, 'rb') as f:
+        header = f.read(24)
+    if header[0:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        raise ValueError("Not a png file " + filename)
+    return struct.unpack('>II', header[16:24])
+
+
+class VolumeGrid:
+    def __init__(self, dimensions, voxel_count):
+        """dimensions: (3,) size of the volume (AMBF units, scale applied), voxel_count: (nx, ny, nz)"""
+        self.dimensions = np.asarray(dimensions, dtype=np.float64)
+        self.voxel_count = np.asarray(voxel_count, dtype=np.int64)
+        self.min_corner = -self.dimensions / 2.0
+        self.voxel_size = self.dimensions / self.voxel_count
+
+    @classmethod
+    def from_adf(cls, adf_file, volume_name=None, voxel_count=None):
+        """Grid of a VOLUME of an ADF yaml (the first one if volume_name is None). The voxel count comes from the
+        first png slice and the image count unless given"""
+        with open(adf_file, 'r') as f:
+            adf = yaml.safe_load(f)
+        volumes = adf.get('volumes', [])
+        if not volumes:
+            raise ValueError("No volumes in " + adf_file)
+        key = volumes[0] if volume_name is None else next(
+            (v for v in volumes if v == volume_name or adf[v].get('name') == volume_name), None)
+        if key is None:
+            raise ValueError("No volume " + str(volume_name) + " in " + adf_file)
+        volume = adf[key]
+        scale = float(volume.get('scale', 1.0))
+        dims = volume['dimensions']
+        dimensions = np.array([dims['x'], dims['y'], dims['z']], dtype=np.float64) * scale
+        if voxel_count is None:
+            images = volume['images']
+            path = os.path.join(os.path.dirname(os.path.abspath(adf_file)), images['path'])
+            first = os.path.join(path, images['prefix'] + '0.' + images['format'])
+            width, height = png_size(first)
+            voxel_count = (width, height, int(images['count']))
+        return cls(dimensions, voxel_count)
+
+
+def capsule_mask(a, b, radius, grid):
+    """(n, 3) int32 indices of the voxels whose centers are within radius of the segment a - b"""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    lo = np.maximum(np.ceil((np.minimum(a, b) - radius - grid.min_corner) / grid.voxel_size - 0.5), 0).astype(np.int64)
+    hi = np.minimum(np.floor((np.maximum(a, b) + radius - grid.min_corner) / grid.voxel_size - 0.5), grid.voxel_count - 1).astype(np.int64)
+    if (hi < lo).any():
+        return np.zeros((0, 3), dtype=np.int32)
+    axes = [grid.min_corner[n] + (np.arange(lo[n], hi[n] + 1) + 0.5) * grid.voxel_size[n] - a[n] for n in range(3)]
+    d = b - a
+    dd = float(d @ d)
+    # projection parameter of every center on the segment, clamped to the end caps
+    if dd > 0.0:
+        t = (axes[0][:, None, None] * d[0] + axes[1][None, :, None] * d[1] + axes[2][None, None, :] * d[2]) / dd
+        np.clip(t, 0.0, 1.0, out=t)
+    else:
+        t = np.zeros((len(axes[0]), len(axes[1]), len(axes[2])))
+    dist2 = ((axes[0][:, None, None] - t * d[0]) ** 2 + (axes[1][None, :, None] - t * d[1]) ** 2
+             + (axes[2][None, None, :] - t * d[2]) ** 2)
+    return (np.argwhere(dist2 <= radius * radius) + lo).astype(np.int32)
+
+
+def trajectories_mask(trajectories, grid, mm_to_ambf_unit=DEFAULT_MM_TO_AMBF_UNIT):
+    """Sorted unique (n, 3) int32 voxel indices covered by the (burr_size mm, points) trajectories"""
+    parts = []
+    for burr_size, points in trajectories:
+        radius = burr_size * mm_to_ambf_unit / 2.0
+        ends = points[1:] if len(points) > 1 else points
+        for a, b in zip(points, ends):
+            parts.append(capsule_mask(a, b, radius, grid))
+    if not parts:
+        return np.zeros((0, 3), dtype=np.int32)
+    indices = np.concatenate(parts)
+    flat = np.unique(np.ravel_multi_index(indices.T, grid.voxel_count))
+    return np.stack(np.unravel_index(flat, grid.voxel_count), axis=1).astype(np.int32)
+
+
+def source_hash(csv_files, grid, mm_to_ambf_unit=DEFAULT_MM_TO_AMBF_UNIT):
+    """32 character hash of the trajectories and the grid a mask is made from"""
+    h = hashlib.blake2b(digest_size=16)
+    for filename in csv_files:
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+    h.update(np.concatenate((grid.dimensions, grid.voxel_count, [mm_to_ambf_unit, VERSION])).astype('<f8').tobytes())
+    return h.hexdigest()
+
+
+def write_mask(filename, indices, voxel_count, hash_hex=''):
+    indices = np.ascontiguousarray(indices, dtype='<i4').reshape(-1, 3)
+    header = _HEADER.pack(MAGIC, VERSION, *(int(n) for n in voxel_count), len(indices), hash_hex.encode('ascii'))
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        f.write(indices.tobytes())
+    os.replace(tmp, filename)
+
+
+def read_mask_header(filename):
+    """{'version', 'dims', 'count', 'source_hash'} of a mask file, None if it is not one"""
+    with open(filename, 'rb') as f:
+        data = f.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE or data[0:len(MAGIC)] != MAGIC:
+        return None
+    magic, version, nx, ny, nz, count, hash_bytes = _HEADER.unpack(data)
+    return {'version': version, 'dims': (nx, ny, nz), 'count': count,
+            'source_hash': hash_bytes.rstrip(b'\0').decode('ascii', errors='replace')}
+
+
+def read_mask(filename):
+    header = read_mask_header(filename)
+    if header is None or header['version'] != VERSION:
+        raise ValueError("Not a version " + str(VERSION) + " predrill mask: " + filename)
+    indices = np.fromfile(filename, dtype='<i4', offset=HEADER_SIZE, count=3 * header['count'])
+    return header, indices.reshape(-1, 3)
@@ -0,0 +1,132 @@
+
+import threading
+import numpy as np
+
+# Preallocated ring buffers for streamed samples (no ROS dependency). Callbacks write each message straight into
+# a row of a fixed numpy array instead of building message objects and python lists, a window of samples is
+# marked with mark() and read back as one array with since_mark().
+
+# columns of a pose sample, quaternion in x, y, z, w order (as tf.transformations / geometry_msgs)
+POSE_COLUMNS = ('t', 'x', 'y', 'z', 'qx', 'qy', 'qz', 'qw')
+JOINT_COLUMNS = ('t', 'position')
+DEFAULT_CAPACITY = 8192
+
+
+class SampleRingBuffer:
+    def __init__(self, columns, capacity=DEFAULT_CAPACITY):
+        self.columns = columns
+        self.capacity = capacity
+        self._data = np.zeros((capacity, len(columns)))
+        self._lock = threading.Lock()
+        self._total = 0  # samples pushed since creation, also the write position (modulo capacity)
+        self._mark = 0
+        self._last_seq = None
+        self.seq_gaps = 0  # messages missing according to the header sequence numbers
+
+    def push(self, values, seq=None):
+        with self._lock:
+            self._data[self._total % self.capacity] = values
+            self._total += 1
+            if seq is not None:
+                if self._last_seq is not None and seq > self._last_seq + 1:
+                    self.seq_gaps += seq - self._last_seq - 1
+                self._last_seq = seq
+
+    def mark(self):
+        """Start a new window, returns the counters at the start of it (see window_stats)"""
+        with self._lock:
+            self._mark = self._total
+            return {'total': self._total, 'seq_gaps': self.seq_gaps}
+
+    def since_mark(self):
+        """Copy of the samples pushed since mark() (oldest first), at most capacity of them"""
+        return self.last(self._total - self._mark)
+
+    def last(self, n):
+        with self._lock:
+            n = min(n, self._total, self.capacity)
+            start = (self._total - n) % self.capacity
+            if start + n <= self.capacity:
+                return self._data[start:start + n].copy()
+            return np.concatenate((self._data[start:], self._data[:start + n - self.capacity]))
+
+    def since_time(self, t):
+        """Copy of the buffered samples with a timestamp (first column) >= t, timestamps are assumed increasing"""
+        with self._lock:
+            n = min(self._total, self.capacity)
+            start = (self._total - n) % self.capacity
+            if start + n <= self.capacity:
+                segments = [self._data[start:start + n]]
+            else:
+                segments = [self._data[start:], self._data[:start + n - self.capacity]]
+            for i, segment in enumerate(segments):
+                first = np.searchsorted(segment[:, 0], t)
+                if first < len(segment):
+                    return np.concatenate([segment[first:]] + segments[i + 1:])
+            return self._data[:0].copy()
+
+    def latest(self):
+        return self.last(1)[0] if self._total else None
+
+    def window_stats(self, marked):
+        """Counts of the window started by the mark() call that returned marked: received samples, samples lost
+        because the window outgrew the buffer and messages missing from the sequence numbers"""
+        with self._lock:
+            received = self._total - marked['total']
+            return {'samples': received,
+                    'overwritten': max(received - self.capacity, 0),
+                    'seq_gaps': self.seq_gaps - marked['seq_gaps']}
+
+    @property
+    def total(self):
+        return self._total
+
+
+def motion_metrics(samples, columns):
+    """(speed, spread) of the given columns over a window of samples: speed is the net displacement over the
+    window divided by its duration, spread the largest standard deviation of any column"""
+    samples = np.asarray(samples)
+    if len(samples) < 2:
+        return np.inf, np.inf
+    values = samples[:, columns]
+    duration = samples[-1, 0] - samples[0, 0]
+    speed = np.linalg.norm(values[-1] - values[0]) / duration if duration > 0 else np.inf
+    return speed, values.std(axis=0).max()
+
+
+def quaternion_to_matrix(q):
+    """(..., 4) x, y, z, w unit quaternions -> (..., 4, 4) homogeneous rotation matrices"""
+    q = np.asarray(q, dtype=np.float64)
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    g = np.zeros(q.shape[:-1] + (4, 4))
+    g[..., 0, 0] = 1 - 2 * (y * y + z * z)
+    g[..., 0, 1] = 2 * (x * y - z * w)
+    g[..., 0, 2] = 2 * (x * z + y * w)
+    g[..., 1, 0] = 2 * (x * y + z * w)
+    g[..., 1, 1] = 1 - 2 * (x * x + z * z)
+    g[..., 1, 2] = 2 * (y * z - x * w)
+    g[..., 2, 0] = 2 * (x * z - y * w)
+    g[..., 2, 1] = 2 * (y * z + x * w)
+    g[..., 2, 2] = 1 - 2 * (x * x + y * y)
+    g[..., 3, 3] = 1
+    return g
+
+
+def mean_quaternion(q):
+    """Mean of (n, 4) quaternions: eigenvector of the largest eigenvalue of sum(q q^T) (Markley et al.), after
+    aligning the signs with the first sample so q and -q count as the same rotation"""
+    q = np.asarray(q, dtype=np.float64)
+    q = q * np.where(q @ q[0] < 0, -1.0, 1.0)[:, None]
+    _, vectors = np.linalg.eigh(q.T @ q)
+    mean = vectors[:, -1]
+    return mean if mean @ q[0] >= 0 else -mean
+
+
+def mean_pose(samples):
+    """(n, 8) POSE_COLUMNS samples -> 4x4 homogeneous transform of the mean position and mean orientation"""
+    samples = np.asarray(samples)
+    if len(samples) == 0:
+        raise ValueError("No pose samples to average")
+    g = quaternion_to_matrix(mean_quaternion(samples[:, 4:8]))
+    g[0:3, 3] = samples[:, 1:4].mean(axis=0)
+    return g
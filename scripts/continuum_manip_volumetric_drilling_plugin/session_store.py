@@ -0,0 +1,168 @@
+
+import json
+import os
+import numpy as np
+
+# Append-only storage of a calibration session (free_space_calibration.py), readable with numpy alone.
+# A session directory holds
+#   session_samples.bin  every streamed sample of every datapoint as fixed size SAMPLE_DTYPE records
+#   session_points.bin   one POINT_DTYPE record per datapoint: bend command, averaged poses and the range of its
+#                        samples in session_samples.bin. Written after the samples, so it is the commit log: samples
+#                        after the end of the last complete point record belong to an interrupted write and are ignored
+#   session_meta.json    version, stream / column names and the zero transforms (replaced atomically)
+# Adding a datapoint appends to the two .bin files, so the cost does not grow with the session and loading is a
+# pair of memory maps.
+SAMPLES_FILENAME = 'session_samples.bin'
+POINTS_FILENAME = 'session_points.bin'
+META_FILENAME = 'session_meta.json'
+SESSION_VERSION = 1
+
+BASE, TIP, BEND = 0, 1, 2
+STREAM_NAMES = ('base', 'tip', 'bend')
+
+# values: x, y, z, qx, qy, qz, qw for poses, the position in values[0] for the bend motor
+SAMPLE_DTYPE = np.dtype([('stream', '<u4'), ('point', '<u4'), ('t', '<f8'), ('values', '<f8', (7,))])
+POINT_DTYPE = np.dtype([('bend_cmd', '<f8'), ('base_avg', '<f8', (4, 4)), ('tip_avg', '<f8', (4, 4)),
+                        ('sample_start', '<u8'), ('sample_count', '<u8')])
+
+
+def is_session_dir(directory):
+    return os.path.isfile(os.path.join(directory, POINTS_FILENAME))
+
+
+def _complete_records(path, dtype):
+    return os.path.getsize(path) // dtype.itemsize if os.path.isfile(path) else 0
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SessionStore:
+    """Writer, appends to the session in directory (created if needed)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.samples_path = os.path.join(directory, SAMPLES_FILENAME)
+        self.points_path = os.path.join(directory, POINTS_FILENAME)
+        self.meta_path = os.path.join(directory, META_FILENAME)
+        self._recover()
+        if not os.path.isfile(self.meta_path):
+            self.set_zero_transforms(np.eye(4), np.eye(4))
+
+    def _recover(self):
+        # drop a partially written point record and any samples not referenced by a complete one
+        self.num_points = _complete_records(self.points_path, POINT_DTYPE)
+        self.num_samples = 0
+        if self.num_points:
+            last = np.fromfile(self.points_path, dtype=POINT_DTYPE, count=1, offset=(self.num_points - 1) * POINT_DTYPE.itemsize)[0]
+            self.num_samples = int(last['sample_start'] + last['sample_count'])
+        for path, size in ((self.points_path, self.num_points * POINT_DTYPE.itemsize),
+                           (self.samples_path, self.num_samples * SAMPLE_DTYPE.itemsize)):
+            if os.path.isfile(path) and os.path.getsize(path) != size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+    def clear(self):
+        for path in (self.samples_path, self.points_path):
+            open(path, 'wb').close()
+        self.num_points = 0
+        self.num_samples = 0
+
+    def set_zero_transforms(self, base_zero, tip_zero):
+        _write_json_atomic(self.meta_path, {'version': SESSION_VERSION,
+                                            'streams': list(STREAM_NAMES),
+                                            'base_zero_transform': np.asarray(base_zero).tolist(),
+                                            'tip_zero_transform': np.asarray(tip_zero).tolist()})
+
+    def append_point(self, base_samples, tip_samples, bend_samples, base_avg, tip_avg, bend_cmd=np.nan):
+        """base / tip samples are (n, 8) t, xyz, quaternion arrays, bend samples (n, 2) t, position arrays
+        (see sample_buffer.POSE_COLUMNS / JOINT_COLUMNS)"""
+        streams = ((BASE, base_samples), (TIP, tip_samples), (BEND, bend_samples))
+        records = np.zeros(sum(len(s) for _, s in streams), dtype=SAMPLE_DTYPE)
+        i = 0
+        for stream, samples in streams:
+            samples = np.asarray(samples, dtype=np.float64).reshape(len(samples), -1)
+            n = len(samples)
+            records['stream'][i:i + n] = stream
+            records['t'][i:i + n] = samples[:, 0]
+            records['values'][i:i + n, :samples.shape[1] - 1] = samples[:, 1:]
+            i += n
+        records['point'] = self.num_points
+
+        point = np.zeros(1, dtype=POINT_DTYPE)
+        point['bend_cmd'] = bend_cmd
+        point['base_avg'] = base_avg
+        point['tip_avg'] = tip_avg
+        point['sample_start'] = self.num_samples
+        point['sample_count'] = len(records)
+
+        # samples are on disk before the point record that references them
+        with open(self.samples_path, 'ab') as f:
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.points_path, 'ab') as f:
+            f.write(point.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.num_points += 1
+        self.num_samples += len(records)
+
+
+class Session:
+    """Read only view of a session directory, the records are memory mapped"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILENAME), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != SESSION_VERSION:
+            raise ValueError("Unsupported calibration session version: " + str(self.meta.get('version')))
+        self.points = self._map(POINTS_FILENAME, POINT_DTYPE)
+        num_samples = int(self.points['sample_start'][-1] + self.points['sample_count'][-1]) if len(self.points) else 0
+        self.samples = self._map(SAMPLES_FILENAME, SAMPLE_DTYPE)[:num_samples]
+
+    def _map(self, filename, dtype):
+        path = os.path.join(self.directory, filename)
+        count = _complete_records(path, dtype)
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def bend_cmd(self):
+        return self.points['bend_cmd']
+
+    @property
+    def base_avg(self):
+        return self.points['base_avg']
+
+    @property
+    def tip_avg(self):
+        return self.points['tip_avg']
+
+    @property
+    def base_zero_transform(self):
+        return np.array(self.meta['base_zero_transform'])
+
+    @property
+    def tip_zero_transform(self):
+        return np.array(self.meta['tip_zero_transform'])
+
+    def point_samples(self, i, stream):
+        """Samples of datapoint i for one stream: (n, 8) t, xyz, quaternion for BASE / TIP, (n, 2) t, position for BEND"""
+        point = self.points[i]
+        records = self.samples[int(point['sample_start']):int(point['sample_start'] + point['sample_count'])]
+        records = records[records['stream'] == stream]
+        width = 1 if stream == BEND else 7
+        return np.column_stack((records['t'], records['values'][:, :width]))
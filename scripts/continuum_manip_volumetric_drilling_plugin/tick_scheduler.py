@@ -0,0 +1,108 @@
+
+import asyncio
+import heapq
+import time
+
+# Cooperative fixed rate scheduling of several control loops in one asyncio event loop (no ROS dependency):
+#   scheduler = TickScheduler(clock=rospy.Time.now)
+#   scheduler.add('ur5_left', left.step, 120)
+#   scheduler.add('ur5_right', right.step, 120)
+#   asyncio.run(scheduler.run(rospy.is_shutdown))
+# Ticks are run earliest deadline first. Every wake up runs all ticks that are due with one shared stamp from
+# clock, so messages of different loops published in the same wake up carry the same time. A loop that falls more
+# than a period behind drops the ticks it missed instead of running them back to back.
+
+
+class ScheduledLoop:
+    def __init__(self, name, step, rate_hz, offset=0.0):
+        self.name = name
+        self.step = step
+        self.period = 1.0 / rate_hz
+        self.offset = offset
+        self.deadline = 0.0
+        self.ticks = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+class TickScheduler:
+    def __init__(self, clock=None, phase_offsets=True):
+        """clock: called once per wake up, its result is passed to every step run in it (None passes None).
+        phase_offsets: spread the first deadlines of the loops over their periods so loops of the same rate do
+        not all wake up at the same instant"""
+        self.clock = clock
+        self.phase_offsets = phase_offsets
+        self.loops = []
+
+    def add(self, name, step, rate_hz):
+        """step(stamp) is called at rate_hz"""
+        if rate_hz <= 0:
+            raise ValueError(f"{name}: rate must be positive, got {rate_hz}")
+        loop = ScheduledLoop(name, step, rate_hz)
+        self.loops.append(loop)
+        return loop
+
+    async def run(self, should_stop=None):
+        """Run the loops until should_stop() returns True (or forever)"""
+        if not self.loops:
+            return
+        event_loop = asyncio.get_running_loop()
+        start = event_loop.time()
+        queue = []
+        for i, loop in enumerate(self.loops):
+            if self.phase_offsets:
+                loop.offset = loop.period * i / len(self.loops)
+            loop.deadline = start + loop.offset
+            heapq.heappush(queue, loop)
+
+        while should_stop is None or not should_stop():
+            delay = queue[0].deadline - event_loop.time()
+            # always yield, other coroutines (e.g. reporting) run while the loops wait
+            await asyncio.sleep(max(delay, 0.0))
+            now = event_loop.time()
+            stamp = self.clock() if self.clock is not None else None
+            while queue and queue[0].deadline <= now:
+                loop = heapq.heappop(queue)
+                lateness = now - loop.deadline
+                if lateness > loop.max_lateness:
+                    loop.max_lateness = lateness
+                loop.step(stamp)
+                loop.ticks += 1
+                loop.deadline += loop.period
+                # more than a period behind: skip to the next deadline in the future
+                behind = event_loop.time() - loop.deadline
+                if behind > 0:
+                    skipped = int(behind / loop.period) + 1
+                    loop.deadline += skipped * loop.period
+                    loop.missed += skipped
+                heapq.heappush(queue, loop)
+
+    def summary(self, reset=True):
+        """{name: (ticks, missed, max lateness in s)} since the last reset"""
+        stats = {loop.name: (loop.ticks, loop.missed, loop.max_lateness) for loop in self.loops}
+        if reset:
+            for loop in self.loops:
+                loop.ticks = 0
+                loop.missed = 0
+                loop.max_lateness = 0.0
+        return stats
+
+
+def format_scheduler_summary(stats, window):
+    lines = []
+    for name, (ticks, missed, lateness) in stats.items():
+        lines.append(f"  {name:>16}: {ticks / window:8.1f} Hz, {missed} missed ticks, max lateness {lateness * 1e3:.3f} ms")
+    return "\n".join(lines)
+
+
+async def report_periodically(scheduler, period, report, should_stop=None):
+    """Call report(scheduler.summary(), window) every period seconds alongside scheduler.run"""
+    last = time.perf_counter()
+    while should_stop is None or not should_stop():
+        await asyncio.sleep(period)
+        now = time.perf_counter()
+        report(scheduler.summary(), now - last)
+        last = now
@@ -0,0 +1,342 @@
+
+import math
+import sys
+import time
+import numpy as np
+
+# UR5 / UR10 forward kinematics and geometric Jacobian (base frame) from the DH parameters used by ur5_ambf.py.
+# URKinematics writes into buffers allocated once and builds each link transform in closed form, fk_batch
+# evaluates N configurations at once. fk_reference is the previous per-joint matrix product implementation,
+# kept to check and benchmark against (python3 -m continuum_manip_volumetric_drilling_plugin.ur_kinematics).
+# URKinematics.ik_all gives the eight analytic inverse kinematics solutions (Hawkins, "Analytic Inverse Kinematics
+# for the Universal Robots UR-5/UR-10 Arms", 2013) of a tip pose at once, ik picks the one closest to the current
+# joints within the joint limits.
+
+# d, a, alpha. UR5: changes to DH here go to end effector, instead of to the origin of wrist_3_link
+UR_DH = {
+    'UR5': (np.array([0.089159, 0, 0, 0.10915, 0.09465, 0.0823]),
+            np.array([0, -0.425, -0.39225, 0, 0, 0]),
+            np.array([np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, np.pi / 2])),
+    'UR10': (np.array([0.1273, 0, 0, 0.163941, 0.1157, 0.0922]),
+             np.array([0, -0.612, -0.5723, 0, 0, 0]),
+             np.array([np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, 0])),
+}
+# accounts for an offset between the AMBF joint 0 and the DH definition
+JOINT_OFFSETS = np.array([-np.pi, 0, 0, 0, 0, 0])
+NUM_JOINTS = 6
+# AMBF joint positions, all UR5 / UR10 joints turn +-360 deg
+JOINT_LIMITS = (np.full(NUM_JOINTS, -2 * np.pi), np.full(NUM_JOINTS, 2 * np.pi))
+# acos arguments up to this much beyond +-1 (rounding at the workspace boundary) are clamped instead of rejected
+_IK_TOLERANCE = 1e-9
+# below this |sin(th5)| the wrist is singular and th6 is taken from the current joints
+_WRIST_SINGULARITY = 1e-7
+
+
+def _dh_transforms(th, d, a, alpha):
+    """(n, 4, 4) Rz(th) Tz(d) Tx(a) Rx(alpha) for n angles th"""
+    ct, st = np.cos(th), np.sin(th)
+    ca, sa = math.cos(alpha), math.sin(alpha)
+    g = np.zeros(np.shape(th) + (4, 4))
+    g[..., 0, 0] = ct
+    g[..., 0, 1] = -st * ca
+    g[..., 0, 2] = st * sa
+    g[..., 0, 3] = a * ct
+    g[..., 1, 0] = st
+    g[..., 1, 1] = ct * ca
+    g[..., 1, 2] = -ct * sa
+    g[..., 1, 3] = a * st
+    g[..., 2, 1] = sa
+    g[..., 2, 2] = ca
+    g[..., 2, 3] = d
+    g[..., 3, 3] = 1.0
+    return g
+
+
+def _rigid_inverse(g):
+    inv = np.zeros_like(g)
+    rotation_t = np.swapaxes(g[..., :3, :3], -1, -2)
+    inv[..., :3, :3] = rotation_t
+    inv[..., :3, 3] = -np.einsum('...ij,...j->...i', rotation_t, g[..., :3, 3])
+    inv[..., 3, 3] = 1.0
+    return inv
+
+
+def _acos_branches(c):
+    """+-acos(c), nan where |c| > 1 beyond the tolerance"""
+    c = np.where(np.abs(c) <= 1.0 + _IK_TOLERANCE, np.clip(c, -1.0, 1.0), np.nan)
+    return np.arccos(c)
+
+
+def rotation_to_quaternion(r):
+    """3x3 rotation matrix -> (x, y, z, w) with w >= 0, in plain float arithmetic (Shepperd's method)"""
+    r00, r01, r02 = float(r[0, 0]), float(r[0, 1]), float(r[0, 2])
+    r10, r11, r12 = float(r[1, 0]), float(r[1, 1]), float(r[1, 2])
+    r20, r21, r22 = float(r[2, 0]), float(r[2, 1]), float(r[2, 2])
+    trace = r00 + r11 + r22
+    if trace > 0:
+        s = 2.0 * math.sqrt(trace + 1.0)
+        q = ((r21 - r12) / s, (r02 - r20) / s, (r10 - r01) / s, 0.25 * s)
+    elif r00 > r11 and r00 > r22:
+        s = 2.0 * math.sqrt(1.0 + r00 - r11 - r22)
+        q = (0.25 * s, (r01 + r10) / s, (r02 + r20) / s, (r21 - r12) / s)
+    elif r11 > r22:
+        s = 2.0 * math.sqrt(1.0 + r11 - r00 - r22)
+        q = ((r01 + r10) / s, 0.25 * s, (r12 + r21) / s, (r02 - r20) / s)
+    else:
+        s = 2.0 * math.sqrt(1.0 + r22 - r00 - r11)
+        q = ((r02 + r20) / s, (r12 + r21) / s, 0.25 * s, (r10 - r01) / s)
+    return q if q[3] >= 0 else (-q[0], -q[1], -q[2], -q[3])
+
+
+class URKinematics:
+    def __init__(self, robot_type='UR5'):
+        self.d, self.a, self.alph = UR_DH[robot_type]
+        self._ca = [math.cos(a) for a in self.alph]
+        self._sa = [math.sin(a) for a in self.alph]
+        # frames[i] is the transform from the base to the frame of joint i, frames[6] the tip
+        self.frames = np.zeros((NUM_JOINTS + 1, 4, 4))
+        self.frames[0] = np.eye(4)
+        self.jacobian = np.zeros((6, NUM_JOINTS))
+        self._link = np.eye(4)
+        self._offsets = JOINT_OFFSETS.tolist()
+        self._d = self.d.tolist()
+        self._a = self.a.tolist()
+        self._lever = np.zeros((NUM_JOINTS, 3))
+        self._tmp = np.zeros(NUM_JOINTS)
+        # the analytic IK needs the UR layout (a1 = a4 = a5 = a6 = 0, d2 = d3 = 0, alphas pi/2, 0, 0, pi/2, -pi/2)
+        if (np.abs(self.a[[0, 3, 4, 5]]).max() > 0 or np.abs(self.d[1:3]).max() > 0 or
+                not np.allclose(self.alph[:5], [np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2])):
+            raise ValueError(robot_type + " DH parameters do not have the UR layout needed by the analytic IK")
+        # a non zero alpha6 (the UR5 entry of UR_DH) only rotates the tip about its x axis, the IK removes it first
+        self._alpha6_inverse = np.eye(4)
+        self._alpha6_inverse[1:3, 1:3] = [[self._ca[5], self._sa[5]], [-self._sa[5], self._ca[5]]]
+        self.joint_limits = JOINT_LIMITS
+        # branch signs of th1, th5, th3 for the eight solutions
+        self._branches = np.array([(s1, s5, s3) for s1 in (1, -1) for s5 in (1, -1) for s3 in (1, -1)], dtype=np.float64).T
+
+    def fk(self, q):
+        """Tip transform and 6x6 Jacobian (linear rows first) for the AMBF joint positions q.
+        Both are views of internal buffers, overwritten by the next call"""
+        link = self._link
+        for i in range(NUM_JOINTS):
+            th = q[i] + self._offsets[i]
+            ct, st = math.cos(th), math.sin(th)
+            ca, sa = self._ca[i], self._sa[i]
+            # Rz(th) Tz(d) Tx(a) Rx(alpha)
+            link[0, 0] = ct
+            link[0, 1] = -st * ca
+            link[0, 2] = st * sa
+            link[0, 3] = self._a[i] * ct
+            link[1, 0] = st
+            link[1, 1] = ct * ca
+            link[1, 2] = -ct * sa
+            link[1, 3] = self._a[i] * st
+            link[2, 1] = sa
+            link[2, 2] = ca
+            link[2, 3] = self._d[i]
+            np.matmul(self.frames[i], link, out=self.frames[i + 1])
+
+        # linear part z_k x (tip - o_k), angular part z_k, all written into the buffers
+        z = self.frames[:NUM_JOINTS, 0:3, 2]
+        lever = self._lever
+        jac = self.jacobian
+        tmp = self._tmp
+        np.subtract(self.frames[NUM_JOINTS, 0:3, 3], self.frames[:NUM_JOINTS, 0:3, 3], out=lever)
+        for row, (i, j) in enumerate(((1, 2), (2, 0), (0, 1))):
+            np.multiply(z[:, i], lever[:, j], out=jac[row])
+            np.multiply(z[:, j], lever[:, i], out=tmp)
+            np.subtract(jac[row], tmp, out=jac[row])
+        np.copyto(jac[3:6], z.T)
+        return self.frames[NUM_JOINTS], jac
+
+    def ik_all(self, T, th6_singular=0.0):
+        """All eight inverse kinematics solutions of the 4x4 tip transform T, as (8, 6) AMBF joint positions wrapped
+        to [-pi, pi]. Rows are nan where the branch does not reach T. th6_singular is used for th6 when the wrist
+        is singular (th5 = 0), where th4 + th6 is all that is determined"""
+        d1, _, _, d4, d5, d6 = self._d
+        a2, a3 = self._a[1], self._a[2]
+        T = np.asarray(T, dtype=np.float64) @ self._alpha6_inverse
+        r, p = T[0:3, 0:3], T[0:3, 3]
+        s1_sign, s5_sign, s3_sign = self._branches
+
+        # th1: the wrist center (origin of frame 5) lies at distance d4 from the plane of the arm
+        p05 = p - d6 * r[:, 2]
+        radius = math.hypot(p05[0], p05[1])
+        th1 = math.atan2(p05[1], p05[0]) + s1_sign * _acos_branches(d4 / radius if radius > 0 else np.inf) + np.pi / 2
+        c1, s1 = np.cos(th1), np.sin(th1)
+
+        # th5 from the tip position along the joint 1 axis, th6 from the tip orientation
+        th5 = s5_sign * _acos_branches((p[0] * s1 - p[1] * c1 - d4) / d6)
+        s5 = np.sin(th5)
+        singular = np.abs(s5) < _WRIST_SINGULARITY
+        safe_s5 = np.where(singular, 1.0, s5)
+        th6 = np.where(singular, th6_singular + JOINT_OFFSETS[5],
+                       np.arctan2((-r[0, 1] * s1 + r[1, 1] * c1) / safe_s5, (r[0, 0] * s1 - r[1, 0] * c1) / safe_s5))
+
+        # th2, th3, th4: planar 3 link arm in the x-y plane of frame 1, whose rotation about z is th2 + th3 + th4
+        T01 = _dh_transforms(th1, d1, 0.0, self.alph[0])
+        T46 = _dh_transforms(th5, d5, 0.0, self.alph[4]) @ _dh_transforms(th6, d6, 0.0, 0.0)
+        T14 = _rigid_inverse(T01) @ T @ _rigid_inverse(T46)
+        x, y = T14[:, 0, 3], T14[:, 1, 3]
+        th3 = s3_sign * _acos_branches((x ** 2 + y ** 2 - a2 ** 2 - a3 ** 2) / (2 * a2 * a3))
+        th2 = np.arctan2(y, x) - np.arctan2(a3 * np.sin(th3), a2 + a3 * np.cos(th3))
+        th4 = np.arctan2(T14[:, 1, 0], T14[:, 0, 0]) - th2 - th3
+
+        q = np.stack((th1, th2, th3, th4, th5, th6), axis=1) - JOINT_OFFSETS
+        return np.mod(q + np.pi, 2 * np.pi) - np.pi
+
+    def ik(self, T, q_current=None, max_error=1e-6):
+        """AMBF joint positions reaching the tip transform T closest to q_current (default zeros), each joint
+        shifted by a turn where that brings it closer and stays within joint_limits. None if T is not reachable.
+        Solutions whose forward kinematics misses T by more than max_error (m / rad) are rejected"""
+        q_current = np.zeros(NUM_JOINTS) if q_current is None else np.asarray(q_current, dtype=np.float64)
+        solutions = self.ik_all(T, q_current[5])
+        # candidates q - 2 pi, q, q + 2 pi of every joint of every solution: (8, 6, 3)
+        candidates = solutions[:, :, None] + np.array([-2 * np.pi, 0.0, 2 * np.pi])
+        lower, upper = self.joint_limits
+        in_limits = (candidates >= lower[:, None]) & (candidates <= upper[:, None])
+        distance = np.where(in_limits, np.abs(candidates - q_current[:, None]), np.inf)
+        nearest = np.argmin(distance, axis=2)
+        q = np.take_along_axis(candidates, nearest[:, :, None], axis=2)[:, :, 0]
+        cost = np.take_along_axis(distance, nearest[:, :, None], axis=2)[:, :, 0]
+        cost = np.where(np.isnan(solutions), np.inf, cost ** 2).sum(axis=1)
+        T = np.asarray(T, dtype=np.float64)
+        for i in np.argsort(cost):
+            if not np.isfinite(cost[i]):
+                return None
+            T_check, _ = self.fk(q[i])
+            if np.abs(T_check[0:3, :] - T[0:3, :]).max() <= max_error:
+                return q[i]
+        return None
+
+
+def fk_batch(q, robot_type='UR5'):
+    """(N, 6) joint positions -> (N, 4, 4) tip transforms and (N, 6, 6) Jacobians"""
+    d, a, alph = UR_DH[robot_type]
+    q = np.atleast_2d(np.asarray(q, dtype=np.float64)) + JOINT_OFFSETS
+    n = len(q)
+    ct, st = np.cos(q), np.sin(q)
+    ca, sa = np.cos(alph), np.sin(alph)
+    links = np.zeros((n, NUM_JOINTS, 4, 4))
+    links[..., 0, 0] = ct
+    links[..., 0, 1] = -st * ca
+    links[..., 0, 2] = st * sa
+    links[..., 0, 3] = a * ct
+    links[..., 1, 0] = st
+    links[..., 1, 1] = ct * ca
+    links[..., 1, 2] = -ct * sa
+    links[..., 1, 3] = a * st
+    links[..., 2, 1] = sa
+    links[..., 2, 2] = ca
+    links[..., 2, 3] = d
+    links[..., 3, 3] = 1.0
+
+    frames = np.empty((n, NUM_JOINTS + 1, 4, 4))
+    frames[:, 0] = np.eye(4)
+    for i in range(NUM_JOINTS):
+        np.matmul(frames[:, i], links[:, i], out=frames[:, i + 1])
+
+    z = frames[:, :NUM_JOINTS, 0:3, 2]
+    lever = frames[:, NUM_JOINTS, None, 0:3, 3] - frames[:, :NUM_JOINTS, 0:3, 3]
+    jacobians = np.empty((n, 6, NUM_JOINTS))
+    jacobians[:, 0:3, :] = np.swapaxes(np.cross(z, lever), 1, 2)
+    jacobians[:, 3:6, :] = np.swapaxes(z, 1, 2)
+    return frames[:, NUM_JOINTS], jacobians
+
+
+def fk_reference(q, robot_type='UR5'):
+    """The original UR5_AMBF.FK computation (four 4x4 matrices and three products per joint)"""
+    d, a, alph = UR_DH[robot_type]
+    th = list(q)
+    th[0] -= np.pi
+
+    def AH(n, th):
+        T_a = np.identity(4)
+        T_a[0, 3] = a[n]
+        T_d = np.identity(4)
+        T_d[2, 3] = d[n]
+        Rzt = np.array([[np.cos(th[n]), -np.sin(th[n]), 0, 0],
+                        [np.sin(th[n]), np.cos(th[n]), 0, 0],
+                        [0, 0, 1, 0],
+                        [0, 0, 0, 1]])
+        Rxa = np.array([[1, 0, 0, 0],
+                        [0, np.cos(alph[n]), -np.sin(alph[n]), 0],
+                        [0, np.sin(alph[n]), np.cos(alph[n]), 0],
+                        [0, 0, 0, 1]])
+        return T_d @ Rzt @ T_a @ Rxa
+
+    FK_T = np.eye(4)
+    Origins_T = []
+    for i in range(len(th)):
+        Origins_T.append(FK_T)
+        FK_T = FK_T @ AH(i, th)
+    jac = np.zeros((6, 6))
+    tip = FK_T[0:3, 3]
+    for k, origin in enumerate(Origins_T):
+        jac[0:3, k] = np.cross(origin[0:3, 2], tip - origin[0:3, 3])
+        jac[3:6, k] = origin[0:3, 2]
+    return FK_T, jac
+
+
+def benchmark(robot_type='UR5', repeats=5000, batch=10000):
+    """us per configuration of fk_reference (+ scipy quaternion, as the old FK did), URKinematics.fk (+ quaternion),
+    fk_batch and URKinematics.ik, and the largest difference to the reference (of ik: tip pose error)"""
+    rng = np.random.default_rng(0)
+    configurations = rng.uniform(-np.pi, np.pi, size=(repeats, NUM_JOINTS))
+    kinematics = URKinematics(robot_type)
+    results = {}
+
+    try:
+        from scipy.spatial.transform import Rotation
+        t = time.perf_counter()
+        for q in configurations:
+            T, _ = fk_reference(q, robot_type)
+            Rotation.from_matrix(T[0:3, 0:3]).as_quat()
+        results['reference FK + scipy quaternion'] = (time.perf_counter() - t) / repeats * 1e6
+    except ImportError:
+        pass
+
+    t = time.perf_counter()
+    for q in configurations:
+        fk_reference(q, robot_type)
+    results['reference FK'] = (time.perf_counter() - t) / repeats * 1e6
+
+    q_lists = configurations.tolist()
+    t = time.perf_counter()
+    for q in q_lists:
+        T, _ = kinematics.fk(q)
+        rotation_to_quaternion(T)
+    results['URKinematics.fk + quaternion'] = (time.perf_counter() - t) / repeats * 1e6
+
+    many = rng.uniform(-np.pi, np.pi, size=(batch, NUM_JOINTS))
+    t = time.perf_counter()
+    fk_batch(many, robot_type)
+    results['fk_batch (N=' + str(batch) + ')'] = (time.perf_counter() - t) / batch * 1e6
+
+    ik_repeats = repeats // 10
+    targets = [fk_reference(q, robot_type)[0] for q in configurations[:ik_repeats]]
+    t = time.perf_counter()
+    for T, q in zip(targets, q_lists):
+        kinematics.ik(T, q)
+    results['URKinematics.ik'] = (time.perf_counter() - t) / ik_repeats * 1e6
+
+    error = 0.0
+    for T, q in zip(targets, q_lists):
+        solution = kinematics.ik(T, q)
+        if solution is not None:
+            error = max(error, np.abs(fk_reference(solution, robot_type)[0] - T).max())
+    batch_T, batch_J = fk_batch(configurations, robot_type)
+    for i, q in enumerate(configurations):
+        ref_T, ref_J = fk_reference(q, robot_type)
+        T, J = kinematics.fk(q)
+        error = max(error, np.abs(T - ref_T).max(), np.abs(J - ref_J).max(),
+                    np.abs(batch_T[i] - ref_T).max(), np.abs(batch_J[i] - ref_J).max())
+    return results, error
+
+
+if __name__ == '__main__':
+    robot = sys.argv[1] if len(sys.argv) > 1 else 'UR5'
+    timings, max_error = benchmark(robot)
+    for name, us in timings.items():
+        print(f"{name:>34}: {us:8.2f} us per configuration")
+    print(f"largest difference to the reference: {max_error:.3g}")
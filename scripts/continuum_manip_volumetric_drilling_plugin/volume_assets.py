@@ -0,0 +1,171 @@
+
+import numpy as np
+from os import remove
+from os.path import isfile, join
+from continuum_manip_volumetric_drilling_plugin.volume_images import PngSliceWriter, DEFAULT_PNG_COMPRESS_LEVEL, DEFAULT_SLAB_DEPTH
+from continuum_manip_volumetric_drilling_plugin.hardness_file import AIR_HU
+
+# Helpers shared by the volume preparation scripts (setup_files_for_nrrd_volume.py, prepare_volumes.py) to turn an
+# nrrd volume into the png stack and VOLUME ADF loaded by AMBF
+
+PNG_STAGE = 'png_stack'
+PNG_SCALE = 255.9  # normalized values are scaled to [0, 256) and truncated to uint8
+
+
+def png_stage_params(image_prefix, compress_level, downsample=1):
+    # everything that changes the png files for a given nrrd, recorded in the asset manifest
+    params = {'prefix': image_prefix, 'compress_level': compress_level, 'normalization': 'min-max x ' + str(PNG_SCALE)}
+    if downsample != 1:
+        params['downsample'] = downsample
+    return params
+
+
+def level_volume_name(volume_name, factor):
+    # name of the VOLUME (and its png / hardness directory) for a downsampled level of the pyramid
+    return volume_name if factor == 1 else volume_name + "_ds" + str(factor)
+
+
+def downsample_volume(data, factor, background=None, chunk_blocks=8):
+    """Occupancy preserving factor x downsampling of an (x, y, z) volume. A block is occupied if any of its voxels is
+    above background (default: air, or the minimum of data if that is higher) and then gets the mean of its occupied
+    voxels, so thin structures such as cortical bone do not disappear into the surrounding air. Empty blocks get the
+    minimum of data. The volume is padded up to a multiple of factor"""
+    if factor == 1:
+        return data
+    vmin = data.min()
+    if background is None:
+        background = max(vmin, AIR_HU)
+    out_shape = tuple(-(-int(n) // factor) for n in data.shape)
+    out = np.empty(out_shape, dtype=np.result_type(data.dtype, np.float32))
+    # blocks are reduced a few z rows at a time to bound the temporary memory
+    step = factor * chunk_blocks
+    for z0 in range(0, data.shape[2], step):
+        chunk = data[:, :, z0:z0 + step]
+        nz = -(-chunk.shape[2] // factor)
+        pad = [(0, out_shape[0] * factor - chunk.shape[0]), (0, out_shape[1] * factor - chunk.shape[1]), (0, nz * factor - chunk.shape[2])]
+        chunk = np.pad(chunk, pad, mode='constant', constant_values=vmin)
+        blocks = chunk.reshape(out_shape[0], factor, out_shape[1], factor, nz, factor)
+        occupied = blocks > background
+        count = occupied.sum(axis=(1, 3, 5))
+        total = np.where(occupied, blocks, 0).sum(axis=(1, 3, 5), dtype=np.float64)
+        zb = z0 // factor
+        out[:, :, zb:zb + nz] = np.where(count > 0, total / np.maximum(count, 1), vmin)
+    return out
+
+
+def downsample_header(header, factor):
+    """nrrd header describing the output of downsample_volume(data, factor)"""
+    if factor == 1:
+        return header
+    level = dict(header)
+    directions = np.asarray(header['space directions'], dtype=np.float64)
+    level['sizes'] = np.array([-(-int(n) // factor) for n in header['sizes']])
+    level['space directions'] = directions * factor
+    # the origin stays the corner of the volume (as in volume_geometry), so the first block starts where the first
+    # voxel does. Only the padding moves the level: its centre is 0.5 * (sizes * factor - original sizes) original
+    # voxels further along each axis than that of the full resolution volume
+    level['space origin'] = np.asarray(header['space origin'], dtype=np.float64)
+    return level
+
+
+def normalize_data(data, min=None, max=None):
+    # min / max default to those of data, pass the global values when normalizing a slab of a larger volume
+    if max is None:
+        max = data.max()
+    if min is None:
+        min = data.min()
+    if max==min:
+        if min!= 0: # assume entire image is single volume
+            normalized_data = data/min
+        else: # image is all zero and will remain that way
+            normalized_data = data
+    else:
+        normalized_data = (data - min) / float(max - min)
+    return normalized_data
+
+
+def scale_data(data, scale):
+    scaled_data = data * scale
+    return scaled_data
+
+
+def volume_geometry(header, scale=1.0):
+    """(data_size, dimensions_m, origin_m) of the VOLUME ADF from an nrrd header"""
+    if header['space'] != 'left-posterior-superior':
+        print("WARNING: Coord system is not LPS, but: "+ header['space'])
+    dimensions_mm = np.matmul(header['space directions'],header['sizes'])
+    dimensions_m = 0.001*(dimensions_mm)
+    origin_mm = scale*(header['space origin'] + (dimensions_mm/2))
+    origin_m = 0.001 * origin_mm
+    return tuple(int(s) for s in header['sizes']), dimensions_m, origin_m
+
+
+def save_yaml_file(data_size, dimensions, volume_name, yaml_save_location, origin, scale):
+    # Note a swap in the 'x' and 'y' coordinates as a result of nrrd being HxW vs WxH for AMBF
+    lines = []
+    lines.append("# AMBF Version: (0.1)")
+    lines.append("bodies: []")
+    lines.append("joints: []")
+    lines.append("volumes: [VOLUME "+volume_name+"]")
+    lines.append("high resolution path: ./meshes/high_res/")
+    lines.append("low resolution path: ./meshes/low_res/")
+    lines.append("ignore inter-collision: true")
+    lines.append("namespace: /ambf/env/")
+    lines.append("")
+    lines.append("VOLUME "+volume_name+":")
+    lines.append("  name: "+volume_name)
+    lines.append("  location:")
+    lines.append("    position: {x: " + str(origin[1])+", y: "+str(origin[0])+", z: "+str(origin[2])+"}")
+    lines.append("    orientation: {r: 0.0, p: 0.0, y: " + str(np.pi/2)+"}")
+    lines.append("  scale: "+str(scale))
+    lines.append("  dimensions: {x: "+str(dimensions[1])+", y: "+str(dimensions[0])+", z: " + str(dimensions[2]) +"}")
+    lines.append("  images:")
+    lines.append("    path: ../resources/volumes/"+volume_name+"/")
+    lines.append("    prefix: plane00")
+    lines.append("    format: png")
+    lines.append("    count: " + str(max(data_size)))  # Note this can be larger than actual value
+    lines.append("  shaders:")
+    lines.append("    path: ./shaders/volume/")
+    lines.append("    vertex: shader.vs")
+    lines.append("    fragment: shader.fs")
+    yaml_file = yaml_save_location+volume_name+".yaml"
+    content = '\n'.join(lines)
+    # only touch the file if it changed, so unchanged assets keep their timestamps
+    if isfile(yaml_file):
+        with open(yaml_file, 'r') as f:
+            if f.read() == content:
+                return yaml_file
+    with open(yaml_file, 'w') as f:
+        f.write(content)
+        f.close()
+    return yaml_file
+
+
+def iter_volume_slabs(data, depth=DEFAULT_SLAB_DEPTH):
+    # same (z0, slab) pairs as NrrdSlabReader.iter_slabs, for a volume that is already in memory
+    for z0 in range(0, data.shape[2], depth):
+        yield z0, data[:, :, z0:z0 + depth]
+
+
+def update_png_stack(manifest, input_digest, slabs, value_range, png_dir, image_prefix, workers=1,
+                     compress_level=DEFAULT_PNG_COMPRESS_LEVEL, force=False, params=None):
+    """Normalize the (z0, slab) pairs of a volume with its global value_range (min, max) and write them as the png
+    stack in png_dir. Only slices whose pixels changed since the run recorded in the manifest are re-encoded, slices
+    that are no longer part of the volume are removed. Returns the PngSliceWriter (digests, skipped count)"""
+    if params is None:
+        params = png_stage_params(image_prefix, compress_level)
+    previous_stage = manifest.stage(PNG_STAGE)
+    previous_digests = {}
+    if not force and previous_stage.get('params') == params:
+        previous_digests = previous_stage.get('slices', {})
+    min, max = value_range
+    with PngSliceWriter(workers, compress_level, previous_digests=previous_digests) as writer:
+        for z0, slab in slabs:
+            writer.write_slab(scale_data(normalize_data(slab, min, max), PNG_SCALE), join(png_dir, image_prefix), start_idx=z0)
+    for stale in set(previous_stage.get('slices', {})) - set(writer.digests):
+        if isfile(join(png_dir, stale)):
+            remove(join(png_dir, stale))
+    manifest.set_stage(PNG_STAGE, input_digest, params, outputs=[join(png_dir, name) for name in sorted(writer.digests)],
+                       slices=writer.digests)
+    manifest.save()
+    return writer
@@ -0,0 +1,95 @@
+
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import PIL.Image
+import numpy as np
+from continuum_manip_volumetric_drilling_plugin.asset_cache import digest_bytes
+
+# Writes the plane00*.png stack loaded by the ADF VOLUME. Each slice is a grayscale RGBA image where black voxels
+# are fully transparent, identical to the former float -> uint8 -> RGB -> RGBA -> convert_png_transparent chain.
+
+# PIL's default zlib level, keeps the files byte-identical to the ones written by previous versions of the scripts
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+DEFAULT_SLAB_DEPTH = 16
+
+
+def slice_filename(im_prefix, idx):
+    return im_prefix + '0' + str(idx) + '.png'
+
+
+def slab_to_rgba(slab):
+    """(x, y, n) slab already scaled to [0, 256) -> (n, x, y, 4) uint8 RGBA array, zero voxels are transparent"""
+    gray = np.moveaxis(np.asarray(slab).astype(np.uint8), 2, 0)
+    rgba = np.empty(gray.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = gray
+    rgba[..., 1] = gray
+    rgba[..., 2] = gray
+    rgba[..., 3] = np.where(gray == 0, 0, 255)
+    return rgba
+
+
+def save_rgba_png(rgba, im_name, compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    PIL.Image.fromarray(rgba).save(im_name, compress_level=compress_level)
+
+
+class PngSliceWriter:
+    """Encodes slices on a pool of worker processes (inline if workers <= 1). At most max_pending slices are queued,
+    so memory stays bounded when fed slab by slab.
+    If previous_digests ({filename: digest} from an earlier run) is given, the pixel digest of every slice is recorded
+    in self.digests and slices whose file exists with an unchanged digest are not re-encoded"""
+
+    def __init__(self, workers=1, compress_level=DEFAULT_PNG_COMPRESS_LEVEL, max_pending=None, previous_digests=None):
+        if workers is None or workers <= 0:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        self.compress_level = compress_level
+        self.max_pending = max_pending if max_pending is not None else 4 * workers
+        self._pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._pending = set()
+        self.previous_digests = previous_digests
+        self.digests = {}
+        self.skipped = 0
+
+    def _wait_for(self, max_pending):
+        while len(self._pending) > max_pending:
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()  # re-raise encoding errors here
+
+    def write_slab(self, slab, im_prefix, start_idx=0):
+        """Write the slices of an (x, y, n) slab as im_prefix0<start_idx + i>.png, returns the written filenames"""
+        rgba = slab_to_rgba(slab)
+        filenames = []
+        for i in range(rgba.shape[0]):
+            im_name = slice_filename(im_prefix, start_idx + i)
+            filenames.append(im_name)
+            if self.previous_digests is not None:
+                key = os.path.basename(im_name)
+                self.digests[key] = digest_bytes(rgba[i])
+                if self.previous_digests.get(key) == self.digests[key] and os.path.isfile(im_name):
+                    self.skipped += 1
+                    continue
+            if self._pool is None:
+                save_rgba_png(rgba[i], im_name, self.compress_level)
+            else:
+                self._wait_for(self.max_pending - 1)
+                self._pending.add(self._pool.submit(save_rgba_png, rgba[i], im_name, self.compress_level))
+        return filenames
+
+    def write_volume(self, data, im_prefix, slab_depth=DEFAULT_SLAB_DEPTH):
+        filenames = []
+        for z0 in range(0, data.shape[2], slab_depth):
+            filenames += self.write_slab(data[:, :, z0:z0 + slab_depth], im_prefix, start_idx=z0)
+        return filenames
+
+    def close(self):
+        self._wait_for(0)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,198 @@
+
+import glob
+import json
+import os
+import time
+import traceback
+import nrrd
+from continuum_manip_volumetric_drilling_plugin.asset_cache import AssetManifest
+from continuum_manip_volumetric_drilling_plugin.hardness_file import save_hardness, hardness_stage_params, HARDNESS_STAGE_PREFIX
+from continuum_manip_volumetric_drilling_plugin.volume_assets import volume_geometry, save_yaml_file, png_stage_params, \
+    iter_volume_slabs, update_png_stack, downsample_volume, downsample_header, level_volume_name, PNG_STAGE
+from continuum_manip_volumetric_drilling_plugin.volume_images import DEFAULT_PNG_COMPRESS_LEVEL
+
+# Non-interactive preparation of one nrrd volume: the nrrd is decoded once and the array is handed to every output
+# stage (png stack, VOLUME ADF yaml, hardness file, metadata json). Optional downsampled levels (see
+# volume_assets.downsample_volume) are written as separate volumes named <volume>_ds<factor> with their own outputs.
+# Used by scripts/prepare_volumes.py
+
+STAGES = ('png', 'yaml', 'hardness', 'metadata')
+NRRD_PATTERNS = ('*.nrrd', '*.nhdr')
+
+DEFAULT_OPTIONS = {
+    'yaml_dir': 'ADF',
+    'png_root': 'resources/volumes',
+    'image_prefix': 'plane0',
+    'scale': 1.0,
+    'compress_level': DEFAULT_PNG_COMPRESS_LEVEL,
+    'png_workers': 1,
+    'hardness_format': 'bin',
+    'hardness_dtype': 'float32',
+    'stages': STAGES,
+    'levels': (1,),
+    'force': False,
+}
+
+
+def find_nrrd_files(inputs):
+    """Expand files, directories (all nrrds directly inside) and glob patterns into a sorted list without duplicates"""
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for pattern in NRRD_PATTERNS:
+                found += glob.glob(os.path.join(item, pattern))
+        elif os.path.isfile(item):
+            found.append(item)
+        else:
+            found += glob.glob(item, recursive=True)
+    return sorted(set(os.path.abspath(f) for f in found))
+
+
+def volume_name_for(nrrd_file):
+    return os.path.splitext(os.path.basename(nrrd_file))[0]
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.isfile(path) else 0
+
+
+def _stage_size(manifest, stage_name):
+    return sum(_file_size(os.path.join(manifest.directory, f)) for f in manifest.stage(stage_name).get('outputs', {}))
+
+
+def save_metadata_file(filename, metadata):
+    with open(filename, 'w') as f:
+        json.dump(metadata, f, indent=1, sort_keys=True)
+
+
+def process_volume(nrrd_file, options=None):
+    """Run the requested stages for one nrrd, returns a result dict with status, per stage timings (s) and
+    output sizes (bytes). Never raises, errors are reported in the result"""
+    opts = dict(DEFAULT_OPTIONS)
+    opts.update(options or {})
+    name = opts.get('volume_name') or volume_name_for(nrrd_file)
+    result = {'nrrd': nrrd_file, 'volume': name, 'status': 'ok', 'timings': {}, 'sizes': {}}
+    t_start = time.perf_counter()
+    try:
+        _process_volume(nrrd_file, name, opts, result)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        result['traceback'] = traceback.format_exc()
+    result['timings']['total'] = time.perf_counter() - t_start
+    result['sizes']['total'] = sum(result['sizes'].values())
+    return result
+
+
+class _LazyVolume:
+    # decodes the nrrd on first use and keeps every downsampled level that was asked for, so the volume is
+    # decoded at most once whatever the stages and levels that are out of date
+    def __init__(self, nrrd_file, timings):
+        self.nrrd_file = nrrd_file
+        self.timings = timings
+        self._levels = {}
+
+    def get(self, factor):
+        if factor not in self._levels:
+            if 1 not in self._levels:
+                t = time.perf_counter()
+                self._levels[1], _ = nrrd.read(self.nrrd_file)
+                self.timings['decode'] = time.perf_counter() - t
+            t = time.perf_counter()
+            self._levels[factor] = downsample_volume(self._levels[1], factor)
+            _add(self.timings, 'downsample', time.perf_counter() - t)
+        return self._levels[factor]
+
+
+def _add(totals, key, value):
+    totals[key] = totals.get(key, 0) + value
+
+
+def _process_volume(nrrd_file, name, opts, result):
+    t = time.perf_counter()
+    header = nrrd.read_header(nrrd_file)
+    result['timings']['header'] = time.perf_counter() - t
+    volume = _LazyVolume(nrrd_file, result['timings'])
+    result['levels'] = []
+    up_to_date = True
+    for factor in sorted(set(opts['levels'])):
+        up_to_date &= _process_level(nrrd_file, level_volume_name(name, factor), downsample_header(header, factor), volume,
+                                     factor, opts, result)
+        result['levels'].append(level_volume_name(name, factor))
+    if up_to_date:
+        result['status'] = 'up to date'
+
+
+def _process_level(nrrd_file, name, header, volume, factor, opts, result):
+    """Run the stages for one level of the pyramid (factor 1 is the full resolution volume), timings and sizes are
+    accumulated over the levels. Returns True if nothing had to be regenerated"""
+    timings = result['timings']
+    sizes = result['sizes']
+    stages = opts['stages']
+    png_dir = os.path.join(opts['png_root'], name)
+    os.makedirs(png_dir, exist_ok=True)
+    os.makedirs(opts['yaml_dir'], exist_ok=True)
+
+    manifest = AssetManifest(png_dir)
+    nrrd_digest = manifest.input_digest(nrrd_file)
+    data_size, dimensions_m, origin_m = volume_geometry(header, opts['scale'])
+
+    png_params = png_stage_params(opts['image_prefix'], opts['compress_level'], factor)
+    hardness_stage = HARDNESS_STAGE_PREFIX + opts['hardness_format']
+    hardness_params = hardness_stage_params(opts['hardness_format'], opts['hardness_dtype'])
+    if factor != 1:
+        hardness_params['downsample'] = factor
+    need_png = 'png' in stages and (opts['force'] or not manifest.stage_up_to_date(PNG_STAGE, nrrd_digest, png_params))
+    need_hardness = 'hardness' in stages and (opts['force'] or not manifest.stage_up_to_date(hardness_stage, nrrd_digest, hardness_params))
+
+    if need_png:
+        data = volume.get(factor)
+        t = time.perf_counter()
+        writer = update_png_stack(manifest, nrrd_digest, iter_volume_slabs(data), (data.min(), data.max()), png_dir,
+                                  opts['image_prefix'], opts['png_workers'], opts['compress_level'], opts['force'], png_params)
+        _add(result, 'slices_written', len(writer.digests) - writer.skipped)
+        _add(timings, 'png', time.perf_counter() - t)
+    if 'png' in stages:
+        _add(sizes, 'png', _stage_size(manifest, PNG_STAGE))
+
+    if 'yaml' in stages:
+        t = time.perf_counter()
+        yaml_dir = os.path.join(opts['yaml_dir'], '')
+        yaml_file = save_yaml_file(data_size, dimensions_m, name, yaml_dir, origin_m, opts['scale'])
+        _add(timings, 'yaml', time.perf_counter() - t)
+        _add(sizes, 'yaml', _file_size(yaml_file))
+
+    hardness_file = os.path.join(png_dir, name + "_hardness." + opts['hardness_format'])
+    if need_hardness:
+        data = volume.get(factor)
+        t = time.perf_counter()
+        save_hardness(hardness_file, data, header, opts['hardness_format'], opts['hardness_dtype'])
+        manifest.set_stage(hardness_stage, nrrd_digest, hardness_params, outputs=[hardness_file])
+        manifest.save()
+        _add(timings, 'hardness', time.perf_counter() - t)
+    if 'hardness' in stages:
+        _add(sizes, 'hardness', _file_size(hardness_file))
+
+    if 'metadata' in stages:
+        t = time.perf_counter()
+        metadata_file = os.path.join(png_dir, name + "_metadata.json")
+        save_metadata_file(metadata_file, {
+            'volume_name': name,
+            'nrrd_file': nrrd_file,
+            'nrrd_digest': nrrd_digest,
+            'downsample': factor,
+            'sizes': list(data_size),
+            'type': header['type'],
+            'space': header.get('space'),
+            'space_directions': [list(map(float, d)) for d in header['space directions']],
+            'space_origin': list(map(float, header['space origin'])),
+            'scale': opts['scale'],
+            'dimensions_m': list(map(float, dimensions_m)),
+            'origin_m': list(map(float, origin_m)),
+            'image_prefix': opts['image_prefix'],
+            'slice_count': len(manifest.stage(PNG_STAGE).get('slices', {})),
+            'hardness_file': os.path.basename(hardness_file) if 'hardness' in stages else None,
+        })
+        _add(timings, 'metadata', time.perf_counter() - t)
+        _add(sizes, 'metadata', _file_size(metadata_file))
+    return not need_png and not need_hardness
@@ -0,0 +1,32 @@
+
+import numpy as np
+
+# Unpacking of the voxels_removed_batch messages of the drilling plugin (no ROS dependency, works on any object with
+# the sensor_msgs/PointCloud2 fields). Every message holds the voxels removed in one physics tick:
+#   indices, colors, time = unpack_voxels_removed(msg)   # (n, 3) int32, (n, 4) uint8, sim time in s
+# A batch with is_reset_batch(msg) follows a reset of the volume to its state as loaded (resetVoxels or a checkpoint
+# restore), its voxels are the ones removed again on top of it.
+
+# point layout written by DrillingPublisher::queueVoxelRemoved (collision_publisher.cpp)
+VOXEL_BATCH_DTYPE = np.dtype([('index', '<i4', (3,)), ('color', 'u1', (4,))])
+VOXEL_BATCH_FIELDS = ('x', 'y', 'z', 'r', 'g', 'b', 'a')
+# header.frame_id of the reset batches (VOXEL_BATCH_RESET_FRAME in collision_publisher.cpp)
+VOXEL_BATCH_RESET_FRAME = 'volume_reset'
+
+
+def unpack_voxels_removed(msg):
+    """(n, 3) voxel indices, (n, 4) RGBA colors (0-255) and the sim time of a voxels_removed_batch message.
+    The arrays are read only views of the message data"""
+    if msg.point_step != VOXEL_BATCH_DTYPE.itemsize or tuple(f.name for f in msg.fields) != VOXEL_BATCH_FIELDS:
+        raise ValueError("Not a voxels_removed_batch message (point_step " + str(msg.point_step) + ")")
+    points = np.frombuffer(msg.data, dtype=VOXEL_BATCH_DTYPE, count=msg.width * msg.height)
+    return points['index'], points['color'], msg.header.stamp.to_sec()
+
+
+def is_reset_batch(msg):
+    return msg.header.frame_id == VOXEL_BATCH_RESET_FRAME
+
+
+def colors_to_float(colors):
+    """uint8 RGBA -> float 0..1, as sent on the per voxel voxels_removed topic"""
+    return np.asarray(colors, dtype=np.float32) / 255.0
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use('Agg')  # headless, figures are only written to files
+import matplotlib.pyplot as plt
+import numpy as np
+from continuum_manip_volumetric_drilling_plugin.calibration_fit import load_calibration_session, fit_calibration_model, \
+    save_calibration_fit, plot_calibration_fit, OUTPUT_NAMES
+
+# Offline version of the 'F' command of free_space_calibration.py, no ROS master needed:
+#   python3 fit_calibration.py output/20230101120000 output/20230102* --degrees 1-6 -j 4
+# Every session directory is fitted on its own (or all together with --combine), the polynomial degree of each
+# output is picked by k-fold cross validation and the coefficient files and plots are written next to the session
+
+
+def parse_degrees(text):
+    degrees = set()
+    for part in text.split(','):
+        if '-' in part:
+            low, high = part.split('-')
+            degrees.update(range(int(low), int(high) + 1))
+        elif part.strip():
+            degrees.add(int(part))
+    return sorted(degrees)
+
+
+def fit_and_save(name, lengths, base_avg, tip_avg, prefix, parsed_args, degrees, executor):
+    t = time.perf_counter()
+    fit = fit_calibration_model(lengths, base_avg, tip_avg, degrees, parsed_args.folds, parsed_args.derivative_degree, executor)
+    files = save_calibration_fit(fit, prefix)
+    if not parsed_args.no_plots:
+        figures = plot_calibration_fit(fit)
+        for figure, suffix in zip(figures, ("xyzthz_fit.png", "dxdydzdthz_fit.png")):
+            figure.savefig(prefix + suffix)
+            plt.close(figure)
+    print(name + ": " + str(len(lengths)) + " datapoints, degrees " +
+          ", ".join(o + "=" + str(d) for o, d in zip(OUTPUT_NAMES, fit['degrees'])) + " ({:.2f} s)".format(time.perf_counter() - t))
+    for degree, errors in sorted(fit['cv_errors'].items()):
+        print("    degree {:>2}: cv rmse ".format(degree) + " ".join("{}={:.3g}".format(o, np.sqrt(e)) for o, e in zip(OUTPUT_NAMES, errors)))
+    for f in files:
+        print("    saved " + f)
+
+
+def main():
+    parser = ArgumentParser(description="Fit the snake calibration polynomials of saved calibration sessions")
+    parser.add_argument('sessions', nargs='+', help='Session directories written by free_space_calibration.py')
+    parser.add_argument('--degrees', action='store', dest='degrees', default='1-5',
+                        help='Candidate polynomial degrees, e.g. 3 or 1-6 or 2,3,5 (default 1-5)')
+    parser.add_argument('-k', '--folds', action='store', dest='folds', type=int, default=5, help='Cross validation folds')
+    parser.add_argument('--derivative-degree', action='store', dest='derivative_degree', type=int, default=3,
+                        help='Degree of the derivative over thz fits')
+    parser.add_argument('-o', action='store', dest='output_dir',
+                        help='Write the results here instead of into each session directory')
+    parser.add_argument('--combine', action='store_true', dest='combine', help='Fit all sessions together as one dataset')
+    parser.add_argument('--no-plots', action='store_true', dest='no_plots', help='Only write the coefficient files')
+    parser.add_argument('-j', '--jobs', action='store', dest='jobs', type=int, default=0,
+                        help='Processes used to evaluate the candidate degrees (0 = one per cpu)')
+    parsed_args = parser.parse_args()
+
+    try:
+        degrees = parse_degrees(parsed_args.degrees)
+    except ValueError:
+        parser.error("--degrees must look like 3, 1-6 or 2,3,5")
+    if not degrees or degrees[0] < 0:
+        parser.error("--degrees must contain non negative degrees")
+    if parsed_args.output_dir:
+        os.makedirs(parsed_args.output_dir, exist_ok=True)
+
+    sessions = []
+    for directory in parsed_args.sessions:
+        if not os.path.isdir(directory):
+            print("Skipping " + directory + ": not a directory")
+            continue
+        try:
+            sessions.append((directory, load_calibration_session(directory)))
+        except (OSError, ValueError) as e:
+            print("Skipping " + directory + ": " + str(e))
+    if not sessions:
+        sys.exit("Error: no calibration sessions could be loaded")
+
+    timestamp = time.strftime("%Y%m%d%H%M%S_")
+    jobs = parsed_args.jobs if parsed_args.jobs > 0 else (os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 and len(degrees) > 1 else None
+    try:
+        if parsed_args.combine:
+            lengths = np.concatenate([s[0] for _, s in sessions])
+            base_avg = np.concatenate([s[1] for _, s in sessions])
+            tip_avg = np.concatenate([s[2] for _, s in sessions])
+            prefix = os.path.join(parsed_args.output_dir or sessions[0][0], timestamp + "combined_")
+            fit_and_save("combined (" + str(len(sessions)) + " sessions)", lengths, base_avg, tip_avg, prefix, parsed_args, degrees, executor)
+        else:
+            for directory, (lengths, base_avg, tip_avg, _, _) in sessions:
+                name = os.path.basename(os.path.normpath(directory))
+                output_dir = parsed_args.output_dir or directory
+                prefix = os.path.join(output_dir, timestamp + (name + "_" if parsed_args.output_dir else ""))
+                try:
+                    fit_and_save(name, lengths, base_avg, tip_avg, prefix, parsed_args, degrees, executor)
+                except (ValueError, np.linalg.LinAlgError) as e:
+                    print(name + ": fit failed: " + str(e))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
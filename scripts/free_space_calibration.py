@@ -7,9 +7,11 @@ from sensor_msgs.msg import JointState
 from ambf_msgs.msg import RigidBodyState
 import numpy as np
 import matplotlib.pyplot as plt
-import tf.transformations as tr
 import time
 import os
+from continuum_manip_volumetric_drilling_plugin.sample_buffer import SampleRingBuffer, mean_pose, motion_metrics, POSE_COLUMNS, JOINT_COLUMNS
+from continuum_manip_volumetric_drilling_plugin.session_store import SessionStore, Session, is_session_dir, BASE, TIP, BEND
+from continuum_manip_volumetric_drilling_plugin.calibration_fit import fit_calibration_model, save_calibration_fit, plot_calibration_fit
 
 class free_space_calibration:
 
@@ -24,15 +26,31 @@ class free_space_calibration:
         bend_sub = rospy.Subscriber('/ambf/volumetric_drilling/bend_motor/measured_js/', JointState, self.bend_sub_callback)
         self.bend_pub = rospy.Publisher('/ambf/volumetric_drilling/bend_motor/move_jp/', JointState)
 
-        self.collect = False
-        self.reset_sublists()
+        # every message is written into these preallocated buffers, windows are cut out of them by collect_over_period
+        self.base_samples = SampleRingBuffer(POSE_COLUMNS)
+        self.tip_samples = SampleRingBuffer(POSE_COLUMNS)
+        self.bend_samples = SampleRingBuffer(JOINT_COLUMNS)
+        self.bend_motor_pos = None
+        self.window_stats = []
 
         self.simulation_units_to_meter = 0.1
 
         self.ms = 0.001
         self.sec = 1.0
-        self.base_transform = TransformStamped()
-        self.tip_transform = TransformStamped()
+
+        # 'A' sweep: bend positions and repetitions, and when the manipulator counts as settled at each of them.
+        # Settled = over the last settle_window seconds the tip moved slower than settle_velocity (m/s) with a
+        # position standard deviation below settle_std (m) and the bend motor moved slower than settle_joint_velocity
+        self.sweep_points = rospy.get_param('~sweep_points', 101)
+        self.sweep_reps = rospy.get_param('~sweep_reps', 1)
+        self.sweep_max = rospy.get_param('~sweep_max', 0.20)
+        self.settle_window = rospy.get_param('~settle_window', 0.25)
+        self.settle_velocity = rospy.get_param('~settle_velocity', 0.0005)
+        self.settle_std = rospy.get_param('~settle_std', 0.00005)
+        self.settle_joint_velocity = rospy.get_param('~settle_joint_velocity', 0.001)
+        self.settle_min_time = rospy.get_param('~settle_min_time', 0.1)
+        self.settle_timeout = rospy.get_param('~settle_timeout', 3.0)
+        self.sweep_collect_duration = rospy.get_param('~sweep_collect_duration', 0.5)
         self.base_zero_transform = np.eye(4)   
         self.tip_zero_transform = np.eye(4)
 
@@ -41,7 +59,11 @@ class free_space_calibration:
         self.base_transforms_measured_avg = []
         self.tip_transforms_measured_avg = []
         self.bend_motor_pos_all = []
+        # one command per datapoint, NaN for the manually collected ones
         self.bend_motor_cmd_all = []
+        self.last_window = None
+        # datapoints are appended to the session files as they are collected (see session_store.py)
+        self.store = SessionStore(self.save_dir)
 
     def run(self):
        do_run = True
@@ -59,22 +81,7 @@ class free_space_calibration:
 
             # Automatically run data collection over range specified below
             if user_in == "A":
-                reps = 1
-                motor_max = 0.20
-                motor_min = -motor_max
-                motor_pos = np.linspace(motor_min,motor_max,101)
-
-                motor_pos_rev = np.flipud(motor_pos)
-                pos = np.append(motor_pos,motor_pos_rev)
-                for r in range(reps):
-                    for p in pos:
-                        self.bend_motor_cmd_all.append(p)
-                        msg_pub = JointState()
-                        msg_pub.position = [p]
-                        self.bend_pub.publish(msg_pub)
-                        rospy.sleep(3000*self.ms)
-                        self.collect_over_period(500*self.ms) 
-                        self.save_to_output()
+                self.auto_calibration_sweep()
                 continue
             
             # Fit calibration
@@ -87,160 +94,129 @@ class free_space_calibration:
             if user_in == 'Z':
                 self.base_zero_transform = self.base_transforms_measured_avg[-1]
                 self.tip_zero_transform = self.tip_transforms_measured_avg[-1]
+                self.store.set_zero_transforms(self.base_zero_transform, self.tip_zero_transform)
         
             self.save_to_output()        
 
+    def auto_calibration_sweep(self):
+        motor_max = self.sweep_max
+        motor_min = -motor_max
+        motor_pos = np.linspace(motor_min,motor_max,self.sweep_points)
+
+        motor_pos_rev = np.flipud(motor_pos)
+        pos = np.append(motor_pos,motor_pos_rev)
+        settle_times = []
+        timed_out = 0
+        t_sweep = time.perf_counter()
+        msg_pub = JointState()
+        for r in range(self.sweep_reps):
+            for i, p in enumerate(pos):
+                msg_pub.position = [p]
+                self.bend_pub.publish(msg_pub)
+                settle_time, settled = self.wait_until_settled()
+                settle_times.append(settle_time)
+                timed_out += not settled
+                self.collect_over_period(self.sweep_collect_duration*self.sec)
+                self.save_to_output(p)
+                print(f"[{r + 1}/{self.sweep_reps}] {i + 1}/{len(pos)} bend {p:.4f}: settled in {settle_time:.2f} s" + ("" if settled else " (timeout)"))
+        sweep_time = time.perf_counter() - t_sweep
+
+        settle_times = np.array(settle_times)
+        np.savetxt(self.save_dir + time.strftime("%Y%m%d%H%M%S_") + "sweep_settle_times.txt",
+                   np.column_stack((np.tile(pos, self.sweep_reps), settle_times)), header="bend_cmd settle_time_s")
+        print(f"Sweep of {len(settle_times)} points took {sweep_time:.1f} s, settle time mean {settle_times.mean():.2f} s, "
+              f"max {settle_times.max():.2f} s, {timed_out} timeouts")
+
+    def is_settled(self):
+        latest_tip = self.tip_samples.latest()
+        latest_bend = self.bend_samples.latest()
+        if latest_tip is None or latest_bend is None:
+            return False
+        tip = self.tip_samples.since_time(latest_tip[0] - self.settle_window)
+        bend = self.bend_samples.since_time(latest_bend[0] - self.settle_window)
+        # the windows need to be (nearly) full, otherwise a short burst of samples could look still
+        if len(tip) < 2 or tip[-1, 0] - tip[0, 0] < 0.8 * self.settle_window or len(bend) < 2:
+            return False
+        tip_speed, tip_std = motion_metrics(tip, [1, 2, 3])
+        bend_speed, _ = motion_metrics(bend, [1])
+        return tip_speed < self.settle_velocity and tip_std < self.settle_std and bend_speed < self.settle_joint_velocity
+
+    def wait_until_settled(self):
+        """Block until the tip and bend motor stop moving or settle_timeout passes. Returns (seconds waited, settled)"""
+        t_start = time.perf_counter()
+        rospy.sleep(self.settle_min_time*self.sec)
+        while not rospy.is_shutdown():
+            elapsed = time.perf_counter() - t_start
+            if self.is_settled():
+                return elapsed, True
+            if elapsed >= self.settle_timeout:
+                return elapsed, False
+            rospy.sleep(20*self.ms)
+        return time.perf_counter() - t_start, False
+
     def collect_over_period(self, collect_duration):
         # Collect data
-        self.reset_sublists()
-        self.collect = True
+        marks = [buffer.mark() for buffer in (self.base_samples, self.tip_samples, self.bend_samples)]
         rospy.sleep(collect_duration)
-        self.collect = False
-
-        # Store data internally
-        self.base_transforms_measured_all.append(self.base_transforms_sublist)
-        self.tip_transforms_measured_all.append(self.tip_transforms_sublist)
-        self.bend_motor_pos_all.append(self.bend_motor_pos_sublist)
-
-        self.base_transforms_measured_avg.append(self.average_list_of_TransformStamped(self.base_transforms_sublist))
-        self.tip_transforms_measured_avg.append(self.average_list_of_TransformStamped(self.tip_transforms_sublist))
-
-
-    def average_list_of_TransformStamped(self,list_of_TS):
-        N = len(list_of_TS)
-        average = TransformStamped()
-        average.transform.rotation.w = sum([T.transform.rotation.w for T in list_of_TS])/N
-        average.transform.rotation.x = sum([T.transform.rotation.x for T in list_of_TS])/N
-        average.transform.rotation.y = sum([T.transform.rotation.y for T in list_of_TS])/N
-        average.transform.rotation.z = sum([T.transform.rotation.z for T in list_of_TS])/N
-        average.transform.translation.x = sum([T.transform.translation.x for T in list_of_TS])/N
-        average.transform.translation.y = sum([T.transform.translation.y for T in list_of_TS])/N
-        average.transform.translation.z = sum([T.transform.translation.z for T in list_of_TS])/N
-
-        R = average.transform.rotation
-        p = average.transform.translation
-        q = np.array([R.x,R.y,R.z,R.w])
-        q = q / np.linalg.norm(q)
-        g = tr.quaternion_matrix(q)
-        g[0:3,-1] = np.array([p.x,p.y,p.z])
-        return g
-
-    def base_marker_sub_callback(self,transform):
-        self.base_transform = transform
-        if self.collect:
-            self.base_transforms_sublist.append(transform)
-
-    def tip_marker_sub_callback(self,transform):
-        self.tip_transform = transform
-        if self.collect:
-            self.tip_transforms_sublist.append(transform)
+        base = self.base_samples.since_mark()
+        tip = self.tip_samples.since_mark()
+        bend = self.bend_samples.since_mark()
+        stats = {name: buffer.window_stats(mark) for name, buffer, mark
+                 in zip(('base', 'tip', 'bend'), (self.base_samples, self.tip_samples, self.bend_samples), marks)}
+        self.window_stats.append(stats)
+        self.print_window_stats(stats)
+
+        # Store data internally: (n, 8) t, xyz, quaternion arrays and the bend motor positions
+        self.base_transforms_measured_all.append(base)
+        self.tip_transforms_measured_all.append(tip)
+        self.bend_motor_pos_all.append(bend[:, 1])
+
+        self.base_transforms_measured_avg.append(mean_pose(base))
+        self.tip_transforms_measured_avg.append(mean_pose(tip))
+        self.last_window = (base, tip, bend)
+
+    def print_window_stats(self, stats):
+        line = "Collected"
+        for name, s in stats.items():
+            line += f" {name}: {s['samples']} samples"
+            if s['overwritten'] or s['seq_gaps']:
+                line += f" ({s['overwritten']} overwritten, {s['seq_gaps']} missed)"
+            line += ","
+        print(line.rstrip(","))
+
+    def push_rigid_body_state(self, buffer, ambf_rigid_body_state):
+        p = ambf_rigid_body_state.pose.position
+        q = ambf_rigid_body_state.pose.orientation
+        s = self.simulation_units_to_meter
+        header = ambf_rigid_body_state.header
+        buffer.push((header.stamp.to_sec(), p.x * s, p.y * s, p.z * s, q.x, q.y, q.z, q.w), header.seq)
 
     def ambf_base_marker_sub_callback(self,ambf_rigid_body_state):
-        self.base_marker_sub_callback(ambf_rigid_body_state_to_transform_stamped(ambf_rigid_body_state, self.simulation_units_to_meter))
+        self.push_rigid_body_state(self.base_samples, ambf_rigid_body_state)
   
     def ambf_tip_marker_sub_callback(self,ambf_rigid_body_state):
-        self.tip_marker_sub_callback(ambf_rigid_body_state_to_transform_stamped(ambf_rigid_body_state, self.simulation_units_to_meter))
+        self.push_rigid_body_state(self.tip_samples, ambf_rigid_body_state)
 
     def bend_sub_callback(self,motor_pos):
         self.bend_motor_pos = motor_pos.position[0]
-        if self.collect:
-            self.bend_motor_pos_sublist.append(motor_pos.position[0])
-
-    def reset_sublists(self):
-        self.base_transforms_sublist = []
-        self.tip_transforms_sublist = []
-        self.bend_motor_pos_sublist = []
+        self.bend_samples.push((motor_pos.header.stamp.to_sec(), motor_pos.position[0]), motor_pos.header.seq)
 
     def fit_calibration(self):
-        lengths = self.bend_motor_cmd_all
-        x = np.zeros(len(lengths))
-        y = np.zeros(len(lengths))
-        z = np.zeros(len(lengths))
-        thz = np.zeros(len(lengths))
+        # only the commanded datapoints, same as load_calibration_session for the offline fit
+        cmds = np.array(self.bend_motor_cmd_all, dtype=np.float64)
+        commanded = ~np.isnan(cmds)
+        lengths = cmds[commanded]
 
         print("bend lengths: ", lengths)
         base_T_tip_zero = np.linalg.inv(self.base_zero_transform) @ self.tip_zero_transform
         print("base_T_tip_zero: ", base_T_tip_zero) # Not using right now
 
-        for i in range(len(lengths)):
-            base_T_tip =  np.linalg.inv(self.base_transforms_measured_avg[i]) @ self.tip_transforms_measured_avg[i]
-            x[i]=base_T_tip[0,3]
-            y[i]=base_T_tip[1,3]
-            z[i]=base_T_tip[2,3]
-            print(base_T_tip)
-            th,dir,_ = tr.rotation_from_matrix(base_T_tip)
-            thz[i] = th * np.sign(dir[2])
-            print(dir)
-
-        l = np.array(lengths)
-        degree = 3
-        x_coeff = np.polyfit(l, x, degree)
-        y_coeff = np.polyfit(l, y, degree)
-        z_coeff = np.polyfit(l, z, degree)
-        thz_coeff  = np.polyfit(l, thz, degree)
-
-        poly_x = np.poly1d(x_coeff)
-        poly_y = np.poly1d(y_coeff)
-        poly_z = np.poly1d(z_coeff)
-        poly_thz = np.poly1d(thz_coeff)
-
-        new_l = np.linspace(min(l), max(l))
-        new_x = poly_x(new_l)
-        new_y = poly_y(new_l)
-        new_z = poly_z(new_l)
-        new_thz = poly_thz(new_l)
-
-        fig, (ax_x, ax_y, ax_z, ax_thz) = plt.subplots(4)
-        ax_x.plot(l, x, "o", new_l, new_x)
-        ax_x.set(xlabel="cable length (mm)", ylabel="Tip X value (m)")
-        ax_y.plot(l, y, "o", new_l, new_y)
-        ax_y.set(xlabel="cable length (mm)", ylabel="Tip Y value (m)")
-        ax_z.plot(l, z, "o", new_l, new_z)
-        ax_z.set(xlabel="cable length (mm)", ylabel="Tip Z value (m)")
-        ax_thz.plot(l, thz, "o", new_l, new_thz)
-        ax_thz.set(xlabel="cable length (mm)", ylabel="Tip Rotation Angle (rad) (th_z)")  
+        # same fit as fit_calibration.py (offline, over saved sessions), with a fixed degree
+        fit = fit_calibration_model(lengths, np.array(self.base_transforms_measured_avg)[commanded],
+                                    np.array(self.tip_transforms_measured_avg)[commanded], degrees=(3,))
         timestamp = time.strftime("%Y%m%d%H%M%S_")
-
-        save_filename = self.save_dir+timestamp+"xyzthz_snake_polyfit_coeffs.txt"
-        np.savetxt(save_filename,np.array((x_coeff,y_coeff,z_coeff,thz_coeff)))
-
-        # additional estimates of dx,dy,dz as function of thz (essentially fitting terms of the jacobian to angle)
-        poly_dx = poly_x.deriv()
-        poly_dy = poly_y.deriv()
-        poly_dz = poly_z.deriv()
-        poly_dth = poly_thz.deriv()
-        new_dx = poly_dx(new_l)
-        new_dy = poly_dy(new_l)
-        new_dz = poly_dz(new_l)
-        new_dth = poly_dth(new_l)
-        # find fit coefficients for dx,dy,dz as function of thz
-        dx_thzcoeff = np.polyfit(new_thz, new_dx, degree)
-        dy_thzcoeff = np.polyfit(new_thz, new_dy, degree)
-        dz_thzcoeff = np.polyfit(new_thz, new_dz, degree)
-        dth_thzcoeff = np.polyfit(new_thz, new_dth, degree)
-
-        poly_dx_thz = np.poly1d(dx_thzcoeff)
-        poly_dy_thz = np.poly1d(dy_thzcoeff)
-        poly_dz_thz = np.poly1d(dz_thzcoeff)
-        poly_dth_thz = np.poly1d(dth_thzcoeff)
-
-        new_dx_thz = poly_dx_thz(new_thz)
-        new_dy_thz = poly_dy_thz(new_thz)
-        new_dz_thz = poly_dz_thz(new_thz)
-        new_dth_thz = poly_dth_thz(new_thz)
-
-        fig, (ax_dx, ax_dy, ax_dz, ax_dth) = plt.subplots(4)
-        ax_dx.plot(new_thz, new_dx, "o", new_thz, new_dx_thz)
-        ax_dx.set(xlabel="Tip Rotation Angle (rad) (th_z)", ylabel="Tip X value (m)")
-        ax_dy.plot(new_thz, new_dy, "o", new_thz, new_dy_thz)
-        ax_dy.set(xlabel="Tip Rotation Angle (rad) (th_z)", ylabel="Tip Y value (m)")
-        ax_dz.plot(new_thz, new_dz, "o", new_thz, new_dz_thz)
-        ax_dz.set(xlabel="Tip Rotation Angle (rad) (th_z)", ylabel="Tip Z value (m)")
-        ax_dth.plot(new_thz, new_dth, "o", new_thz, new_dth_thz)
-        ax_dth.set(xlabel="Tip Rotation Angle (rad) (th_z)", ylabel="Tip Rotation Angle (rad) (th_z)")
-
-        save_filename = self.save_dir+timestamp+"dxdydzdthz_snake_polyfit_coeffs.txt"
-        np.savetxt(save_filename,np.array((dx_thzcoeff,dy_thzcoeff,dz_thzcoeff,dth_thzcoeff)))
+        _, save_filename = save_calibration_fit(fit, self.save_dir+timestamp)
+        plot_calibration_fit(fit)
 
         print("Coefficients saved to " + save_filename)
         print("Close Graph to Continue:")
@@ -248,15 +224,11 @@ class free_space_calibration:
 
 
 
-    def save_to_output(self):
-        np.save(self.save_dir+"base_transforms_measured_all.npy",np.array(self.base_transforms_measured_all))
-        np.save(self.save_dir+"tip_transforms_measured_all.npy",np.array(self.tip_transforms_measured_all))
-        np.save(self.save_dir+"base_transforms_measured_avg.npy",np.array(self.base_transforms_measured_avg))
-        np.save(self.save_dir+"tip_transforms_measured_avg.npy",np.array(self.tip_transforms_measured_avg))
-        np.save(self.save_dir+"base_zero_transform.npy",np.array(self.base_zero_transform))
-        np.save(self.save_dir+"tip_zero_transform.npy",np.array(self.tip_zero_transform))
-        np.save(self.save_dir+"bend_motor_pos_all.npy",np.array(self.bend_motor_pos_all))
-        np.save(self.save_dir+"bend_motor_cmd_all.npy",np.array(self.bend_motor_cmd_all))
+    def save_to_output(self, bend_cmd=np.nan):
+        # appends the last collected datapoint, the cost does not depend on the size of the session
+        base, tip, bend = self.last_window
+        self.bend_motor_cmd_all.append(bend_cmd)
+        self.store.append_point(base, tip, bend, self.base_transforms_measured_avg[-1], self.tip_transforms_measured_avg[-1], bend_cmd)
 
     def load_from_output(self):
         # ask user for directory to load from
@@ -268,14 +240,54 @@ class free_space_calibration:
         # check if directory ends with "/"
         if not load_dir.endswith("/"):
             load_dir += "/"
-        self.base_transforms_measured_all = np.load(load_dir+"base_transforms_measured_all.npy", allow_pickle=True)
-        self.tip_transforms_measured_all = np.load(load_dir+"tip_transforms_measured_all.npy", allow_pickle=True)
-        self.base_transforms_measured_avg = np.load(load_dir+"base_transforms_measured_avg.npy", allow_pickle=True)
-        self.tip_transforms_measured_avg = np.load(load_dir+"tip_transforms_measured_avg.npy", allow_pickle=True)
+        if not is_session_dir(load_dir):
+            self.load_from_legacy_output(load_dir)
+            return
+        session = Session(load_dir)
+        self.base_transforms_measured_all = [session.point_samples(i, BASE) for i in range(len(session))]
+        self.tip_transforms_measured_all = [session.point_samples(i, TIP) for i in range(len(session))]
+        self.bend_motor_pos_all = [session.point_samples(i, BEND)[:, 1] for i in range(len(session))]
+        self.base_transforms_measured_avg = list(np.array(session.base_avg))
+        self.tip_transforms_measured_avg = list(np.array(session.tip_avg))
+        self.base_zero_transform = session.base_zero_transform
+        self.tip_zero_transform = session.tip_zero_transform
+        # NaN for the manually collected datapoints, which have no bend command
+        self.bend_motor_cmd_all = list(session.bend_cmd)
+
+        # the loaded datapoints become the start of this session, as new datapoints are appended to it
+        if os.path.abspath(load_dir) != os.path.abspath(self.save_dir):
+            self.store.clear()
+            for i in range(len(session)):
+                self.store.append_point(session.point_samples(i, BASE), session.point_samples(i, TIP), session.point_samples(i, BEND),
+                                        session.base_avg[i], session.tip_avg[i], session.bend_cmd[i])
+            self.store.set_zero_transforms(self.base_zero_transform, self.tip_zero_transform)
+        print(f"Loaded {len(session)} datapoints from {load_dir}")
+
+    def load_from_legacy_output(self, load_dir):
+        # sessions saved as one pickled .npy per list by earlier versions, only the averaged transforms are kept
+        self.base_transforms_measured_avg = list(np.load(load_dir+"base_transforms_measured_avg.npy", allow_pickle=True))
+        self.tip_transforms_measured_avg = list(np.load(load_dir+"tip_transforms_measured_avg.npy", allow_pickle=True))
         self.base_zero_transform = np.load(load_dir+"base_zero_transform.npy", allow_pickle=True)
         self.tip_zero_transform = np.load(load_dir+"tip_zero_transform.npy", allow_pickle=True)
-        self.bend_motor_pos_all = np.load(load_dir+"bend_motor_pos_all.npy", allow_pickle=True)
-        self.bend_motor_cmd_all = np.load(load_dir+"bend_motor_cmd_all.npy", allow_pickle=True)
+        self.bend_motor_cmd_all = list(np.load(load_dir+"bend_motor_cmd_all.npy", allow_pickle=True))
+        self.base_transforms_measured_all = []
+        self.tip_transforms_measured_all = []
+        self.bend_motor_pos_all = []
+        # carried over into this session without their raw samples. The commands can only be matched to the
+        # datapoints if every datapoint was commanded
+        n = len(self.base_transforms_measured_avg)
+        cmds = self.bend_motor_cmd_all if len(self.bend_motor_cmd_all) == n else [np.nan] * n
+        self.bend_motor_cmd_all = list(cmds)
+        no_samples = np.zeros((0, 8))
+        self.store.clear()
+        for i in range(n):
+            self.store.append_point(no_samples, no_samples, np.zeros((0, 2)), self.base_transforms_measured_avg[i],
+                                    self.tip_transforms_measured_avg[i], cmds[i])
+            self.base_transforms_measured_all.append(no_samples)
+            self.tip_transforms_measured_all.append(no_samples)
+            self.bend_motor_pos_all.append(np.zeros(0))
+        self.store.set_zero_transforms(self.base_zero_transform, self.tip_zero_transform)
+        print(f"Loaded {n} datapoints from legacy files in {load_dir}")
     
 
 def ambf_rigid_body_state_to_transform_stamped(ambf_rigid_body_state, translation_scale=1.0):
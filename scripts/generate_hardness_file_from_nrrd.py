@@ -1,12 +1,35 @@
 #!/usr/bin/env python3
 
 import nrrd
-import PIL.Image
 import numpy as np
 from argparse import ArgumentParser
 import sys
 from os.path import isdir, isfile
 from os import mkdir
+from continuum_manip_volumetric_drilling_plugin.hardness_file import save_hardness, create_hardness_file, encode_hardness, hu_to_hardness, \
+    to_hardness_axes, hardness_stage_params, AIR_HU, HARDNESS_AXIS_ORDER, HARDNESS_STAGE_PREFIX, DEFAULT_BRICK_SIZE
+from continuum_manip_volumetric_drilling_plugin.nrrd_stream import NrrdSlabReader, DEFAULT_MAX_MEMORY_MB
+from continuum_manip_volumetric_drilling_plugin.asset_cache import AssetManifest
+
+
+def save_hardness_streaming(output_filename, reader, dtype, spacing_mm):
+    # first pass: global HU range, second pass: convert and write each z slab straight into the memory mapped output
+    min_hu, max_hu = reader.min_max(mask_above=AIR_HU)
+    sizes = reader.shape
+    hardness = create_hardness_file(output_filename, (sizes[1], sizes[0], sizes[2]), dtype=dtype, axis_order=HARDNESS_AXIS_ORDER,
+                                    origin=reader.header['space origin'], spacing=spacing_mm)
+    for z0, slab in reader.iter_slabs():
+        hardness[:, :, z0:z0 + slab.shape[2]] = encode_hardness(to_hardness_axes(hu_to_hardness(slab, min_hu, max_hu)), dtype)
+        hardness.flush()
+    del hardness
+
+
+def save_hardness_in_memory(output_filename, nrrd_file, format, dtype, brick_size=DEFAULT_BRICK_SIZE):
+    data, header = nrrd.read(nrrd_file)
+    if header['space'] != 'left-posterior-superior':
+        print("WARNING: Coord system is not LPS, but: " + header['space'])
+    print(header)
+    save_hardness(output_filename, data, header, format, dtype, brick_size)
 
 
 def main():
@@ -14,11 +37,27 @@ def main():
     parser = ArgumentParser()
     parser.add_argument('-n', action='store', dest='nrrd_file', help='Specify Nrrd File')
     parser.add_argument('-o', action='store', dest='output_dir', help='Specify output file')
+    parser.add_argument('-f', action='store', dest='format',
+                        help='Output format, binary (bin), sparse binary that skips air-only bricks (bricks) or legacy per-voxel csv (csv)',
+                        choices=['bin', 'bricks', 'csv'], default='bin')
+    parser.add_argument('-t', action='store', dest='dtype', help='Value type stored in the binary formats',
+                        choices=['float32', 'uint8'], default='float32')
+    parser.add_argument('-b', '--brick-size', action='store', dest='brick_size', type=int, default=DEFAULT_BRICK_SIZE,
+                        help='Edge length in voxels of the bricks of the bricks format (power of two)')
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='Process the nrrd in z slabs with bounded memory instead of loading the whole volume (binary format only)')
+    parser.add_argument('--max-memory', action='store', dest='max_memory', type=float, default=DEFAULT_MAX_MEMORY_MB,
+                        help='Approximate memory budget (MB) per slab in streaming mode')
+    parser.add_argument('--force', action='store_true', dest='force',
+                        help='Regenerate the hardness file even if the asset manifest says it is up to date')
     parsed_args = parser.parse_args()
+    if parsed_args.stream and parsed_args.format != 'bin':
+        parser.error("--stream only supports the binary format")
+    if parsed_args.brick_size <= 0 or parsed_args.brick_size & (parsed_args.brick_size - 1):
+        parser.error("--brick-size must be a power of two")
     nrrd_file = parsed_args.nrrd_file
     if not isfile(parsed_args.nrrd_file):
         sys.exit("Error: nrrd file " + parsed_args.nrrd_file + " does not exist")
-    scale = 10.0
     output_dir = parsed_args.output_dir
     # check if save location exists
     if not isdir(output_dir):
@@ -32,51 +71,31 @@ def main():
 
     # get the file name of nrrd file
     nrrd_file_name = nrrd_file.split("/")[-1]
-    output_filename = output_dir + "/" + nrrd_file_name.replace(".nrrd", "_hardness.csv")
-    
-    # read the nrrd file    
-    data, header = nrrd.read(nrrd_file)
-    if header['space'] != 'left-posterior-superior':
-        print("WARNING: Coord system is not LPS, but: " + header['space'])
-    dimensions_mm = np.matmul(header['space directions'], header['sizes'])
-    dimensions_m = 0.001*(dimensions_mm)
-    origin_mm = scale*(header['space origin'] + (dimensions_mm/2))
-    origin_m = 0.001 * origin_mm
-    print(header)
-    
-    print("help")
+    output_filename = output_dir + "/" + nrrd_file_name.replace(".nrrd", "_hardness." + parsed_args.format)
 
-    min_hu = np.min(data[data > -1000])
-    max_hu = np.max(data)
-    
-    # set data[data > -1000] to be scaled between 0 and 1
-    if min_hu == max_hu:
-        if min_hu == -1000:
-            # set all data to 0
-            data = np.zeros(data.shape)
-        else:
-            # set all data to 1
-            data = np.ones(data.shape)
+    # nothing to do if this nrrd was already converted with the same parameters and the output is untouched
+    manifest = AssetManifest(output_dir)
+    nrrd_digest = manifest.input_digest(nrrd_file)
+    stage_name = HARDNESS_STAGE_PREFIX + parsed_args.format
+    hardness_params = hardness_stage_params(parsed_args.format, parsed_args.dtype, parsed_args.brick_size)
+    if not parsed_args.force and manifest.stage_up_to_date(stage_name, nrrd_digest, hardness_params):
+        print(f"Hardness file is up to date: {output_filename}")
+        return
+
+    if parsed_args.stream:
+        reader = NrrdSlabReader(nrrd_file, parsed_args.max_memory)
+        header = reader.header
+        if header['space'] != 'left-posterior-superior':
+            print("WARNING: Coord system is not LPS, but: " + header['space'])
+        print(header)
+        print("Streaming " + str(reader.shape) + " volume in slabs of " + str(reader.slab_depth) + " slices")
+        spacing_mm = np.linalg.norm(header['space directions'], axis=1)
+        save_hardness_streaming(output_filename, reader, parsed_args.dtype, spacing_mm)
     else:
-        data[data > -1000] = (data[data > -1000] - min_hu) / (max_hu - min_hu)
-        # set data[data <= -1000] to be 0
-        data[data <= -1000] = 0
-
-    # data is (x by y by z) but we want (y by x by z)
-    data = np.swapaxes(data, 0, 1)
-    # we want to flip the y' axis if axes are (x' by y' by z')
-    data = np.flip(data, 1)
-    data_size = data.shape
-    # now let's save to csv where first line is the dimensions of the data (x by y by z) and then nested for loop through x,y,z each line is data[x,y,z]
-    with open(output_filename, 'w') as f:
-        
-        # write the dimensions
-        f.write(str(data_size[0]) + "," + str(data_size[1]) + "," + str(data_size[2]) + "\n")
-        for x in range(data_size[0]):
-            for y in range(data_size[1]):
-                for z in range(data_size[2]):
-                    f.write(str(data[x,y,z])+ "\n")
+        save_hardness_in_memory(output_filename, nrrd_file, parsed_args.format, parsed_args.dtype, parsed_args.brick_size)
 
+    manifest.set_stage(stage_name, nrrd_digest, hardness_params, outputs=[output_filename])
+    manifest.save()
     print(f"Hardness file saved to: {output_filename}")
 
 
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import sys
+from argparse import ArgumentParser
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray
+from continuum_manip_volumetric_drilling_plugin.physics_profile import STATUS_NAME, parse_values, format_table, \
+    ReportCsvWriter
+
+# Live table of where the simulator's physicsUpdate time goes (reports of the plugin's --profile_period):
+#   rosrun continuum_manip_volumetric_drilling_plugin physics_profile_monitor.py -o physics_profile.csv
+# One csv row per report, times in ms (see physics_profile.py for the columns)
+
+CLEAR_SCREEN = "\033[2J\033[H"
+
+
+def main():
+    parser = ArgumentParser(description="Show the physicsUpdate phase timings of the volumetric drilling plugin")
+    parser.add_argument('-o', action='store', dest='csv_file', default=None, help='Also append every report to this csv file')
+    parser.add_argument('-n', action='store', dest='count', type=int, default=0,
+                        help='Exit after this many reports (0 = run until shutdown)')
+    parser.add_argument('--status-name', action='store', dest='status_name', default=STATUS_NAME,
+                        help='DiagnosticStatus name of the reports (default "' + STATUS_NAME + '")')
+    parser.add_argument('--no-clear', action='store_true', dest='no_clear', help='Print reports one after the other instead of redrawing')
+    parsed_args, _ = parser.parse_known_args(rospy.myargv()[1:])
+
+    rospy.init_node('physics_profile_monitor', anonymous=True)
+    writer = ReportCsvWriter(parsed_args.csv_file) if parsed_args.csv_file else None
+    received = [0]
+
+    def callback(msg):
+        for status in msg.status:
+            if status.name != parsed_args.status_name:
+                continue
+            report = parse_values([(kv.key, kv.value) for kv in status.values])
+            stamp = msg.header.stamp.to_sec()
+            if writer is not None:
+                writer.write(stamp, report)
+            text = format_table(report)
+            if status.level != status.OK:
+                text += "\nWARNING: " + status.message
+            sys.stdout.write(("" if parsed_args.no_clear else CLEAR_SCREEN) + status.name + " at " + f"{stamp:.3f}\n" + text + "\n")
+            sys.stdout.flush()
+            received[0] += 1
+            if parsed_args.count and received[0] >= parsed_args.count:
+                rospy.signal_shutdown("received " + str(received[0]) + " reports")
+
+    rospy.Subscriber("/diagnostics", DiagnosticArray, callback, queue_size=10)
+    print("Waiting for " + parsed_args.status_name + " reports on /diagnostics...")
+    rospy.spin()
+    if writer is not None:
+        writer.close()
+        print("Wrote " + str(writer.rows) + " reports to " + parsed_args.csv_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import os
+import time
+from argparse import ArgumentParser
+from continuum_manip_volumetric_drilling_plugin.predrill_mask import VolumeGrid, read_predrill_csv, trajectories_mask, \
+    source_hash, write_mask, read_mask_header, DEFAULT_MM_TO_AMBF_UNIT
+
+# Voxelizes predrill trajectories once, for the plugin's --predrill_mask_file option:
+#   python3 precompute_predrill_mask.py -a ../ADF/RFemur.yaml -o ../resources/predrill.mask ../resources/predrill1.csv ../resources/predrill2.csv
+# The mask is only rewritten when the trajectories or the volume changed (hash stored in the file header)
+
+
+def main():
+    parser = ArgumentParser(description="Precompute the voxels removed by predrill trajectories")
+    parser.add_argument('csv_files', nargs='+', help='Predrill trajectory csvs (burr size in mm, then x, y, z per line)')
+    parser.add_argument('-a', action='store', dest='adf_file', required=True, help='ADF yaml of the volume')
+    parser.add_argument('-n', action='store', dest='volume_name', default=None, help='Volume in the ADF (default the first one)')
+    parser.add_argument('-o', action='store', dest='output', required=True, help='Output mask file')
+    parser.add_argument('--voxel-count', action='store', dest='voxel_count', type=int, nargs=3, default=None,
+                        help='Voxel count of the volume, read from the png slices if not given')
+    parser.add_argument('--mm-to-ambf-unit', action='store', dest='mm_to_ambf_unit', type=float, default=DEFAULT_MM_TO_AMBF_UNIT,
+                        help='AMBF units per mm (default ' + str(DEFAULT_MM_TO_AMBF_UNIT) + ')')
+    parser.add_argument('--force', action='store_true', dest='force', help='Rewrite the mask even if it is up to date')
+    args = parser.parse_args()
+
+    grid = VolumeGrid.from_adf(args.adf_file, args.volume_name, args.voxel_count)
+    hash_hex = source_hash(args.csv_files, grid, args.mm_to_ambf_unit)
+    if not args.force and os.path.isfile(args.output):
+        header = read_mask_header(args.output)
+        if header is not None and header['source_hash'] == hash_hex:
+            print(args.output + " is up to date (" + str(header['count']) + " voxels)")
+            return
+
+    t = time.perf_counter()
+    indices = trajectories_mask([read_predrill_csv(f) for f in args.csv_files], grid, args.mm_to_ambf_unit)
+    write_mask(args.output, indices, grid.voxel_count, hash_hex)
+    print("Wrote " + str(len(indices)) + " voxels of a " + "x".join(str(n) for n in grid.voxel_count) + " volume to "
+          + args.output + " in " + "{:.3f}".format(time.perf_counter() - t) + " s")
+
+
+if __name__ == '__main__':
+    main()
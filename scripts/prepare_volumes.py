@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from continuum_manip_volumetric_drilling_plugin.volume_pipeline import find_nrrd_files, process_volume, STAGES
+from continuum_manip_volumetric_drilling_plugin.volume_images import DEFAULT_PNG_COMPRESS_LEVEL
+
+# Batch, non-interactive version of setup_files_for_nrrd_volume.py + generate_hardness_file_from_nrrd.py:
+#   python3 prepare_volumes.py <dir | glob | file.nrrd> [...] -j 4
+# Each nrrd is decoded once and written as png stack, VOLUME ADF yaml, hardness file and metadata json.
+# Missing output directories are created, unchanged volumes are skipped (see asset_manifest.json)
+
+PLUGIN_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def print_summary(results, wall_time):
+    columns = ['decode', 'downsample', 'png', 'hardness', 'total']
+    print("")
+    print("{:<24} {:<11}".format("volume", "status") + "".join("{:>12}".format(c + " s") for c in columns) + "{:>12}".format("size MB"))
+    for r in results:
+        print("{:<24} {:<11}".format(r['volume'][:24], r['status'])
+              + "".join("{:>12.2f}".format(r['timings'].get(c, 0.0)) for c in columns)
+              + "{:>12.1f}".format(r['sizes'].get('total', 0) / 1e6))
+    failed = [r for r in results if r['status'] == 'error']
+    for r in failed:
+        print("")
+        print("ERROR in " + r['nrrd'] + ": " + r['error'])
+        print(r['traceback'])
+    print("")
+    print(str(len(results)) + " volumes, " + str(len(failed)) + " failed, wall time " + "{:.2f}".format(wall_time) + " s")
+
+
+def main():
+    parser = ArgumentParser(description="Prepare many nrrd volumes for the simulator in one unattended run")
+    parser.add_argument('inputs', nargs='+', help='nrrd files, directories containing nrrds, or glob patterns')
+    parser.add_argument('-y', action='store', dest='yaml_dir', default=os.path.join(PLUGIN_PATH, 'ADF'),
+                        help='Directory for the VOLUME yaml files (default <plugin-path>/ADF)')
+    parser.add_argument('-i', action='store', dest='png_root', default=os.path.join(PLUGIN_PATH, 'resources', 'volumes'),
+                        help='Root directory of the per volume png / hardness directories (default <plugin-path>/resources/volumes)')
+    parser.add_argument('-p', action='store', dest='image_prefix', default='plane0', help='Image prefix')
+    parser.add_argument('-s', action='store', dest='scale', type=float, default=1.0, help='Scale for volume')
+    parser.add_argument('-f', action='store', dest='hardness_format', choices=['bin', 'bricks', 'csv'], default='bin',
+                        help='Hardness file format (bricks: sparse binary that skips air-only bricks)')
+    parser.add_argument('-t', action='store', dest='hardness_dtype', choices=['float32', 'uint8'], default='float32',
+                        help='Value type stored in the binary hardness formats')
+    parser.add_argument('--stages', action='store', dest='stages', default=','.join(STAGES),
+                        help='Comma separated subset of ' + ','.join(STAGES))
+    parser.add_argument('--levels', action='store', dest='levels', default='1',
+                        help='Comma separated downsampling factors to export, e.g. 1,2,4. Each level > 1 is written as '
+                             'volume <name>_ds<factor> with its own pngs, yaml and hardness file')
+    parser.add_argument('-j', '--jobs', action='store', dest='jobs', type=int, default=0,
+                        help='Number of volumes processed concurrently (0 = one per cpu, capped by the number of volumes)')
+    parser.add_argument('--compress-level', action='store', dest='compress_level', type=int, default=DEFAULT_PNG_COMPRESS_LEVEL,
+                        choices=range(10), metavar='[0-9]', help='zlib level of the png slices')
+    parser.add_argument('--force', action='store_true', dest='force', help='Regenerate everything, ignoring the asset manifests')
+    parser.add_argument('--summary-json', action='store', dest='summary_json', help='Also write the per volume results to this file')
+    parsed_args = parser.parse_args()
+
+    stages = tuple(s.strip() for s in parsed_args.stages.split(',') if s.strip())
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error("Unknown stages: " + ", ".join(sorted(unknown)))
+
+    try:
+        levels = tuple(int(l) for l in parsed_args.levels.split(',') if l.strip())
+    except ValueError:
+        parser.error("--levels must be a comma separated list of integers")
+    if not levels or min(levels) < 1:
+        parser.error("--levels must contain factors >= 1")
+
+    nrrd_files = find_nrrd_files(parsed_args.inputs)
+    if not nrrd_files:
+        sys.exit("Error: no nrrd files found in " + " ".join(parsed_args.inputs))
+
+    cpus = os.cpu_count() or 1
+    jobs = parsed_args.jobs if parsed_args.jobs > 0 else cpus
+    jobs = min(jobs, len(nrrd_files))
+    options = {
+        'yaml_dir': parsed_args.yaml_dir,
+        'png_root': parsed_args.png_root,
+        'image_prefix': parsed_args.image_prefix,
+        'scale': parsed_args.scale,
+        'compress_level': parsed_args.compress_level,
+        # with a single volume at a time the png encoding gets the cores instead
+        'png_workers': cpus if jobs == 1 else 1,
+        'hardness_format': parsed_args.hardness_format,
+        'hardness_dtype': parsed_args.hardness_dtype,
+        'stages': stages,
+        'levels': levels,
+        'force': parsed_args.force,
+    }
+    print("Preparing " + str(len(nrrd_files)) + " volumes with " + str(jobs) + " jobs")
+
+    t_start = time.perf_counter()
+    results = []
+    if jobs == 1:
+        for nrrd_file in nrrd_files:
+            results.append(process_volume(nrrd_file, options))
+            print("[" + str(len(results)) + "/" + str(len(nrrd_files)) + "] " + results[-1]['volume'] + ": " + results[-1]['status'])
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(process_volume, nrrd_file, options) for nrrd_file in nrrd_files]
+            for future in as_completed(futures):
+                results.append(future.result())
+                print("[" + str(len(results)) + "/" + str(len(nrrd_files)) + "] " + results[-1]['volume'] + ": " + results[-1]['status'])
+    wall_time = time.perf_counter() - t_start
+
+    results.sort(key=lambda r: r['volume'])
+    print_summary(results, wall_time)
+    if parsed_args.summary_json:
+        with open(parsed_args.summary_json, 'w') as f:
+            json.dump({'wall_time': wall_time, 'results': results}, f, indent=1)
+    if any(r['status'] == 'error' for r in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
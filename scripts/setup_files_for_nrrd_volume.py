@@ -47,85 +47,16 @@
 
 # */
 # //==============================================================================
-from numpy import imag
 import nrrd
-import PIL.Image
-import numpy as np
 from argparse import ArgumentParser
 import sys
 from os.path import isdir, isfile
 from os import mkdir
-
-
-def convert_png_transparent(image, bg_color=(255,255,255)):
-    # https://stackoverflow.com/questions/765736/how-to-use-pil-to-make-all-white-pixels-transparent
-    # Jonathan Dauwe
-    array = np.array(image, dtype=np.ubyte)
-    mask = (array[:,:,:3] == bg_color).all(axis=2)
-    alpha = np.where(mask, 0, 255)
-    array[:,:,-1] = alpha
-    return PIL.Image.fromarray(np.ubyte(array))
-    
-def save_image(array, im_name):
-    img = PIL.Image.fromarray(array.astype(np.uint8))
-    img = img.convert("RGBA")
-    img = convert_png_transparent(img, bg_color=(0,0,0))
-    img.save(im_name)
-
-
-def normalize_data(data):
-    max = data.max()
-    min = data.min()
-    if max==min:
-        if min!= 0: # assume entire image is single volume
-            normalized_data = data/min
-        # here, else is implicit - image is all zero and will remain that way
-    else:
-        normalized_data = (data - min) / float(max - min)
-    return normalized_data
-
-
-def scale_data(data, scale):
-    scaled_data = data * scale
-    return scaled_data
-
-
-def save_volume_as_images(data, im_prefix):
-    for i in range(data.shape[2]):
-        im_name = im_prefix + '0' + str(i) + '.png'
-        save_image(data[:, :, i], im_name)
-
-def save_yaml_file(data_size, dimensions, volume_name, yaml_save_location, origin, scale):
-    # Note a swap in the 'x' and 'y' coordinates as a result of nrrd being HxW vs WxH for AMBF
-    lines = []
-    lines.append("# AMBF Version: (0.1)")
-    lines.append("bodies: []")
-    lines.append("joints: []")
-    lines.append("volumes: [VOLUME "+volume_name+"]")
-    lines.append("high resolution path: ./meshes/high_res/")
-    lines.append("low resolution path: ./meshes/low_res/")
-    lines.append("ignore inter-collision: true")
-    lines.append("namespace: /ambf/env/")
-    lines.append("")
-    lines.append("VOLUME "+volume_name+":")
-    lines.append("  name: "+volume_name)
-    lines.append("  location:")
-    lines.append("    position: {x: " + str(origin[1])+", y: "+str(origin[0])+", z: "+str(origin[2])+"}")
-    lines.append("    orientation: {r: 0.0, p: 0.0, y: " + str(np.pi/2)+"}")
-    lines.append("  scale: "+str(scale))
-    lines.append("  dimensions: {x: "+str(dimensions[1])+", y: "+str(dimensions[0])+", z: " + str(dimensions[2]) +"}")
-    lines.append("  images:")
-    lines.append("    path: ../resources/volumes/"+volume_name+"/")
-    lines.append("    prefix: plane00")
-    lines.append("    format: png")
-    lines.append("    count: " + str(max(data_size)))  # Note this can be larger than actual value
-    lines.append("  shaders:")
-    lines.append("    path: ./shaders/volume/")
-    lines.append("    vertex: shader.vs")
-    lines.append("    fragment: shader.fs")
-    with open(yaml_save_location+volume_name+".yaml", 'w') as f:
-        f.write('\n'.join(lines))
-        f.close()
+from continuum_manip_volumetric_drilling_plugin.nrrd_stream import NrrdSlabReader, DEFAULT_MAX_MEMORY_MB
+from continuum_manip_volumetric_drilling_plugin.volume_images import DEFAULT_PNG_COMPRESS_LEVEL
+from continuum_manip_volumetric_drilling_plugin.asset_cache import AssetManifest
+from continuum_manip_volumetric_drilling_plugin.volume_assets import volume_geometry, save_yaml_file, png_stage_params, \
+    iter_volume_slabs, update_png_stack, PNG_STAGE
 
 
 def main():
@@ -138,6 +69,16 @@ def main():
     parser.add_argument('-y', action='store', dest='yaml_save_location', help='Specify path for new yaml file')
     parser.add_argument('-i', action='store', dest='png_img_save_location', help='Specify path for png file directory')
     parser.add_argument('-s', action='store', dest='scale', help='Specify scale for volume', default=1.0)
+    parser.add_argument('--stream', action='store_true', dest='stream',
+                        help='Process the nrrd in z slabs with bounded memory instead of loading the whole volume')
+    parser.add_argument('--max-memory', action='store', dest='max_memory', type=float, default=DEFAULT_MAX_MEMORY_MB,
+                        help='Approximate memory budget (MB) per slab in streaming mode')
+    parser.add_argument('-j', '--workers', action='store', dest='workers', type=int, default=0,
+                        help='Number of processes encoding png slices (0 = one per cpu)')
+    parser.add_argument('--compress-level', action='store', dest='compress_level', type=int, default=DEFAULT_PNG_COMPRESS_LEVEL,
+                        choices=range(10), metavar='[0-9]', help='zlib level of the png slices (default keeps files identical to previous versions)')
+    parser.add_argument('--force', action='store_true', dest='force',
+                        help='Regenerate everything, ignoring the asset manifest of previous runs')
 
     parsed_args = parser.parse_args()
     print('Specified Arguments')
@@ -162,25 +103,36 @@ def main():
 
     scale = float(parsed_args.scale)
 
-    data, header = nrrd.read(parsed_args.nrrd_file)
-    print(np.min(data))
-    if header['space'] != 'left-posterior-superior':
-        print("WARNING: Coord system is not LPS, but: "+ header['space'])
-    dimensions_mm = np.matmul(header['space directions'],header['sizes'])
-    dimensions_m = 0.001*(dimensions_mm)
-    origin_mm = scale*(header['space origin'] + (dimensions_mm/2))
-    origin_m = 0.001 * origin_mm
+    header = nrrd.read_header(parsed_args.nrrd_file)
+    data_size, dimensions_m, origin_m = volume_geometry(header, scale)
     print(header)
-    data_size = data.shape
     # scaling = data.shape/np.linalg.norm(data.shape)
     # scaling = data.shape/np.max(data.shape)
 
     # print("Data size: " +  str(data_size))
     # print("Scaling: " + str(scaling))
-    normalized_data = normalize_data(data)
-    scaled_data = scale_data(normalized_data, 255.9)
-    
-    save_volume_as_images(scaled_data, png_img_dir+parsed_args.image_prefix)
+
+    # skip the slices entirely if the nrrd and the parameters are unchanged since the last run, otherwise only
+    # re-encode the slices whose pixels differ
+    manifest = AssetManifest(png_img_dir)
+    nrrd_digest = manifest.input_digest(parsed_args.nrrd_file)
+    png_params = png_stage_params(parsed_args.image_prefix, parsed_args.compress_level)
+    if not parsed_args.force and manifest.stage_up_to_date(PNG_STAGE, nrrd_digest, png_params):
+        print("PNG slices in " + png_img_dir + " are up to date")
+    else:
+        if parsed_args.stream:
+            reader = NrrdSlabReader(parsed_args.nrrd_file, parsed_args.max_memory)
+            print("Streaming " + str(data_size) + " volume in slabs of " + str(reader.slab_depth) + " slices")
+            # first pass finds the global range, second pass normalizes and writes one z slab at a time
+            value_range = reader.min_max()
+            slabs = reader.iter_slabs()
+        else:
+            data, header = nrrd.read(parsed_args.nrrd_file)
+            value_range = (data.min(), data.max())
+            slabs = iter_volume_slabs(data)
+        writer = update_png_stack(manifest, nrrd_digest, slabs, value_range, png_img_dir, parsed_args.image_prefix,
+                                  parsed_args.workers, parsed_args.compress_level, parsed_args.force)
+        print("Wrote " + str(len(writer.digests) - writer.skipped) + " slices, " + str(writer.skipped) + " unchanged")
     save_yaml_file(data_size, dimensions_m, parsed_args.volume_name, parsed_args.yaml_save_location, origin_m, scale)
 
 
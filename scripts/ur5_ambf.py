@@ -6,20 +6,44 @@ import rospy
 
 from sensor_msgs.msg import JointState
 from geometry_msgs.msg import PoseStamped
-from std_msgs.msg import Float64MultiArray, MultiArrayDimension
+from std_msgs.msg import Float64, Float64MultiArray, MultiArrayDimension
+from trajectory_msgs.msg import JointTrajectory
+from control_msgs.msg import JointTrajectoryControllerState
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+import os
 import time
-from scipy.spatial.transform import Rotation
+from continuum_manip_volumetric_drilling_plugin.ur_kinematics import URKinematics, UR_DH, rotation_to_quaternion
+from continuum_manip_volumetric_drilling_plugin.loop_profiler import LoopProfiler, format_summary
+from continuum_manip_volumetric_drilling_plugin.sample_buffer import quaternion_to_matrix
+from continuum_manip_volumetric_drilling_plugin.joint_trajectory import JointTrajectorySpline
+from continuum_manip_volumetric_drilling_plugin.calibration_lut import CalibrationLUT, DEFAULT_LENGTH_RANGE
+from continuum_manip_volumetric_drilling_plugin.combined_kinematics import CombinedKinematics, NUM_TASK_JOINTS
+
+LOOP_PHASES = ('read', 'fk', 'publish', 'command')
 
 
 class UR5_AMBF:
-    def __init__(self, client, name, use_simul_pos_for_vel=False):
+    def __init__(self, client, name, use_simul_pos_for_vel=False, params=None, robot_type="UR5"):
         self.client = client
         self.name = name
+        # settings given in params (e.g. one entry of the ur5_ambf_scheduler.py config) take precedence over the
+        # private ROS params of the node
+        self.params = params if params is not None else {}
         self.base = self.client.get_obj_handle(name + '/base_link')
         self.use_simul_pos_for_vel = use_simul_pos_for_vel
         time.sleep(0.5)
-        self.rate_hz = 120
+        self.rate_hz = self.get_param('rate_hz', 120)
         self.rate = rospy.Rate(self.rate_hz)
+        # joint positions / velocities read once per tick by read_joint_state and shared by everything in run
+        self.js = [0.0] * 6
+        self.jv = [0.0] * 6
+        self.io_count = 0
+        # loop timing: summary on /diagnostics (and printed) every ~diagnostics_period s, trace of the last cycles
+        # written to ~trace_file when the node shuts down
+        self.profiler = LoopProfiler(LOOP_PHASES, self.rate_hz)
+        self.diagnostics_period = self.get_param('diagnostics_period', 5.0)
+        self.trace_file = self.get_param('trace_file', os.path.join(os.path.expanduser('~'), '.ros', name + '_loop_trace.csv'))
+        self.pub_diagnostics = rospy.Publisher("/diagnostics", DiagnosticArray, queue_size=1)
 
         self._T_b_w = None
         self._T_w_b = None
@@ -28,18 +52,112 @@ class UR5_AMBF:
         self.servo_jv_cmd = [0, 0, 0, 0, 0, 0]
         self.servo_jp_cmd = [0, 0, 0, 0, 0, 0]
         self.servo_jp_flag = False
+        self.servo_cp_cmd = None
+        self.servo_cp_flag = False
+        self._ik_solution = None
+        self._ik_failures = 0
+        # active trajectory as (spline, start rospy.Time), replaced as a whole by the callback, and the last
+        # position / velocity commanded from it (start of the next trajectory if one preempts it)
+        self.trajectory = None
+        self.trajectory_setpoint = None
+        self._joint_names = None
         self.pub_measured_js = rospy.Publisher(
             "/ambf/env/"+name+"/measured_js", JointState, queue_size=1)
         self.sub_servo_jp = rospy.Subscriber(
             "/ambf/env/"+name+"/servo_jp", JointState, self.sub_servo_jp_callback)
         self.sub_servo_jv = rospy.Subscriber(
             "/ambf/env/"+name+"/servo_jv", JointState, self.sub_servo_jv_callback)
+        # tip pose in the base frame, resolved by the analytic IK in the loop
+        self.sub_servo_cp = rospy.Subscriber(
+            "/ambf/env/"+name+"/servo_cp", PoseStamped, self.sub_servo_cp_callback)
+        # whole trajectories, interpolated in the loop. A new one preempts the active one, an empty one stops it
+        self.sub_trajectory = rospy.Subscriber(
+            "/ambf/env/"+name+"/trajectory", JointTrajectory, self.sub_trajectory_callback)
+        self.pub_trajectory_state = rospy.Publisher(
+            "/ambf/env/"+name+"/trajectory_state", JointTrajectoryControllerState, queue_size=1)
+        self.pub_trajectory_progress = rospy.Publisher(
+            "/ambf/env/"+name+"/trajectory_progress", Float64, queue_size=1)
         self.pub_measured_cp = rospy.Publisher(
             "/ambf/env/"+name+"/measured_cp", PoseStamped, queue_size=1)
         self.pub_jacobian = rospy.Publisher(
             "/ambf/env/"+name+"/jacobian", Float64MultiArray, queue_size=1)
         # self.run_once = False
-        self.set_dh("UR5")
+        self.set_dh(robot_type)
+        # optional tighter joint limits for the IK (AMBF joint positions, rad)
+        lower = self.get_param('joint_lower_limits', None)
+        upper = self.get_param('joint_upper_limits', None)
+        if lower is not None and upper is not None:
+            self.kinematics.joint_limits = (np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64))
+
+        # messages are allocated once and refilled every time they are published
+        self.measured_js_msg = JointState()
+        self.measured_js_msg.name = 'ur5_ambf'
+        self.measured_cp_msg = PoseStamped()
+        self.jacobian_msg = Float64MultiArray()
+        self.jacobian_msg.layout.dim.append(
+            MultiArrayDimension(label="rows", size=6, stride=1))
+        self.jacobian_msg.layout.dim.append(
+            MultiArrayDimension(label="cols", size=6, stride=6))
+        self.jacobian_msg.layout.data_offset = 0
+        self.trajectory_state_msg = JointTrajectoryControllerState()
+        self.trajectory_progress_msg = Float64()
+
+        # per topic publish rate (Hz, ~<topic>_rate params, default the loop rate, 0 disables the topic). Topics are
+        # published every publish_every[topic] ticks, and only if something is subscribed to them
+        self.publish_every = {}
+        for topic in ('measured_js', 'measured_cp', 'jacobian', 'trajectory_state', 'task_jacobian', 'cm_measured_cp'):
+            topic_rate = self.get_param(topic + '_rate', self.rate_hz)
+            self.publish_every[topic] = max(1, int(round(self.rate_hz / topic_rate))) if topic_rate > 0 else 0
+        self.setup_combined_kinematics()
+        self.tick = 0
+        self.io_total = 0
+        self.last_report = time.perf_counter()
+
+    def setup_combined_kinematics(self):
+        # arm + continuum manipulator task Jacobian at the burr, only with a calibration file (~cm_calibration_file,
+        # the xyzthz_snake_polyfit_coeffs.txt of fit_calibration.py). ~arm_T_cm: arm tip to CM base (snake_stick)
+        # as 16 values (row major) or x, y, z, qx, qy, qz, qw
+        self.combined = None
+        self.cm_length = None
+        calibration_file = self.get_param('cm_calibration_file', '')
+        if not calibration_file:
+            return
+        arm_T_cm = np.eye(4)
+        values = self.get_param('arm_T_cm', None)
+        if values is not None and len(values) == 16:
+            arm_T_cm = np.asarray(values, dtype=np.float64).reshape((4, 4))
+        elif values is not None and len(values) == 7:
+            arm_T_cm = quaternion_to_matrix(values[3:7])
+            arm_T_cm[0:3, 3] = values[0:3]
+        elif values is not None:
+            print(self.name + ": ~arm_T_cm needs 16 or 7 values, using identity")
+        try:
+            lut = CalibrationLUT.from_files(calibration_file, length_range=self.get_param('cm_length_range', DEFAULT_LENGTH_RANGE))
+        except (OSError, ValueError) as e:
+            print(self.name + ": no task Jacobian, could not load " + calibration_file + ": " + str(e))
+            return
+        self.combined = CombinedKinematics(lut, arm_T_cm, self.robot_type)
+        self.sub_cm_bend = rospy.Subscriber(
+            self.get_param('cm_bend_topic', '/ambf/volumetric_drilling/bend_motor/measured_js'), JointState, self.sub_cm_bend_callback)
+        self.pub_task_jacobian = rospy.Publisher(
+            "/ambf/env/"+self.name+"/task_jacobian", Float64MultiArray, queue_size=1)
+        self.pub_cm_measured_cp = rospy.Publisher(
+            "/ambf/env/"+self.name+"/cm_measured_cp", PoseStamped, queue_size=1)
+        self.task_jacobian_msg = Float64MultiArray()
+        self.task_jacobian_msg.layout.dim.append(
+            MultiArrayDimension(label="rows", size=6, stride=1))
+        self.task_jacobian_msg.layout.dim.append(
+            MultiArrayDimension(label="cols", size=NUM_TASK_JOINTS, stride=NUM_TASK_JOINTS))
+        self.cm_measured_cp_msg = PoseStamped()
+
+    def sub_cm_bend_callback(self, msg):  # JointState
+        self.cm_length = msg.position[0]
+
+    def get_param(self, key, default):
+        if key in self.params:
+            return self.params[key]
+        return rospy.get_param('~' + key, default)
+
     # def set_home_pose(self, pose):
     # 	self.T_t_b_home = pose
 
@@ -49,8 +167,8 @@ class UR5_AMBF:
         else:
             return True
 
-    # def get_ik_solution(self):
-    #     return self._ik_solution
+    def get_ik_solution(self):
+        return self._ik_solution
 
     # def get_T_b_w(self):
     # 	self._update_base_pose()
@@ -70,13 +188,17 @@ class UR5_AMBF:
     # 		self._T_w_b = self._T_b_w.Inverse()
     # 		self._base_pose_updated = True
 
-    # def servo_cp(self, T_t_b):
-    #     if type(T_t_b) in [np.matrix, np.array]:
-    #         T_t_b = convert_mat_to_frame(T_t_b)
-
-    #     ik_solution = compute_IK(T_t_b)
-    #     self._ik_solution = enforce_limits(ik_solution)
-    #     self.servo_jp(self._ik_solution)
+    def servo_cp(self, T_t_b):
+        # 4x4 tip transform in the base frame, the IK branch closest to the current joints (self.js) is commanded
+        ik_solution = self.kinematics.ik(T_t_b, self.js)
+        if ik_solution is None:
+            self._ik_failures += 1
+            if self._ik_failures == 1 or self._ik_failures % 100 == 0:
+                print(self.name + ": servo_cp pose not reachable within the joint limits (" + str(self._ik_failures) + " times)")
+            return False
+        self._ik_solution = ik_solution
+        self.servo_jp(ik_solution)
+        return True
 
     # def servo_cv(self, twist):
     #     pass
@@ -85,12 +207,10 @@ class UR5_AMBF:
         if (not self.is_present()):
             return
         # jp = self._joint_error_model.add_to_joints(jp, self._joints_error_mask)
-        self.base.set_joint_pos(0, jp[0])
-        self.base.set_joint_pos(1, jp[1])
-        self.base.set_joint_pos(2, jp[2])
-        self.base.set_joint_pos(3, jp[3])
-        self.base.set_joint_pos(4, jp[4])
-        self.base.set_joint_pos(5, jp[5])
+        # the object handle has no bulk setter, each call only fills the outgoing command message
+        for i in range(6):
+            self.base.set_joint_pos(i, jp[i])
+        self.io_count += 6
 
     def servo_jv(self, jv):
         if self.use_simul_pos_for_vel:
@@ -99,48 +219,49 @@ class UR5_AMBF:
                 # print("p: ", js[i])
                 # print("v: ", jv[i])
                 # print("jp: ", js[i] + jv[i]/self.rate_hz)
-            jp = [p + v/self.rate_hz for p,v in zip(self.measured_js(),jv)]
+            # positions of this tick's snapshot (read_joint_state)
+            jp = [p + v/self.rate_hz for p,v in zip(self.js,jv)]
             self.servo_jp(jp)
             return
         if (not self.is_present()):
             return
-        self.base.set_joint_vel(0, jv[0])
-        self.base.set_joint_vel(1, jv[1])
-        self.base.set_joint_vel(2, jv[2])
-        self.base.set_joint_vel(3, jv[3])
-        self.base.set_joint_vel(4, jv[4])
-        self.base.set_joint_vel(5, jv[5])
-
-    # def measured_cp(self):
-    #     jp = self.measured_js()
-    #     jp.append(0.0)
-    #     return compute_FK(jp, 7)
+        for i in range(6):
+            self.base.set_joint_vel(i, jv[i])
+        self.io_count += 6
+
+    def measured_cp(self):
+        # tip transform of the current joint snapshot
+        FK_T, _ = self.kinematics.fk(self.js)
+        return FK_T.copy()
 
     def measured_js(self):
-        j0 = self.base.get_joint_pos(0)
-        j1 = self.base.get_joint_pos(1)
-        j2 = self.base.get_joint_pos(2)
-        j3 = self.base.get_joint_pos(3)
-        j4 = self.base.get_joint_pos(4)
-        j5 = self.base.get_joint_pos(5)
-        q = [j0, j1, j2, j3, j4, j5]
-        self.js = q
+        # one bulk read if the object handle supports it, otherwise one call per joint
+        if hasattr(self.base, 'get_all_joint_pos'):
+            q = list(self.base.get_all_joint_pos()[0:6])
+            self.io_count += 1
+        else:
+            q = [self.base.get_joint_pos(i) for i in range(6)]
+            self.io_count += 6
         # q = self._joint_error_model.remove_from_joints(q, self._joints_error_mask)
         return q
 
     def measured_jv(self):
-        j0 = self.base.get_joint_vel(0)
-        j1 = self.base.get_joint_vel(1)
-        j2 = self.base.get_joint_vel(2)
-        j3 = self.base.get_joint_vel(3)
-        j4 = self.base.get_joint_vel(4)
-        j5 = self.base.get_joint_vel(5)
-        return [j0, j1, j2, j3, j4, j5]
+        if hasattr(self.base, 'get_all_joint_vel'):
+            self.io_count += 1
+            return list(self.base.get_all_joint_vel()[0:6])
+        self.io_count += 6
+        return [self.base.get_joint_vel(i) for i in range(6)]
+
+    def read_joint_state(self):
+        # per tick snapshot, everything else in the loop uses self.js / self.jv
+        self.js = self.measured_js()
+        self.jv = self.measured_jv()
 
     def get_joint_names(self):
         return self.base.get_joint_names()
 
     def sub_servo_jv_callback(self, msg):  # JointState
+        self.trajectory = None
         self.servo_jv_cmd = msg.velocity
     # self.servo_jv(msg.velocity)
         # if self.run_once:
@@ -152,120 +273,234 @@ class UR5_AMBF:
         # new_js[0]+=np.pi
         # self.servo_jp(new_js)
 
+    def sub_servo_cp_callback(self, msg):  # PoseStamped
+        p, o = msg.pose.position, msg.pose.orientation
+        T = quaternion_to_matrix((o.x, o.y, o.z, o.w))
+        T[0:3, 3] = (p.x, p.y, p.z)
+        self.trajectory = None
+        self.servo_cp_cmd = T
+        self.servo_cp_flag = True
+
     def sub_servo_jp_callback(self, msg):  # JointState
+        self.trajectory = None
         self.servo_jp_cmd = msg.position
         self.servo_jp_flag = True
+
+    def sub_trajectory_callback(self, msg):  # JointTrajectory
+        if not msg.points:
+            if self.trajectory is not None:
+                print(self.name + ": trajectory stopped")
+            self.trajectory = None
+            return
+        order = list(range(6))
+        if msg.joint_names:
+            if self._joint_names is None:
+                self._joint_names = list(self.get_joint_names()[0:6])
+            if sorted(msg.joint_names) != sorted(self._joint_names):
+                print(self.name + ": trajectory joint names " + str(msg.joint_names) + " do not match " + str(self._joint_names))
+                return
+            order = [list(msg.joint_names).index(n) for n in self._joint_names]
+        points = msg.points
+        times = [pt.time_from_start.to_sec() for pt in points]
+        positions = [[pt.positions[j] for j in order] for pt in points]
+        velocities = [[pt.velocities[j] for j in order] for pt in points] if all(len(pt.velocities) for pt in points) else None
+        accelerations = [[pt.accelerations[j] for j in order] for pt in points] if velocities and all(len(pt.accelerations) for pt in points) else None
+        # start from the current setpoint, so preempting a running trajectory does not jump
+        if times[0] > 0:
+            if self.trajectory is not None and self.trajectory_setpoint is not None:
+                p0, v0 = self.trajectory_setpoint
+            else:
+                p0, v0 = list(self.js), [0.0] * 6
+            times.insert(0, 0.0)
+            positions.insert(0, list(p0))
+            if velocities is not None:
+                velocities.insert(0, list(v0))
+            if accelerations is not None:
+                accelerations.insert(0, [0.0] * 6)
+        try:
+            spline = JointTrajectorySpline(times, positions, velocities, accelerations)
+        except (ValueError, IndexError) as e:
+            print(self.name + ": rejected trajectory: " + str(e))
+            return
+        start = msg.header.stamp if not msg.header.stamp.is_zero() else rospy.Time.now()
+        # the loop holds position once the trajectory is done
+        self.servo_jv_cmd = [0.0] * 6
+        self.trajectory = (spline, start)
     # self.servo_jp(msg.position)
 
-    def publish_measured_js(self):
-        msg = JointState()
-        msg.name = 'ur5_ambf'
-        msg.position = self.measured_js()
-        msg.header.stamp = rospy.Time.now()
+    def should_publish(self, topic, publisher):
+        every = self.publish_every[topic]
+        return every > 0 and self.tick % every == 0 and publisher.get_num_connections() > 0
+
+    def publish_measured_js(self, stamp=None):
+        msg = self.measured_js_msg
+        msg.position = self.js
+        msg.velocity = self.jv
+        msg.header.stamp = stamp if stamp is not None else rospy.Time.now()
         self.pub_measured_js.publish(msg)
 
+    def step(self, stamp=None):
+        """One tick of the control loop. stamp: time put on the published messages (default now)"""
+        profiler = self.profiler
+        profiler.start_cycle()
+        self.io_count = 0
+        if not self.is_present():
+            self.base = self.client.get_obj_handle(
+                self.name + '/base_link')
+            print("Tried to reconnect")
+        self.read_joint_state()
+        profiler.mark('read')
+
+        publish_cp = self.should_publish('measured_cp', self.pub_measured_cp)
+        publish_jacobian = self.should_publish('jacobian', self.pub_jacobian)
+        publish_task = False
+        if self.combined is not None and self.cm_length is not None:
+            publish_task_jacobian = self.should_publish('task_jacobian', self.pub_task_jacobian)
+            publish_cm_cp = self.should_publish('cm_measured_cp', self.pub_cm_measured_cp)
+            publish_task = publish_task_jacobian or publish_cm_cp
+        if publish_cp or publish_jacobian or publish_task:
+            FK_T, jac = self.kinematics.fk(self.js)
+        if publish_task:
+            burr_T, task_jac = self.combined.compose(FK_T, jac, self.cm_length)
+        profiler.mark('fk')
+
+        if self.should_publish('measured_js', self.pub_measured_js):
+            self.publish_measured_js(stamp)
+        if publish_cp or publish_jacobian:
+            self.publish_FK(FK_T, jac, publish_cp, publish_jacobian, stamp)
+        if publish_task:
+            self.publish_task(burr_T, task_jac, publish_cm_cp, publish_task_jacobian, stamp)
+        profiler.mark('publish')
+
+        trajectory = self.trajectory
+        if self.servo_cp_flag:
+            self.servo_cp_flag = False
+            self.servo_cp(self.servo_cp_cmd)
+        elif self.servo_jp_flag:
+            self.servo_jp(self.servo_jp_cmd)
+            self.servo_jp_flag = False
+        elif trajectory is not None:
+            self.follow_trajectory(trajectory, stamp)
+        else:
+            self.servo_jv(self.servo_jv_cmd)
+        profiler.mark('command')
+        profiler.end_cycle()
+
+        self.io_total += self.io_count
+        now = time.perf_counter()
+        if self.diagnostics_period > 0 and now - self.last_report >= self.diagnostics_period:
+            self.publish_diagnostics(profiler.summary(), self.io_total, now - self.last_report)
+            self.io_total = 0
+            self.last_report = now
+        self.tick += 1
+
+    def publish_task(self, burr_T, task_jac, publish_cp=True, publish_jacobian=True, stamp=None):
+        # burr pose and 6x7 task Jacobian (arm joints, then cable length) in the arm base frame
+        if publish_cp:
+            msg = self.cm_measured_cp_msg
+            msg.header.stamp = stamp if stamp is not None else rospy.Time.now()
+            (msg.pose.position.x, msg.pose.position.y, msg.pose.position.z) = burr_T[0:3, 3]
+            (msg.pose.orientation.x, msg.pose.orientation.y,
+             msg.pose.orientation.z, msg.pose.orientation.w) = rotation_to_quaternion(burr_T)
+            self.pub_cm_measured_cp.publish(msg)
+        if publish_jacobian:
+            self.task_jacobian_msg.data = task_jac.reshape((6 * NUM_TASK_JOINTS,))
+            self.pub_task_jacobian.publish(self.task_jacobian_msg)
+
+    def follow_trajectory(self, trajectory, stamp=None):
+        spline, start = trajectory
+        now = stamp if stamp is not None else rospy.Time.now()
+        t = (now - start).to_sec()
+        position, velocity, done = spline.sample(t)
+        self.servo_jp(position)
+        self.trajectory_setpoint = (position.copy(), velocity.copy())
+        if done or self.should_publish('trajectory_state', self.pub_trajectory_state):
+            self.publish_trajectory_state(now, t, position, velocity, spline.progress(t))
+        if done:
+            # unless a new trajectory replaced it meanwhile
+            if self.trajectory is trajectory:
+                self.trajectory = None
+            print(self.name + ": trajectory done ({:.2f} s)".format(spline.duration))
+
+    def publish_trajectory_state(self, now, t, position, velocity, progress):
+        msg = self.trajectory_state_msg
+        msg.header.stamp = now
+        if self._joint_names is not None:
+            msg.joint_names = self._joint_names
+        msg.desired.positions = position.tolist()
+        msg.desired.velocities = velocity.tolist()
+        msg.desired.time_from_start = rospy.Duration.from_sec(max(t, 0.0))
+        msg.actual.positions = self.js
+        msg.actual.velocities = self.jv
+        msg.error.positions = [d - a for d, a in zip(msg.desired.positions, self.js)]
+        msg.error.velocities = [d - a for d, a in zip(msg.desired.velocities, self.jv)]
+        self.pub_trajectory_state.publish(msg)
+        self.trajectory_progress_msg.data = progress
+        self.pub_trajectory_progress.publish(self.trajectory_progress_msg)
+
     def run(self):
+        rospy.on_shutdown(self.dump_trace)
+        self.last_report = time.perf_counter()
         while not rospy.is_shutdown():
-            if not self.is_present():
-                self.base = self.client.get_obj_handle(
-                    self.name + '/base_link')
-                print("Tried to reconnect")
-            self.publish_measured_js()
-            self.FK(self.measured_js())
-            if self.servo_jp_flag:
-                self.servo_jp(self.servo_jp_cmd)
-                self.servo_jp_flag = False
-            else:
-                self.servo_jv(self.servo_jv_cmd)
-
+            self.step()
             self.rate.sleep()
 
-    # Below is from https://github.com/ShahriarSefati/robot-constrained-control/blob/master/cmc_kinematics.py
+    def publish_diagnostics(self, stats, io_total, window):
+        cycles = max(stats['cycles'], 1)
+        status = DiagnosticStatus()
+        status.name = self.name + " control loop"
+        status.hardware_id = self.name
+        status.level = DiagnosticStatus.WARN if stats['overruns'] else DiagnosticStatus.OK
+        status.message = f"{stats['cycles'] / window:.0f} Hz (target {self.rate_hz} Hz), {stats['overruns']} overruns"
+        status.values.append(KeyValue(key="cycles", value=str(stats['cycles'])))
+        status.values.append(KeyValue(key="overruns", value=str(stats['overruns'])))
+        status.values.append(KeyValue(key="joint I/O per cycle", value=f"{io_total / cycles:.1f}"))
+        for name in LOOP_PHASES + ('cycle', 'jitter'):
+            for p in ('p50', 'p99', 'max'):
+                status.values.append(KeyValue(key=f"{name} {p} (ms)", value=f"{stats[name][p] * 1e3:.4f}"))
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        msg.status.append(status)
+        self.pub_diagnostics.publish(msg)
+        print(self.name + ": " + status.message + f", {io_total / cycles:.1f} joint I/O calls per cycle\n" + format_summary(stats))
+
+    def dump_trace(self):
+        if self.trace_file and self.profiler.total_cycles:
+            rows = self.profiler.dump_csv(self.trace_file)
+            print(f"{self.name}: wrote {rows} cycle timings to {self.trace_file}")
+
+    # Kinematics originally from https://github.com/ShahriarSefati/robot-constrained-control/blob/master/cmc_kinematics.py
     # Would be best to just do this straight from AMBF or defn files using pykdl or others. However, I beleive jacobian defns are different
 
     def set_dh(self, robot_type):
-        if robot_type == 'UR5':
-            # HTP - changes to DH here go to end effector, instead of to the origin of wrist_3_link
-            self.d = np.array([0.089159, 0, 0, 0.10915, 0.09465, 0.0823])
-            # self.d = np.array([0.089159, 0, 0, 0.10915, 0.09465, 0.0823+0.0750998])
-            self.a = np.array([0, -0.425, -0.39225, 0, 0, 0])
-            # self.alph = np.array([np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, 0])
-            self.alph = np.array(
-                [np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, np.pi/2])
-
-        if robot_type == 'UR10':
-            self.d = np.array(
-                [0.1273, 0, 0, 0.163941, 0.1157, 0.0922])              # UR10
-            self.a = np.array([0, -0.612, -0.5723, 0, 0, 0]
-                              )                         # UR10
-            self.alph = np.array(
-                [np.pi / 2, 0, 0, np.pi / 2, -np.pi / 2, 0])                 # UR10
-
-    def AH(self, n, th):
-        T_a = np.identity(4)
-        T_a[0, 3] = self.a[n]
-        T_d = np.identity(4)
-        T_d[2, 3] = self.d[n]
-
-        Rzt = np.array([[np.cos(th[n]), -np.sin(th[n]), 0, 0],
-                        [np.sin(th[n]), np.cos(th[n]), 0, 0],
-                        [0, 0, 1, 0],
-                        [0, 0, 0, 1]])
-
-        Rxa = np.array([[1, 0, 0, 0],
-                        [0, np.cos(self.alph[n]), -np.sin(self.alph[n]), 0],
-                        [0, np.sin(self.alph[n]), np.cos(self.alph[n]), 0],
-                        [0, 0, 0, 1]])
-
-        return T_d @ Rzt @ T_a @ Rxa
-
-    def FK(self, th):
-        th[0] -= np.pi  # This accounts for an offset in the definitions
-        FK_T = np.eye(4)  # Starting the transformations
-        Origins_T = []         # Storing the transformations from base to each joint
-
-        for (i, t) in enumerate(th):
-            Origins_T.append(FK_T)
-            FK_T = FK_T @ self.AH(i, th)
-
-        # compute Jacobian
-        jac = np.zeros((6, 6))
-        tip = FK_T[0:3, 3]
-
-        for (k, origin) in enumerate(Origins_T):
-            z_joint = origin[0:3, 2]  # 3rd column of the rotation part
-            # 4th column of the transformation (translation component)
-            o_joint = origin[0:3, 3]
-
-            jac[0:3, k] = np.cross(z_joint, (tip - o_joint))
-            jac[3:6, k] = z_joint
-
-        fk_msg = PoseStamped()
-        fk_msg.header.stamp = rospy.Time.now()
-        # fk_msg.pose.position = FK_T[0:3,3]
-        (fk_msg.pose.position.x, fk_msg.pose.position.y,
-         fk_msg.pose.position.z) = FK_T[0:3, 3]
-
-        q = Rotation.from_matrix(FK_T[0:3, 0:3]).as_quat()  # x,y,z,w
-
-        (fk_msg.pose.orientation.x, fk_msg.pose.orientation.y,
-         fk_msg.pose.orientation.z, fk_msg.pose.orientation.w) = q
-        self.pub_measured_cp.publish(fk_msg)
-
-        jac_msg = Float64MultiArray()
-        jac_msg.layout
-        jac_msg.layout.dim.append(
-            MultiArrayDimension(label="rows", size=6, stride=1))
-        jac_msg.layout.dim.append(
-            MultiArrayDimension(label="cols", size=6, stride=6))
-        jac_msg.layout.data_offset = 0
-        jac_msg.data = jac.reshape((36,))
-        # print(jac_msg)
-        self.pub_jacobian.publish(jac_msg)
-        # print(FK_T)
-        # print(jac)
+        # DH parameters of the UR5 / UR10 are in ur_kinematics.UR_DH
+        self.robot_type = robot_type
+        self.d, self.a, self.alph = UR_DH[robot_type]
+        self.kinematics = URKinematics(robot_type)
+
+    def FK(self, th, publish_cp=True, publish_jacobian=True):
+        # closed form, writes into preallocated buffers (see ur_kinematics.py), FK_T and jac are overwritten next call
+        FK_T, jac = self.kinematics.fk(th)
+        self.publish_FK(FK_T, jac, publish_cp, publish_jacobian)
         return FK_T, jac
 
+    def publish_FK(self, FK_T, jac, publish_cp=True, publish_jacobian=True, stamp=None):
+        if publish_cp:
+            fk_msg = self.measured_cp_msg
+            fk_msg.header.stamp = stamp if stamp is not None else rospy.Time.now()
+            (fk_msg.pose.position.x, fk_msg.pose.position.y,
+             fk_msg.pose.position.z) = FK_T[0:3, 3]
+
+            q = rotation_to_quaternion(FK_T)  # x,y,z,w
+
+            (fk_msg.pose.orientation.x, fk_msg.pose.orientation.y,
+             fk_msg.pose.orientation.z, fk_msg.pose.orientation.w) = q
+            self.pub_measured_cp.publish(fk_msg)
+
+        if publish_jacobian:
+            self.jacobian_msg.data = jac.reshape((36,))
+            self.pub_jacobian.publish(self.jacobian_msg)
+
 
 if __name__ == "__main__":
     # Create a instance of the client
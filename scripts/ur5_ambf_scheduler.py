@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import asyncio
+import sys
+import time
+from argparse import ArgumentParser
+import numpy as np
+import yaml
+from ambf_client import Client
+import rospy
+from ur5_ambf import UR5_AMBF
+from continuum_manip_volumetric_drilling_plugin.tick_scheduler import TickScheduler, report_periodically, \
+    format_scheduler_summary
+
+# Several arm bridges in one process, sharing one AMBF client (and ROS node):
+#   rosrun continuum_manip_volumetric_drilling_plugin ur5_ambf_scheduler.py -c launch/ur5_ambf_bridges.yaml
+# The config holds a list of bridges, each ticked at its own rate by one asyncio loop (see tick_scheduler.py):
+#   client_name: ambf_arms
+#   bridges:
+#     - name: ur5             # AMBF model namespace, topics go to /ambf/env/<name>/...
+#       robot: UR5            # DH parameters, UR5 or UR10
+#       rate_hz: 120
+#       home: [0.0, -1.0, 1.0, 0.0, -0.3927, 3.1416]   # optional servo_jp sent once the model is loaded
+#       measured_cp_rate: 60  # any other UR5_AMBF param (the private ~params of ur5_ambf.py)
+# Messages published by bridges ticked in the same wake up get the same stamp.
+
+BRIDGE_TYPES = {'UR5_AMBF': UR5_AMBF}
+
+
+def load_config(filename):
+    with open(filename) as f:
+        config = yaml.safe_load(f) or {}
+    bridges = config.get('bridges')
+    if not bridges:
+        raise ValueError(filename + ": no bridges listed")
+    names = [b.get('name') for b in bridges]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError(filename + ": every bridge needs a unique name")
+    for b in bridges:
+        if b.get('type', 'UR5_AMBF') not in BRIDGE_TYPES:
+            raise ValueError(f"{filename}: unknown bridge type {b['type']} of {b['name']}")
+    return config
+
+
+def create_bridges(client, bridge_configs):
+    bridges = []
+    for b in bridge_configs:
+        params = {k: v for k, v in b.items() if k not in ('name', 'type', 'robot', 'home', 'use_simul_pos_for_vel')}
+        bridges.append(BRIDGE_TYPES[b.get('type', 'UR5_AMBF')](
+            client, b['name'], b.get('use_simul_pos_for_vel', False), params, b.get('robot', 'UR5')))
+    return bridges
+
+
+def connect(client_name, bridge_configs):
+    while not rospy.is_shutdown():
+        client = Client(client_name)
+        client.connect()
+        bridges = create_bridges(client, bridge_configs)
+        missing = [b.name for b in bridges if b.base is None]
+        if not missing:
+            print("Found AMBF client and loaded " + ", ".join(b.name for b in bridges))
+            return client, bridges
+        print("Assuming ambf client still loading (missing " + ", ".join(missing) + ") and waiting...")
+        client.clean_up()
+        time.sleep(0.5)
+    return None, []
+
+
+def main():
+    parser = ArgumentParser(description="Run several AMBF arm bridges in one process with one AMBF client")
+    parser.add_argument('-c', '--config', action='store', dest='config', required=True,
+                        help='YAML file with the list of bridges')
+    parser.add_argument('--report-period', action='store', dest='report_period', type=float, default=10.0,
+                        help='Seconds between scheduler summaries (0 disables them)')
+    parsed_args, _ = parser.parse_known_args(rospy.myargv()[1:])
+
+    try:
+        config = load_config(parsed_args.config)
+    except (OSError, ValueError, yaml.YAMLError) as e:
+        sys.exit("Error: " + str(e))
+    bridge_configs = config['bridges']
+
+    client, bridges = connect(config.get('client_name', 'ambf_arms'), bridge_configs)
+    if client is None:
+        return
+    for bridge, b in zip(bridges, bridge_configs):
+        while bridge.base.get_num_joints() < 6:
+            if rospy.is_shutdown():
+                client.clean_up()
+                return
+            print("Waiting for " + bridge.name + " model to load...")
+            time.sleep(0.5)
+        if 'home' in b:
+            bridge.servo_jp(np.asarray(b['home'], dtype=np.float64))
+        rospy.on_shutdown(bridge.dump_trace)
+    print("Loaded " + ", ".join(f"{bridge.name} ({bridge.rate_hz} Hz)" for bridge in bridges))
+    time.sleep(2.0)  # let the move commands finish
+
+    scheduler = TickScheduler(clock=rospy.Time.now)
+    for bridge in bridges:
+        scheduler.add(bridge.name, bridge.step, bridge.rate_hz)
+
+    def report(stats, window):
+        print("scheduler, last {:.1f} s:\n".format(window) + format_scheduler_summary(stats, window))
+
+    async def run_all():
+        if parsed_args.report_period > 0:
+            # left pending when the scheduler returns, asyncio.run cancels it
+            asyncio.ensure_future(report_periodically(scheduler, parsed_args.report_period, report, rospy.is_shutdown))
+        await scheduler.run(rospy.is_shutdown)
+
+    try:
+        asyncio.run(run_all())
+    finally:
+        client.clean_up()
+
+
+if __name__ == '__main__':
+    main()